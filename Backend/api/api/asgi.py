@@ -1,3 +1,4 @@
+import atexit
 import os
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api.settings')
@@ -7,9 +8,13 @@ from django.core.asgi import get_asgi_application
 django_asgi_app = get_asgi_application()
 
 from channels.routing import ProtocolTypeRouter, URLRouter
+from core.engine import engine
 from core.ws_auth import JWTAuthMiddlewareStack
 import core.routing
 
+# Rooms idle since their last move still hold state the database has not seen.
+atexit.register(engine.flush_all)
+
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": JWTAuthMiddlewareStack(
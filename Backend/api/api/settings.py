@@ -88,6 +88,47 @@ DATABASES = {
     }
 }
 
+# SQLITE_CONCURRENT=true tunes SQLite for a single box with concurrent
+# writers: WAL lets reads run alongside the writer, and IMMEDIATE transactions
+# take the write lock up front so they wait on busy_timeout instead of
+# failing when a read lock cannot be upgraded. Applied by core.sqlite.
+SQLITE_PRAGMAS = {}
+if os.getenv("SQLITE_CONCURRENT", "").lower() in {"1", "true", "yes"}:
+    DATABASES['default']['OPTIONS'] = {
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "20000")) / 1000,
+    }
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+        'busy_timeout': int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "20000")),
+        'mmap_size': int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    }
+
+# DB_ENGINE=postgres switches to PostgreSQL for production. Connections are
+# kept open and health-checked between requests, or, with DB_POOL=true
+# (psycopg 3), shared from a pool by the consumer and request threads.
+if os.getenv("DB_ENGINE", "sqlite").lower() in {"postgres", "postgresql"}:
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv("POSTGRES_DB", "backbenchers"),
+        'USER': os.getenv("POSTGRES_USER", "postgres"),
+        'PASSWORD': os.getenv("POSTGRES_PASSWORD", ""),
+        'HOST': os.getenv("POSTGRES_HOST", "127.0.0.1"),
+        'PORT': os.getenv("POSTGRES_PORT", "5432"),
+        'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", "60")),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
+    }
+    if os.getenv("DB_POOL", "").lower() in {"1", "true", "yes"}:
+        # Pooling replaces persistent connections; Django rejects both at once.
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+            'max_size': int(os.getenv("DB_POOL_MAX_SIZE", "20")),
+            'timeout': int(os.getenv("DB_POOL_TIMEOUT", "10")),
+        }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -140,8 +181,34 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=900),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'AUTH_HEADER_TYPES': ('Bearer',),
+    'TOKEN_OBTAIN_SERIALIZER': 'core.serializers.UsernameTokenObtainPairSerializer',
 }
 
+# Off by default: WebSocket connects load the user (cached for 30 seconds).
+# Turned on, they trust the access token's claims and skip that query, but a
+# deleted or deactivated user keeps socket access until the token expires,
+# which with the 900-minute ACCESS_TOKEN_LIFETIME above is up to 15 hours.
+WS_TRUST_TOKEN_CLAIMS = os.getenv("WS_TRUST_TOKEN_CLAIMS", "false").lower() in {"1", "true", "yes"}
+
+# Threads for the consumers' database writes; each room sticks to one.
+# SQLite only takes parallel writers in SQLITE_CONCURRENT (IMMEDIATE) mode,
+# so it defaults to one and core.writers refuses more without that mode.
+_PARALLEL_WRITES = DATABASES['default']['ENGINE'] != 'django.db.backends.sqlite3' or (
+    DATABASES['default'].get('OPTIONS', {}).get('transaction_mode') == 'IMMEDIATE'
+)
+ROOM_WRITE_THREADS = int(os.getenv("ROOM_WRITE_THREADS", "4" if _PARALLEL_WRITES else "1"))
+
+# JSON codec for WebSocket frames: "auto" (orjson, then ujson, then json),
+# or one of "orjson", "ujson", "json".
+WS_JSON_CODEC = os.getenv("WS_JSON_CODEC", "auto")
+
+# Per-action wall time, lock wait, query count and bytes for the room
+# consumers, scraped from /metrics/ with METRICS_TOKEN as a bearer token.
+# SLOW_ACTION_MS then also logs every action at least that slow.
+ACTION_METRICS = os.getenv("ACTION_METRICS", "").lower() in {"1", "true", "yes"}
+SLOW_ACTION_MS = int(os.environ["SLOW_ACTION_MS"]) if os.getenv("SLOW_ACTION_MS") else None
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
 if os.getenv("USE_REDIS_CHANNEL_LAYER", "").lower() in {"1", "true", "yes"}:
     CHANNEL_LAYERS = {
         "default": {
@@ -151,6 +218,11 @@ if os.getenv("USE_REDIS_CHANNEL_LAYER", "").lower() in {"1", "true", "yes"}:
             },
         },
     }
+    # Workers sharing the channel layer also share turn deadline and room owner
+    # leases; a started Bingo room's moves are forwarded to its owner.
+    # Matchmaking queues stay per process: run /ws/matchmaking/ on one worker.
+    TURN_LEASE_REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/1")
+    LEADERBOARD_REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/1")
 else:
     # Local dev fallback so WebSocket works without Redis.
     CHANNEL_LAYERS = {
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Profile, Room, RoomPlayer
+from .models import ArchivedRoom, GameResult, GameResultPlayer, Profile, Room, RoomPlayer
 
 
 @admin.register(Profile)
@@ -13,6 +13,14 @@ class RoomAdmin(admin.ModelAdmin):
     list_display = ("room_id", "owner", "status", "max_players", "current_turn_player", "created_at")
     list_filter = ("status", "created_at")
     search_fields = ("room_id", "owner__username")
+    ordering = ("-created_at",)
+
+
+@admin.register(ArchivedRoom)
+class ArchivedRoomAdmin(admin.ModelAdmin):
+    list_display = ("room_id", "game_type", "owner", "created_at", "ended_at", "archived_at")
+    list_filter = ("game_type", "ended_at")
+    search_fields = ("room_id",)
 
 
 @admin.register(RoomPlayer)
@@ -20,3 +28,16 @@ class RoomPlayerAdmin(admin.ModelAdmin):
     list_display = ("room", "user", "turn_order", "status", "lines_completed", "rank", "joined_at")
     list_filter = ("status", "room__status")
     search_fields = ("room__room_id", "user__username")
+
+
+class GameResultPlayerInline(admin.TabularInline):
+    model = GameResultPlayer
+    extra = 0
+
+
+@admin.register(GameResult)
+class GameResultAdmin(admin.ModelAdmin):
+    list_display = ("id", "room", "game_type", "finished_at", "aggregated_at")
+    list_filter = ("game_type", "finished_at")
+    search_fields = ("room__room_id",)
+    inlines = [GameResultPlayerInline]
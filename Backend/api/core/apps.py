@@ -2,4 +2,9 @@ from django.apps import AppConfig
 
 
 class CoreConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from . import leaderboard  # noqa: F401  (connects the leaderboard signals)
+        from . import sqlite  # noqa: F401  (connects the SQLite pragma hook)
@@ -1,24 +1,65 @@
-def calculate_completed_lines(board_numbers, eliminated_numbers):
-    if len(board_numbers) != 25:
-        return 0
+def _line_mask(cells):
+    mask = 0
+    for cell in cells:
+        mask |= 1 << cell
+    return mask
+
+
+# Cell ``row * 5 + col`` of a board maps to bit ``row * 5 + col``.
+LINE_MASKS = (
+    *(_line_mask(row * 5 + col for col in range(5)) for row in range(5)),
+    *(_line_mask(row * 5 + col for row in range(5)) for col in range(5)),
+    _line_mask(i * 5 + i for i in range(5)),
+    _line_mask(i * 5 + (4 - i) for i in range(5)),
+)
+
+# Only the lines passing through a cell can be completed by marking it.
+CELL_LINE_MASKS = tuple(
+    tuple(mask for mask in LINE_MASKS if mask >> cell & 1)
+    for cell in range(25)
+)
+
+
+def count_lines(marked):
+    return sum(1 for mask in LINE_MASKS if marked & mask == mask)
 
-    marked = set(eliminated_numbers)
-    lines = 0
 
-    # Rows
-    for row in range(5):
-        if all(board_numbers[row * 5 + col] in marked for col in range(5)):
-            lines += 1
+class BingoBoard:
+    __slots__ = ("positions", "marked", "completed")
 
-    # Columns
-    for col in range(5):
-        if all(board_numbers[row * 5 + col] in marked for row in range(5)):
-            lines += 1
+    def __init__(self, board_numbers, called_numbers=()):
+        self.positions = {number: cell for cell, number in enumerate(board_numbers)}
+        self.marked = 0
+        self.completed = 0
+        for number in called_numbers:
+            self.mark(number)
 
-    # Diagonals
-    if all(board_numbers[i * 5 + i] in marked for i in range(5)):
-        lines += 1
-    if all(board_numbers[i * 5 + (4 - i)] in marked for i in range(5)):
-        lines += 1
+    def mark(self, number):
+        cell = self.positions.get(number)
+        if cell is None:
+            return 0
+
+        bit = 1 << cell
+        if self.marked & bit:
+            return 0
+
+        marked = self.marked | bit
+        self.marked = marked
+        new_lines = 0
+        for mask in CELL_LINE_MASKS[cell]:
+            if marked & mask == mask:
+                new_lines += 1
+        self.completed += new_lines
+        return new_lines
+
+
+def calculate_completed_lines(board_numbers, eliminated_numbers):
+    if len(board_numbers) != 25:
+        return 0
 
-    return lines
+    eliminated = set(eliminated_numbers)
+    marked = 0
+    for cell, number in enumerate(board_numbers):
+        if number in eliminated:
+            marked |= 1 << cell
+    return count_lines(marked)
@@ -0,0 +1,110 @@
+import itertools
+import threading
+import time
+import uuid
+
+
+class TTLCache:
+    """Small per-process cache whose entries expire after ``ttl`` seconds.
+
+    Oldest entries are dropped first once ``max_entries`` is reached.
+    """
+
+    def __init__(self, ttl, max_entries=10000, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        if entry[0] <= self.clock():
+            self.delete(key)
+            return default
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data.pop(key, None)
+            while len(self._data) >= self.max_entries:
+                self._data.pop(next(iter(self._data)))
+            self._data[key] = (expires_at, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SnapshotCache:
+    """Latest snapshot of each room, tagged with the room's state version.
+
+    Every mutation bumps the version with ``invalidate``. A build only lands
+    if the version it started from is still current, so a build racing a move
+    cannot leave stale data behind.
+    """
+
+    def __init__(self, max_rooms=10000):
+        self.max_rooms = max_rooms
+        # Tags group events so other processes know to drop their copy.
+        self.origin = uuid.uuid4().hex
+        self._rooms = {}
+        self._versions = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _evict(self):
+        while len(self._rooms) >= self.max_rooms:
+            self._rooms.pop(next(iter(self._rooms)))
+
+    def version(self, room_id):
+        entry = self._rooms.get(room_id)
+        return entry[0] if entry else 0
+
+    def get(self, room_id):
+        entry = self._rooms.get(room_id)
+        return entry[1] if entry else None
+
+    def invalidate(self, room_id):
+        with self._lock:
+            self._rooms.pop(room_id, None)
+            self._evict()
+            version = next(self._versions)
+            self._rooms[room_id] = [version, None, None]
+        return version
+
+    def set(self, room_id, version, snapshot):
+        with self._lock:
+            entry = self._rooms.get(room_id)
+            if (entry[0] if entry else 0) != version:
+                return False
+            if entry is None:
+                self._evict()
+                self._rooms[room_id] = [version, snapshot, None]
+            else:
+                entry[1] = snapshot
+            return True
+
+    def frame(self, room_id, snapshot, encode):
+        # The encoded room_snapshot message, built once per cached snapshot.
+        message = {"type": "room_snapshot", "data": snapshot}
+        entry = self._rooms.get(room_id)
+        if entry is None or entry[1] is not snapshot:
+            return encode(message)
+        if entry[2] is None:
+            entry[2] = encode(message)
+        return entry[2]
+
+
+# Membership is never revoked, so "is a player" can be kept longer than
+# "is not a player yet", which a join in another worker can make stale.
+MEMBER_TTL_SECONDS = 60
+NON_MEMBER_TTL_SECONDS = 5
+
+room_members = TTLCache(MEMBER_TTL_SECONDS)
+snapshots = SnapshotCache()
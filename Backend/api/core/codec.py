@@ -0,0 +1,47 @@
+import json
+
+from django.conf import settings
+
+
+def _json_dumps(content):
+    # Non-ASCII text stays as is, like the other two codecs write it.
+    return json.dumps(content, separators=(",", ":"), ensure_ascii=False)
+
+
+def _ujson_dumps():
+    import ujson
+
+    return lambda content: ujson.dumps(content, ensure_ascii=False)
+
+
+def _orjson_dumps():
+    import orjson
+
+    return lambda content: orjson.dumps(content).decode()
+
+
+_CODECS = {
+    "orjson": _orjson_dumps,
+    "ujson": _ujson_dumps,
+    "json": lambda: _json_dumps,
+}
+
+
+def get_dumps(name=None):
+    """Return ``dumps(content) -> str`` for WebSocket text frames.
+
+    ``auto`` takes the fastest codec that is installed, falling back to the
+    standard library.
+    """
+    name = name or getattr(settings, "WS_JSON_CODEC", "auto")
+    if name != "auto":
+        return _CODECS[name]()
+    for candidate in ("orjson", "ujson"):
+        try:
+            return _CODECS[candidate]()
+        except ImportError:
+            continue
+    return _json_dumps
+
+
+dumps = get_dumps()
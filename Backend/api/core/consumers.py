@@ -1,18 +1,49 @@
 import asyncio
+import json
+import logging
 import random
-from datetime import timedelta
+import time
+from datetime import datetime, timedelta
+from functools import partial
+from urllib.parse import parse_qs
 
-from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.layers import get_channel_layer
 from django.db import transaction
 from django.utils import timezone
 
-from .bingo import calculate_completed_lines
-from .models import GameStatus, PlayerStatus, Profile, Room, RoomPlayer
+from .cache import NON_MEMBER_TTL_SECONDS, room_members, snapshots
+from .codec import dumps
+from .engine import FLUSH_INTERVAL_SECONDS, TURN_SECONDS, StaleRoomState, engine
+from .leases import RoomOwnedElsewhere, leases, owners
+from .lobby import lobby_group, publish_closed
+from .matchmaking import match_group, matchmaker
+from .metrics import actions, add_sent, mark_error
+from .models import GameStatus, GameType, PlayerStatus, Room, RoomPlayer
+from .queues import commands
+from .replay import replay
+from .results import DRAW, LOSS, WIN, aggregator, log_game_result
+from .rooms import room_read_queryset
+from .spectators import spectator_group, spectator_view, spectators
+from .timers import scheduler
+from .writers import room_write
+
+logger = logging.getLogger(__name__)
+
+# A socket that got the current snapshot this recently is not sent it again.
+ROOM_STATE_COALESCE_SECONDS = 0.5
+FLUSH_RETRY_SECONDS = 2.0
 
 
 class BingoRoomConsumer(AsyncJsonWebsocketConsumer):
-    _timer_tasks = {}
+    game_type = GameType.BINGO
+    metrics_game = "bingo"
+    # In-flight snapshot builds by group, shared by every socket in the process.
+    _snapshot_builds = {}
+    # Open player sockets by group in this process.
+    _group_sockets = {}
+    _sent_snapshot = None
+    _sent_at = 0.0
 
     @staticmethod
     def group_name(room_id):
@@ -32,83 +63,375 @@ class BingoRoomConsumer(AsyncJsonWebsocketConsumer):
             return
 
         await self.channel_layer.group_add(self.group, self.channel_name)
+        self._group_sockets[self.group] = self._group_sockets.get(self.group, 0) + 1
+        self._joined = True
         await self.accept()
+        aggregator.ensure_running()
+        if self.game_type == GameType.BINGO:
+            await owners.listen(self.channel_layer, BingoRoomConsumer._run_forwarded)
+            checkpoints.ensure_running()
+
+        # A reconnecting client passes the epoch and last seq it saw and gets
+        # only what it missed, unless the buffer no longer reaches back that
+        # far or the room's numbering has started over since.
+        missed = replay.since(self.room_id, *self._resume_point())
+        if missed is None:
+            snapshot = await self._room_snapshot(self.room_id)
+            await self._send_snapshot(snapshot)
+            await self._schedule_timeout_if_needed(snapshot)
+            return
 
-        snapshot = await self._room_snapshot(self.room_id)
-        await self.send_json({"type": "room_snapshot", "data": snapshot})
-        await self._schedule_timeout_if_needed(snapshot)
+        for text in missed:
+            await self.send(text_data=text)
+        # This worker may be the first to see the room since a restart, so
+        # the turn timer is armed here too, without building a snapshot.
+        turn = self._replayed_turn()
+        if turn is not None:
+            await self._schedule_timeout_if_needed(turn)
+
+    def _replayed_turn(self):
+        # The local engine holds the current turn; otherwise the newest event
+        # in the buffer does.
+        state = engine.get(self.room_id)
+        if state is not None:
+            return state.turn()
+        text = replay.latest(self.room_id)
+        return self._event_data(json.loads(text)) if text is not None else None
+
+    def _resume_point(self):
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        try:
+            return query["epoch"][0], int(query["last_seq"][0])
+        except (KeyError, ValueError):
+            return None, -1
 
     async def disconnect(self, close_code):
-        if hasattr(self, "group"):
-            await self.channel_layer.group_discard(self.group, self.channel_name)
+        if not getattr(self, "_joined", False):
+            return
+        await self.channel_layer.group_discard(self.group, self.channel_name)
+        remaining = self._group_sockets.pop(self.group, 1) - 1
+        if remaining:
+            self._group_sockets[self.group] = remaining
+        elif self.game_type == GameType.BINGO and engine.get(self.room_id) is not None:
+            await commands.run(self.group, partial(self._hand_off, self.room_id))
 
     async def receive_json(self, content, **kwargs):
+        # A socket's messages are handled one at a time, so a repeated
+        # room_state only needs checking against the snapshot last sent.
+        if content.get("action") == "room_state" and self._has_current_snapshot():
+            return
+        await actions.run(
+            self.metrics_game,
+            content.get("action"),
+            partial(commands.run, self.group, partial(self._handle_action, content)),
+        )
+
+    async def _handle_action(self, content):
         action = content.get("action")
         user = self.scope["user"]
         try:
-            if action == "start_game":
-                payload = await self._start_game(self.room_id, user.id)
-                await self.channel_layer.group_send(self.group, {"type": "room.event", "payload": payload})
-                await self._schedule_timeout_if_needed(payload["data"])
-                return
-
-            if action == "mark_number":
-                number = content.get("number")
-                payload = await self._make_move(self.room_id, user.id, number)
-                await self.channel_layer.group_send(self.group, {"type": "room.event", "payload": payload})
-                if payload["type"] != "game_ended":
-                    await self._schedule_timeout_if_needed(payload["data"])
+            if action in ("start_game", "mark_number"):
+                await self._play(action, user.id, content.get("number"))
                 return
 
             if action == "room_state":
                 snapshot = await self._room_snapshot(self.room_id)
-                await self.send_json({"type": "room_snapshot", "data": snapshot})
+                await self._send_snapshot(snapshot)
                 return
 
             await self.send_json({"type": "error", "message": "Unknown action"})
+        except RoomOwnedElsewhere as moved:
+            reply = await self._forward(moved.owner, action=action, user_id=user.id, number=content.get("number"))
+            error = "Room is unavailable, try again" if reply is None else reply.get("error")
+            if error:
+                mark_error()
+                await self.send_json({"type": "error", "message": error})
         except ValueError as exc:
+            mark_error()
             await self.send_json({"type": "error", "message": str(exc)})
 
+    async def _play(self, action, user_id, number=None):
+        if action == "start_game":
+            payload = await self._start_game(self.room_id, user_id)
+            await self._broadcast(self.room_id, payload)
+            await publish_closed(self.channel_layer, self.room_id, self.game_type)
+            await self._schedule_timeout_if_needed(self._event_data(payload))
+            return
+
+        self._check_move(snapshots.get(self.room_id), user_id, number)
+        payload = await self._make_move(self.room_id, user_id, number)
+        await self._broadcast(self.room_id, payload)
+        if payload["type"] != "game_ended":
+            await self._schedule_timeout_if_needed(self._event_data(payload))
+
+    async def _forward(self, owner, **message):
+        # Another process holds the room's engine state; it runs the command.
+        if not owner:
+            return None
+        return await owners.ask(self.channel_layer, owner, {**message, "room_id": self.room_id})
+
+    @classmethod
+    async def _run_forwarded(cls, message):
+        # A socketless consumer runs what another process forwarded to this
+        # room's owner; the events reach every socket through the group.
+        consumer = cls()
+        consumer.channel_layer = get_channel_layer()
+        consumer.room_id = message["room_id"]
+        consumer.group = cls.group_name(consumer.room_id)
+        action = message["action"]
+        if action == "snapshot":
+            state = engine.get(consumer.room_id)
+            return {"snapshot": state.snapshot() if state is not None else None}
+        if action == "auto_skip":
+            await consumer._turn_deadline_expired(consumer.room_id, message["deadline"])
+            return {}
+
+        try:
+            await actions.run(
+                cls.metrics_game,
+                action,
+                partial(
+                    commands.run,
+                    consumer.group,
+                    partial(consumer._play, action, message["user_id"], message.get("number")),
+                ),
+            )
+        except RoomOwnedElsewhere:
+            return {"error": "Room is moving to another server, try again"}
+        except ValueError as exc:
+            return {"error": str(exc)}
+        return {}
+
     async def room_event(self, event):
-        await self.send_json(event["payload"])
+        # The sender already encoded the frame; every socket forwards it as is.
+        if event.get("origin") != snapshots.origin:
+            snapshots.invalidate(self.room_id)
+        replay.record(self.room_id, event.get("seq"), event["text"], event.get("epoch"))
+        await self.send(text_data=event["text"])
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        if text_data is not None:
+            add_sent(text_data)
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+    async def _broadcast(self, room_id, payload):
+        # Bingo events are numbered by the engine; OXO ones here, and their
+        # snapshot, built before the number existed, takes it too.
+        seq = payload.get("seq")
+        if seq is None:
+            seq = payload["seq"] = payload["data"]["seq"] = replay.next_seq(room_id)
+            payload["epoch"] = payload["data"]["epoch"] = replay.epoch(room_id)
+        epoch = payload["epoch"]
+        text = dumps(payload)
+        add_sent(text)
+        replay.record(room_id, seq, text, epoch, restart=True)
+        group = self.group_name(room_id)
+        await self.channel_layer.group_send(
+            group, {"type": "room.event", "text": text, "seq": seq, "epoch": epoch, "origin": snapshots.origin}
+        )
+        await self._poke_spectators(group, room_id)
+
+    async def _poke_spectators(self, group, room_id):
+        # One message per watching process, however many spectators it serves,
+        # and none while nobody watches.
+        if await spectators.watched(group):
+            await self.channel_layer.group_send(
+                spectator_group(group), {"type": "spectator.changed", "room_id": room_id, "origin": snapshots.origin}
+            )
+
+    async def _send_snapshot(self, snapshot):
+        await self.send(text_data=snapshots.frame(self.room_id, snapshot, dumps))
+        self._sent_snapshot = snapshot
+        self._sent_at = time.monotonic()
+
+    def _has_current_snapshot(self):
+        # The cached snapshot is replaced on every change, so still holding
+        # the one last sent means the client already has the current state.
+        return (
+            self._sent_snapshot is not None
+            and snapshots.get(self.room_id) is self._sent_snapshot
+            and time.monotonic() - self._sent_at < ROOM_STATE_COALESCE_SECONDS
+        )
+
+    def _valid_move(self, number):
+        return isinstance(number, int) and 1 <= number <= 25
+
+    def _taken_move_error(self, snapshot, number):
+        if number in snapshot["called_numbers"]:
+            return "Number already eliminated"
+        return None
+
+    def _check_move(self, snapshot, user_id, move):
+        # Turns a move the cached snapshot already shows as stale away with the
+        # error the move itself would raise, before any database work. Invalid
+        # moves are left for the move to report.
+        if snapshot is None or not self._valid_move(move):
+            return
+        if snapshot["status"] != GameStatus.STARTED:
+            raise ValueError("Game is not in started state")
+        if snapshot["current_turn_player_id"] != user_id:
+            raise ValueError("Not your turn")
+        deadline = snapshot["turn_deadline"]
+        if deadline and timezone.now() > datetime.fromisoformat(deadline):
+            raise ValueError("Turn expired")
+        error = self._taken_move_error(snapshot, move)
+        if error:
+            raise ValueError(error)
+
+    @classmethod
+    async def encode_json(cls, content):
+        return dumps(content)
+
+    @staticmethod
+    def _event_data(payload):
+        # Bingo events carry a delta and OXO events a full snapshot; both hold
+        # the room_id, status and turn_deadline the timer needs.
+        return payload.get("delta") or payload["data"]
 
     async def _schedule_timeout_if_needed(self, room_data):
         if room_data["status"] != GameStatus.STARTED or not room_data.get("turn_deadline"):
             return
 
         room_id = room_data["room_id"]
-        existing = self._timer_tasks.get(room_id)
-        if existing and not existing.done():
-            existing.cancel()
+        deadline_iso = room_data["turn_deadline"]
+        if await leases.claim(room_id, deadline_iso):
+            scheduler.schedule(room_id, deadline_iso, self._turn_deadline_expired)
+        else:
+            scheduler.schedule(room_id, deadline_iso, self._standby_deadline_expired, delay=leases.margin)
 
-        self._timer_tasks[room_id] = asyncio.create_task(self._timeout_task(room_id, room_data["turn_deadline"]))
+    async def _turn_deadline_expired(self, room_id, deadline_iso):
+        await actions.run(self.metrics_game, "auto_skip", partial(self._expire_turn, room_id, deadline_iso))
 
-    async def _timeout_task(self, room_id, deadline_iso):
+    async def _expire_turn(self, room_id, deadline_iso):
         try:
-            deadline = timezone.datetime.fromisoformat(deadline_iso)
-            now = timezone.now()
-            wait_seconds = max((deadline - now).total_seconds(), 0)
-            await asyncio.sleep(wait_seconds + 0.1)
-
-            payload = await self._auto_skip_turn(room_id, deadline_iso)
-            if payload:
-                await self.channel_layer.group_send(
-                    self.group_name(room_id),
-                    {"type": "room.event", "payload": payload},
+            payload = await commands.run(self.group_name(room_id), partial(self._auto_skip_turn, room_id, deadline_iso))
+        except RoomOwnedElsewhere as moved:
+            # The owner skips and claims the next deadline itself.
+            await leases.release(room_id)
+            if moved.owner:
+                await owners.ask(
+                    self.channel_layer, moved.owner, {"action": "auto_skip", "room_id": room_id, "deadline": deadline_iso}
                 )
-                if payload["type"] != "game_ended":
-                    await self._schedule_timeout_if_needed(payload["data"])
-        except asyncio.CancelledError:
             return
+        if payload:
+            await self._broadcast(room_id, payload)
+            if payload["type"] != "game_ended":
+                await self._schedule_timeout_if_needed(self._event_data(payload))
+                return
+        await leases.release(room_id)
+
+    async def _standby_deadline_expired(self, room_id, deadline_iso):
+        # The owner's lease outlives the deadline by the margin, so getting it
+        # now means the owner went away without moving the turn on.
+        if self.game_type == GameType.BINGO:
+            owner = await owners.owner(room_id)
+            if owner and owner != owners.channel:
+                # Its engine state is newer than the last checkpoint, so it does
+                # the skip; the room is only loaded here once that lease lapses.
+                reply = await owners.ask(
+                    self.channel_layer, owner, {"action": "auto_skip", "room_id": room_id, "deadline": deadline_iso}
+                )
+                if reply is None:
+                    overdue = max(time.time() - datetime.fromisoformat(deadline_iso).timestamp(), 0)
+                    scheduler.schedule(
+                        room_id, deadline_iso, self._standby_deadline_expired, delay=overdue + owners.ttl
+                    )
+                return
+        if not await leases.claim(room_id, deadline_iso):
+            return
+        if self.game_type == GameType.BINGO and engine.get(room_id) is None:
+            await commands.run(self.group_name(room_id), partial(self._take_over, room_id))
+            return
+        await self._turn_deadline_expired(room_id, deadline_iso)
+
+    async def _take_over(self, room_id):
+        # The owner died, so moves after its last checkpoint are gone; every
+        # socket is resynced to the stored room, whose expired turn is then
+        # skipped as usual.
+        try:
+            await self._room_state(room_id)
+        except (RoomOwnedElsewhere, ValueError):
+            await leases.release(room_id)
+            return
+        logger.warning("Took over room %s from its last checkpoint", room_id)
+        await self._resync(room_id)
+
+    async def _hand_off(self, room_id):
+        # Nobody plays the room from this process any more: write its state and
+        # let it go, so the process its players reconnect to loads it current.
+        state = engine.get(room_id)
+        if state is None or self._group_sockets.get(self.group):
+            return
+        try:
+            await self._flush(state)
+        except ValueError:
+            return
+        if state.dirty:
+            # The checkpoint failed and is being retried; keep the room.
+            return
+        engine.discard(room_id)
+        await owners.release(room_id)
+
+    async def _is_room_player(self, room_id, user_id):
+        key = (room_id, user_id)
+        is_player = room_members.get(key)
+        if is_player is None:
+            is_player = await self._is_room_player_db(room_id, user_id)
+            room_members.set(key, is_player, ttl=None if is_player else NON_MEMBER_TTL_SECONDS)
+        return is_player
 
-    @sync_to_async
-    def _is_room_player(self, room_id, user_id):
-        return RoomPlayer.objects.filter(room__room_id=room_id, user_id=user_id).exists()
+    async def _is_room_player_db(self, room_id, user_id):
+        return await RoomPlayer.objects.filter(room__room_id=room_id, user_id=user_id).aexists()
 
     def _room_snapshot_sync(self, room_id):
-        room = Room.objects.select_related("owner", "current_turn_player").prefetch_related("players__user").get(room_id=room_id)
+        snapshot = snapshots.get(room_id)
+        if snapshot is None:
+            version = snapshots.version(room_id)
+            snapshot = self._build_snapshot(room_id)
+            snapshots.set(room_id, version, snapshot)
+        return snapshot
+
+    async def _room_snapshot_async(self, room_id):
+        snapshot = snapshots.get(room_id)
+        if snapshot is None:
+            version = snapshots.version(room_id)
+            snapshot = await self._build_snapshot_async(room_id)
+            snapshots.set(room_id, version, snapshot)
+        return snapshot
+
+    def _build_snapshot(self, room_id):
+        state = engine.get(room_id)
+        if state is not None:
+            return state.snapshot()
+        return self._snapshot_from_room(self._snapshot_queryset().get(room_id=room_id))
+
+    async def _build_snapshot_async(self, room_id):
+        if self.game_type == GameType.BINGO:
+            snapshot = await self._owner_snapshot(room_id)
+            if snapshot is not None:
+                return snapshot
+        state = engine.get(room_id)
+        if state is not None:
+            return state.snapshot()
+        return self._snapshot_from_room(await self._snapshot_queryset().aget(room_id=room_id))
+
+    async def _owner_snapshot(self, room_id):
+        # The database lags a started room's owner by up to a checkpoint, so
+        # another process asks the owner for its state.
+        owner = await owners.owner(room_id)
+        if not owner or owner == owners.channel:
+            return None
+        engine.discard(room_id)
+        reply = await owners.ask(self.channel_layer, owner, {"action": "snapshot", "room_id": room_id})
+        return reply.get("snapshot") if reply else None
+
+    @staticmethod
+    def _snapshot_queryset():
+        return room_read_queryset()
+
+    def _snapshot_from_room(self, room):
         players = []
-        for entry in room.players.all().order_by("turn_order"):
+        for entry in room.players.all():
             players.append(
                 {
                     "user_id": entry.user_id,
@@ -129,35 +452,30 @@ class BingoRoomConsumer(AsyncJsonWebsocketConsumer):
             "max_players": room.max_players,
             "current_turn_player_id": room.current_turn_player_id,
             "current_turn_username": room.current_turn_player.username if room.current_turn_player else None,
-            "called_numbers": room.called_numbers,
+            "called_numbers": room.current_called_numbers,
             "turn_deadline": room.turn_deadline.isoformat() if room.turn_deadline else None,
             "winner_order": room.winner_order,
             "players": players,
+            "epoch": replay.epoch(room.room_id),
+            "seq": replay.last_seq(room.room_id),
         }
 
-    @sync_to_async
-    def _room_snapshot(self, room_id):
-        return self._room_snapshot_sync(room_id)
-
-    def _next_turn_player(self, room, players):
-        if not players:
-            return None
-
-        available = [p for p in players if p.status != PlayerStatus.FINISHED]
-        if not available:
-            return None
-
-        current_id = room.current_turn_player_id
-        if current_id is None:
-            return available[0]
-
-        ordered = players
-        current_idx = next((idx for idx, item in enumerate(ordered) if item.user_id == current_id), -1)
-        for offset in range(1, len(ordered) + 1):
-            candidate = ordered[(current_idx + offset) % len(ordered)]
-            if candidate.status != PlayerStatus.FINISHED:
-                return candidate
-        return None
+    async def _room_snapshot(self, room_id):
+        # Sockets asking for the same room while a build is running share it,
+        # so a reconnect burst costs one query set instead of one per socket.
+        key = self.group_name(room_id)
+        loop = asyncio.get_running_loop()
+        build = self._snapshot_builds.get(key)
+        if build is None or build.get_loop() is not loop:
+            build = loop.create_task(self._room_snapshot_async(room_id))
+            self._snapshot_builds[key] = build
+            build.add_done_callback(partial(self._snapshot_built, key))
+        return await asyncio.shield(build)
+
+    @classmethod
+    def _snapshot_built(cls, key, build):
+        if cls._snapshot_builds.get(key) is build:
+            del cls._snapshot_builds[key]
 
     def _build_board(self):
         numbers = list(range(1, 26))
@@ -173,43 +491,35 @@ class BingoRoomConsumer(AsyncJsonWebsocketConsumer):
             used.add(candidate)
             player.board_numbers = list(candidate)
 
-    def _finalize_game(self, room, players):
-        room.status = GameStatus.ENDED
-        room.current_turn_player = None
-        room.turn_deadline = None
-        room.save(update_fields=["status", "current_turn_player", "turn_deadline", "updated_at"])
-
-        for player in players:
-            profile, _ = Profile.objects.get_or_create(user=player.user)
-            profile.total_matches += 1
-            if player.rank == 1:
-                profile.wins += 1
-                profile.points += 10
-            elif player.rank == 2:
-                profile.second_place += 1
-                profile.points += 5
-            else:
-                profile.losses += 1
-            profile.save()
+    async def _start_game(self, room_id, user_id):
+        # Checked before the owner lease is claimed, so a refused start never
+        # holds the room; the write checks again under its row locks.
+        room = await Room.objects.only("owner_id", "status").aget(room_id=room_id)
+        self._check_start(room, user_id, await RoomPlayer.objects.filter(room=room).acount())
+        await self._own(room_id)
+        return await self._start_game_db(room_id, user_id)
 
-    @sync_to_async
-    def _start_game(self, room_id, user_id):
+    @staticmethod
+    def _check_start(room, user_id, player_count):
+        if room.owner_id != user_id:
+            raise ValueError("Only room owner can start the game")
+        if room.status != GameStatus.WAITING:
+            raise ValueError("Game already started or ended")
+        if player_count < 2:
+            raise ValueError("Need at least 2 players to start")
+
+    @room_write
+    def _start_game_db(self, room_id, user_id):
         with transaction.atomic():
             room = Room.objects.select_for_update().select_related("owner").get(room_id=room_id)
-            if room.owner_id != user_id:
-                raise ValueError("Only room owner can start the game")
-            if room.status != GameStatus.WAITING:
-                raise ValueError("Game already started or ended")
-
             players = list(room.players.select_for_update().order_by("turn_order"))
-            if len(players) < 2:
-                raise ValueError("Need at least 2 players to start")
+            self._check_start(room, user_id, len(players))
 
             room.status = GameStatus.STARTED
-            room.called_numbers = []
+            room.called_sequence = b""
             room.winner_order = []
             room.current_turn_player = players[0].user
-            room.turn_deadline = timezone.now() + timedelta(seconds=10)
+            room.turn_deadline = timezone.now() + timedelta(seconds=TURN_SECONDS)
             room.save()
 
             self._assign_unique_boards(players)
@@ -217,106 +527,152 @@ class BingoRoomConsumer(AsyncJsonWebsocketConsumer):
                 player.status = PlayerStatus.PLAYING
                 player.rank = None
                 player.lines_completed = 0
-                player.eliminated_numbers = []
                 player.save()
 
-        return {"type": "game_started", "data": self._room_snapshot_sync(room_id)}
+        engine.discard(room_id)
+        snapshots.invalidate(room_id)
+        return engine.load(room_id).start_event()
 
-    @sync_to_async
-    def _make_move(self, room_id, user_id, number):
-        if not isinstance(number, int) or not (1 <= number <= 25):
-            raise ValueError("Number must be in range 1..25")
+    @room_write
+    def _load_room_state(self, room_id):
+        return engine.load(room_id)
 
-        with transaction.atomic():
-            room = Room.objects.select_for_update().get(room_id=room_id)
-            if room.status != GameStatus.STARTED:
-                raise ValueError("Game is not in started state")
-            if room.current_turn_player_id != user_id:
-                raise ValueError("Not your turn")
-            if room.turn_deadline and timezone.now() > room.turn_deadline:
-                raise ValueError("Turn expired")
-            if number in room.called_numbers:
-                raise ValueError("Number already eliminated")
-
-            room.called_numbers = [*room.called_numbers, number]
-            players = list(
-                RoomPlayer.objects.select_for_update()
-                .select_related("user")
-                .filter(room=room)
-                .order_by("turn_order")
-            )
+    @room_write
+    def _flush_room_state(self, room_id, state):
+        engine.flush(state)
 
-            for player in players:
-                if number not in player.eliminated_numbers:
-                    player.eliminated_numbers = [*player.eliminated_numbers, number]
-                player.lines_completed = calculate_completed_lines(player.board_numbers, player.eliminated_numbers)
-                if player.user_id == user_id and player.status == PlayerStatus.SKIPPED:
-                    player.status = PlayerStatus.PLAYING
-                if player.lines_completed >= 5 and player.rank is None:
-                    next_rank = 1 + sum(1 for p in players if p.rank is not None)
-                    player.rank = next_rank
-                    player.status = PlayerStatus.FINISHED
-                    if player.user_id not in room.winner_order:
-                        room.winner_order = [*room.winner_order, player.user_id]
-                player.save()
+    async def _own(self, room_id):
+        if not await owners.claim(room_id):
+            engine.discard(room_id)
+            raise RoomOwnedElsewhere(await owners.owner(room_id))
 
-            ranked_count = sum(1 for p in players if p.rank is not None)
-            winner_threshold = 2 if len(players) > 2 else 1
-            should_end = ranked_count >= winner_threshold or len(room.called_numbers) >= 25
-            if should_end:
-                self._finalize_game(room, players)
-                event_type = "game_ended"
-            else:
-                next_player = self._next_turn_player(room, players)
-                room.current_turn_player = next_player.user if next_player else None
-                room.turn_deadline = timezone.now() + timedelta(seconds=10) if next_player else None
-                room.save(update_fields=["called_numbers", "winner_order", "current_turn_player", "turn_deadline", "updated_at"])
-                event_type = "turn_changed"
+    async def _room_state(self, room_id):
+        await self._own(room_id)
+        state = engine.get(room_id) or await self._load_room_state(room_id)
+        if state is None:
+            raise ValueError("Game is not in started state")
+        return state
 
-        return {"type": event_type, "data": self._room_snapshot_sync(room_id)}
+    async def _checkpoint(self, state):
+        if engine.flush_due(state):
+            await self._flush(state)
 
-    @sync_to_async
-    def _auto_skip_turn(self, room_id, expected_deadline):
-        with transaction.atomic():
-            room = Room.objects.select_for_update().get(room_id=room_id)
-            if room.status != GameStatus.STARTED or not room.turn_deadline:
-                return None
-            if room.turn_deadline.isoformat() != expected_deadline:
-                return None
-            if timezone.now() < room.turn_deadline:
+    async def _flush(self, state):
+        try:
+            await self._flush_room_state(state.room_id, state)
+        except StaleRoomState:
+            # The engine dropped its copy; players get the stored room instead.
+            logger.warning("Room %s changed outside its engine; reloading it", state.room_id)
+            await self._resync(state.room_id)
+            raise ValueError("Room changed elsewhere and was reloaded")
+        except Exception:
+            # The move stands and is still broadcast; the state stays dirty
+            # and in the engine until a retry writes it.
+            logger.exception("Checkpoint of room %s failed", state.room_id)
+            asyncio.get_running_loop().call_later(FLUSH_RETRY_SECONDS, self._retry_flush, state)
+            return
+        if state.status == GameStatus.ENDED:
+            await owners.release(state.room_id)
+
+    def _retry_flush(self, state):
+        asyncio.ensure_future(commands.run(self.group_name(state.room_id), partial(self._flush_again, state)))
+
+    async def _flush_again(self, state):
+        if engine.get(state.room_id) is not state or not state.dirty:
+            return
+        try:
+            await self._flush(state)
+        except ValueError:
+            pass
+
+    async def _resync(self, room_id):
+        # Sent without a seq, like a REST join, so replay buffers start over.
+        snapshots.invalidate(room_id)
+        snapshot = await self._room_snapshot_async(room_id)
+        replay.clear(room_id)
+        group = self.group_name(room_id)
+        text = dumps({"type": "room_snapshot", "data": snapshot})
+        await self.channel_layer.group_send(group, {"type": "room.event", "text": text, "origin": snapshots.origin})
+        await self._poke_spectators(group, room_id)
+        await self._schedule_timeout_if_needed(snapshot)
+
+    async def _make_move(self, room_id, user_id, number):
+        state = await self._room_state(room_id)
+        payload = state.apply_move(user_id, number)
+        snapshots.invalidate(room_id)
+        await self._checkpoint(state)
+        return payload
+
+    async def _auto_skip_turn(self, room_id, expected_deadline):
+        try:
+            state = await self._room_state(room_id)
+        except ValueError:
+            return None
+        payload = state.skip_turn(expected_deadline)
+        if payload is not None:
+            snapshots.invalidate(room_id)
+            try:
+                await self._checkpoint(state)
+            except ValueError:
                 return None
+        return payload
 
-            players = list(
-                RoomPlayer.objects.select_for_update()
-                .select_related("user")
-                .filter(room=room)
-                .order_by("turn_order")
-            )
 
-            skipped = next((p for p in players if p.user_id == room.current_turn_player_id), None)
-            if skipped and skipped.status != PlayerStatus.FINISHED:
-                skipped.status = PlayerStatus.SKIPPED
-                skipped.save(update_fields=["status"])
+class RoomCheckpoints:
+    """Per-process loop that writes rooms nobody has moved in lately.
 
-            next_player = self._next_turn_player(room, players)
-            if not next_player:
-                self._finalize_game(room, players)
-                return {"type": "game_ended", "data": self._room_snapshot_sync(room_id)}
+    Moves and skips checkpoint as they go, so this only catches a room left
+    dirty once ``engine.flush_interval`` has passed without another one.
+    """
 
-            room.current_turn_player = next_player.user
-            room.turn_deadline = timezone.now() + timedelta(seconds=10)
-            room.save(update_fields=["current_turn_player", "turn_deadline", "updated_at"])
+    def __init__(self, interval=FLUSH_INTERVAL_SECONDS):
+        self.interval = interval
+        self._task = None
+
+    def ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    async def flush_due(self):
+        """Checkpoint every room that is due, each in its room's queue; returns how many."""
+        due = [state for state in engine.rooms() if engine.flush_due(state)]
+        for state in due:
+            consumer = BingoRoomConsumer()
+            consumer.channel_layer = get_channel_layer()
+            consumer.room_id = state.room_id
+            consumer.group = consumer.group_name(state.room_id)
+            await commands.run(consumer.group, partial(consumer._flush_again, state))
+        return len(due)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush_due()
+            except Exception:
+                logger.exception("Room checkpoints failed")
+
+
+checkpoints = RoomCheckpoints()
 
-        return {
-            "type": "turn_auto_skipped",
-            "data": self._room_snapshot_sync(room_id),
-        }
 
 class TttRoomConsumer(BingoRoomConsumer):
+    game_type = GameType.OXO
+    metrics_game = "oxo"
+
     @staticmethod
     def group_name(room_id):
         return f"ttt_room_{room_id}"
 
+    def _valid_move(self, cell_index):
+        return isinstance(cell_index, int) and 0 <= cell_index <= 8
+
+    def _taken_move_error(self, snapshot, cell_index):
+        if snapshot["called_numbers"][cell_index] is not None:
+            return "Cell already occupied"
+        return None
+
     def _check_win(self, board):
         # board is a list of 9 elements: None, user_id1, user_id2
         wins = [
@@ -329,7 +685,7 @@ class TttRoomConsumer(BingoRoomConsumer):
                 return board[a]
         return None
 
-    @sync_to_async
+    @room_write
     def _start_game(self, room_id, user_id):
         with transaction.atomic():
             room = Room.objects.select_for_update().select_related("owner").get(room_id=room_id)
@@ -354,9 +710,10 @@ class TttRoomConsumer(BingoRoomConsumer):
                 player.rank = None
                 player.save()
 
+        snapshots.invalidate(room_id)
         return {"type": "game_started", "data": self._room_snapshot_sync(room_id)}
 
-    @sync_to_async
+    @room_write
     def _make_move(self, room_id, user_id, cell_index):
         if not isinstance(cell_index, int) or not (0 <= cell_index <= 8):
             raise ValueError("Invalid cell index")
@@ -389,75 +746,75 @@ class TttRoomConsumer(BingoRoomConsumer):
                 
                 # Update profiles
                 for p in players:
-                    profile, _ = Profile.objects.get_or_create(user=p.user)
-                    profile.total_matches += 1
-                    if p.user_id == winner_id:
-                        p.rank = 1
-                        profile.wins += 1
-                        profile.points += 10
-                    else:
-                        p.rank = 2
-                        profile.losses += 1
-                    p.save()
-                    profile.save()
-                
-                return {"type": "game_ended", "data": self._room_snapshot_sync(room_id)}
-            
+                    p.rank = 1 if p.user_id == winner_id else 2
+                RoomPlayer.objects.bulk_update(players, ["rank"])
+                log_game_result(
+                    room.pk,
+                    GameType.OXO,
+                    [(p.user_id, WIN if p.user_id == winner_id else LOSS, p.rank) for p in players],
+                )
+                event_type = "game_ended"
+
             # Check draw
-            if all(cell is not None for cell in board):
+            elif all(cell is not None for cell in board):
                 room.status = GameStatus.ENDED
                 room.current_turn_player = None
                 room.turn_deadline = None
                 room.save()
-                for p in players:
-                    profile, _ = Profile.objects.get_or_create(user=p.user)
-                    profile.total_matches += 1
-                    profile.save()
-                return {"type": "game_ended", "data": self._room_snapshot_sync(room_id)}
+                log_game_result(room.pk, GameType.OXO, [(p.user_id, DRAW, None) for p in players])
+                event_type = "game_ended"
 
             # Next turn
-            next_player = next(p for p in players if p.user_id != user_id)
-            room.current_turn_player = next_player.user
-            room.turn_deadline = timezone.now() + timedelta(seconds=30)
-            room.save()
+            else:
+                next_player = next(p for p in players if p.user_id != user_id)
+                room.current_turn_player = next_player.user
+                room.turn_deadline = timezone.now() + timedelta(seconds=30)
+                room.save()
+                event_type = "turn_changed"
 
-        return {"type": "turn_changed", "data": self._room_snapshot_sync(room_id)}
+        # Built after commit so a concurrent reader cannot cache the old state
+        # under the new version.
+        snapshots.invalidate(room_id)
+        return {"type": event_type, "data": self._room_snapshot_sync(room_id)}
 
 
-    async def receive_json(self, content, **kwargs):
+    async def _handle_action(self, content):
         action = content.get("action")
         user = self.scope["user"]
         try:
             if action == "start_game":
                 payload = await self._start_game(self.room_id, user.id)
-                await self.channel_layer.group_send(self.group, {"type": "room.event", "payload": payload})
+                await self._broadcast(self.room_id, payload)
+                await publish_closed(self.channel_layer, self.room_id, self.game_type)
                 await self._schedule_timeout_if_needed(payload["data"])
                 return
 
             if action == "mark_number":
                 number = content.get("number")
+                self._check_move(snapshots.get(self.room_id), user.id, number)
                 payload = await self._make_move(self.room_id, user.id, number)
-                await self.channel_layer.group_send(self.group, {"type": "room.event", "payload": payload})
+                await self._broadcast(self.room_id, payload)
                 if payload["type"] != "game_ended":
                     await self._schedule_timeout_if_needed(payload["data"])
                 return
 
             if action == "rematch":
                 payload = await self._rematch(self.room_id, user.id)
-                await self.channel_layer.group_send(self.group, {"type": "room.event", "payload": payload})
+                await self._broadcast(self.room_id, payload)
                 await self._schedule_timeout_if_needed(payload["data"])
                 return
 
             if action == "room_state":
                 snapshot = await self._room_snapshot(self.room_id)
-                await self.send_json({"type": "room_snapshot", "data": snapshot})
+                await self._send_snapshot(snapshot)
                 return
 
             await self.send_json({"type": "error", "message": "Unknown action"})
         except ValueError as exc:
+            mark_error()
             await self.send_json({"type": "error", "message": str(exc)})
 
-    @sync_to_async
+    @room_write
     def _rematch(self, room_id, user_id):
         with transaction.atomic():
             room = Room.objects.select_for_update().get(room_id=room_id)
@@ -477,10 +834,11 @@ class TttRoomConsumer(BingoRoomConsumer):
                 player.status = PlayerStatus.PLAYING
                 player.rank = None
                 player.save()
-        
+
+        snapshots.invalidate(room_id)
         return {"type": "game_started", "data": self._room_snapshot_sync(room_id)}
 
-    @sync_to_async
+    @room_write
     def _auto_skip_turn(self, room_id, expected_deadline):
         with transaction.atomic():
             room = Room.objects.select_for_update().get(room_id=room_id)
@@ -496,4 +854,128 @@ class TttRoomConsumer(BingoRoomConsumer):
             room.turn_deadline = timezone.now() + timedelta(seconds=30)
             room.save()
 
+        snapshots.invalidate(room_id)
         return {"type": "turn_auto_skipped", "data": self._room_snapshot_sync(room_id)}
+
+
+class LobbyConsumer(AsyncJsonWebsocketConsumer):
+    """Pushes lobby_room changes for one game type, or for all of them."""
+
+    async def connect(self):
+        user = self.scope["user"]
+        if not user or user.is_anonymous:
+            await self.close(code=4001)
+            return
+
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        game_type = query.get("game_type", [""])[0].upper()
+        if game_type and game_type not in GameType.values:
+            await self.close(code=4000)
+            return
+
+        self.lobby_groups = [lobby_group(value) for value in GameType.values if value == game_type or not game_type]
+        for group in self.lobby_groups:
+            await self.channel_layer.group_add(group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        for group in getattr(self, "lobby_groups", ()):
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def lobby_event(self, event):
+        await self.send(text_data=event["text"])
+
+
+class MatchmakingConsumer(AsyncJsonWebsocketConsumer):
+    """A user's matchmaking socket: queue or cancel, then get match_found with the room_id.
+
+    Closing the socket the user queued from leaves the queue; their other
+    sockets can come and go. See ``Matchmaker`` for running more than one
+    worker.
+    """
+
+    async def connect(self):
+        user = self.scope["user"]
+        if not user or user.is_anonymous:
+            await self.close(code=4001)
+            return
+
+        self.group = match_group(user.id)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+        matchmaker.ensure_running()
+
+    async def disconnect(self, close_code):
+        if hasattr(self, "group"):
+            matchmaker.cancel(self.scope["user"].id, self.channel_name)
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        action = content.get("action")
+        user_id = self.scope["user"].id
+        if action == "queue":
+            game_type = str(content.get("game_type", "")).upper()
+            if game_type not in GameType.values:
+                await self.send_json({"type": "error", "message": "Unknown game_type"})
+                return
+            waiting = matchmaker.enqueue(user_id, game_type, self.channel_name)
+            await self.send_json({"type": "queued", "game_type": game_type, "waiting": waiting})
+            return
+
+        if action == "cancel":
+            matchmaker.cancel(user_id)
+            await self.send_json({"type": "cancelled"})
+            return
+
+        await self.send_json({"type": "error", "message": "Unknown action"})
+
+    async def matchmaking_event(self, event):
+        await self.send(text_data=event["text"])
+
+    @classmethod
+    async def encode_json(cls, content):
+        return dumps(content)
+
+
+class SpectatorMixin:
+    """Read-only socket on a room for anyone signed in, fed by ``spectators``.
+
+    Spectators never join the players' group and nothing they send is read.
+    """
+
+    async def connect(self):
+        self.room_id = self.scope["url_route"]["kwargs"]["room_id"].upper()
+        user = self.scope["user"]
+        if not user or user.is_anonymous:
+            await self.close(code=4001)
+            return
+
+        try:
+            frame = await self._spectator_frame()
+        except Room.DoesNotExist:
+            await self.close(code=4004)
+            return
+
+        self.group = self.group_name(self.room_id)
+        await self.accept()
+        frame = await spectators.watch(self.group, self.room_id, self, self._spectator_frame, frame)
+        await self.send(text_data=frame)
+
+    async def disconnect(self, close_code):
+        if hasattr(self, "group"):
+            await spectators.leave(self.group, self)
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        return
+
+    async def _spectator_frame(self):
+        snapshot = await self._room_snapshot(self.room_id)
+        return dumps({"type": "spectator_snapshot", "data": spectator_view(snapshot)})
+
+
+class BingoSpectatorConsumer(SpectatorMixin, BingoRoomConsumer):
+    pass
+
+
+class TttSpectatorConsumer(SpectatorMixin, TttRoomConsumer):
+    pass
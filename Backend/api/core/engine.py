@@ -0,0 +1,362 @@
+import logging
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .bingo import BingoBoard
+from .models import GameStatus, GameType, PlayerStatus, Room, RoomPlayer
+from .results import bingo_outcome, log_game_result
+
+logger = logging.getLogger(__name__)
+
+TURN_SECONDS = 10
+FLUSH_INTERVAL_SECONDS = 5.0
+
+
+class StaleRoomState(Exception):
+    """The room row changed since this copy was loaded or last flushed."""
+
+
+class PlayerState:
+    __slots__ = ("pk", "user_id", "username", "turn_order", "status", "board_numbers", "board", "lines_completed", "rank")
+
+    def __init__(self, entry, called_numbers):
+        self.pk = entry.pk
+        self.user_id = entry.user_id
+        self.username = entry.user.username
+        self.turn_order = entry.turn_order
+        self.status = entry.status
+        self.board_numbers = list(entry.board_numbers)
+        self.board = BingoBoard(self.board_numbers, called_numbers)
+        self.lines_completed = self.board.completed
+        self.rank = entry.rank
+
+
+class RoomState:
+    """Authoritative in-memory state of a started Bingo room.
+
+    Moves and skips are validated and applied here under ``lock``; the
+    database only sees the result when the engine flushes a checkpoint.
+    """
+
+    def __init__(self, room, players):
+        self.pk = room.pk
+        self.room_id = room.room_id
+        self.owner_id = room.owner_id
+        self.owner_username = room.owner.username
+        self.max_players = room.max_players
+        self.status = room.status
+        self.called_numbers = bytearray(room.called_sequence)
+        self.called_mask = 0
+        for number in self.called_numbers:
+            self.called_mask |= 1 << number
+        self.current_turn_player_id = room.current_turn_player_id
+        self.turn_deadline = room.turn_deadline
+        self.winner_order = list(room.winner_order)
+        # What the row's updated_at must still be for a checkpoint to land.
+        self.updated_at = room.updated_at
+        self.players = [PlayerState(entry, self.called_numbers) for entry in players]
+        self.by_user = {player.user_id: player for player in self.players}
+        # seq starts over with every load, so events also carry which load
+        # numbered them.
+        self.epoch = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.flushed_at = time.monotonic()
+
+    def _next_turn_player(self):
+        if not self.players:
+            return None
+
+        available = [p for p in self.players if p.status != PlayerStatus.FINISHED]
+        if not available:
+            return None
+
+        current_id = self.current_turn_player_id
+        if current_id is None:
+            return available[0]
+
+        ordered = self.players
+        current_idx = next((idx for idx, item in enumerate(ordered) if item.user_id == current_id), -1)
+        for offset in range(1, len(ordered) + 1):
+            candidate = ordered[(current_idx + offset) % len(ordered)]
+            if candidate.status != PlayerStatus.FINISHED:
+                return candidate
+        return None
+
+    def _end(self):
+        self.status = GameStatus.ENDED
+        self.current_turn_player_id = None
+        self.turn_deadline = None
+
+    def apply_move(self, user_id, number):
+        if not isinstance(number, int) or not (1 <= number <= 25):
+            raise ValueError("Number must be in range 1..25")
+
+        with self.lock:
+            now = timezone.now()
+            if self.status != GameStatus.STARTED:
+                raise ValueError("Game is not in started state")
+            if self.current_turn_player_id != user_id:
+                raise ValueError("Not your turn")
+            if self.turn_deadline and now > self.turn_deadline:
+                raise ValueError("Turn expired")
+            if self.called_mask >> number & 1:
+                raise ValueError("Number already eliminated")
+
+            before = self._player_marks()
+            winners_before = len(self.winner_order)
+            self.called_numbers.append(number)
+            self.called_mask |= 1 << number
+
+            ranked_count = sum(1 for p in self.players if p.rank is not None)
+            for player in self.players:
+                if player.board.mark(number):
+                    player.lines_completed = player.board.completed
+                if player.user_id == user_id and player.status == PlayerStatus.SKIPPED:
+                    player.status = PlayerStatus.PLAYING
+                if player.lines_completed >= 5 and player.rank is None:
+                    ranked_count += 1
+                    player.rank = ranked_count
+                    player.status = PlayerStatus.FINISHED
+                    if player.user_id not in self.winner_order:
+                        self.winner_order.append(player.user_id)
+
+            winner_threshold = 2 if len(self.players) > 2 else 1
+            self.dirty = True
+            if ranked_count >= winner_threshold or len(self.called_numbers) >= 25:
+                self._end()
+                event_type = "game_ended"
+            else:
+                next_player = self._next_turn_player()
+                self.current_turn_player_id = next_player.user_id if next_player else None
+                self.turn_deadline = now + timedelta(seconds=TURN_SECONDS) if next_player else None
+                event_type = "turn_changed"
+            return self._event(event_type, before, winners_before, number=number, called_by=user_id)
+
+    def skip_turn(self, expected_deadline):
+        with self.lock:
+            now = timezone.now()
+            if self.status != GameStatus.STARTED or not self.turn_deadline:
+                return None
+            if self.turn_deadline.isoformat() != expected_deadline:
+                return None
+            if now < self.turn_deadline:
+                return None
+
+            before = self._player_marks()
+            winners_before = len(self.winner_order)
+            skipped = self.by_user.get(self.current_turn_player_id)
+            if skipped and skipped.status != PlayerStatus.FINISHED:
+                skipped.status = PlayerStatus.SKIPPED
+
+            self.dirty = True
+            next_player = self._next_turn_player()
+            if not next_player:
+                self._end()
+                return self._event("game_ended", before, winners_before)
+
+            self.current_turn_player_id = next_player.user_id
+            self.turn_deadline = now + timedelta(seconds=TURN_SECONDS)
+            return self._event("turn_auto_skipped", before, winners_before)
+
+    def start_event(self):
+        with self.lock:
+            self.seq += 1
+            delta = self._turn_fields()
+            delta["called_numbers"] = list(self.called_numbers)
+            delta["winner_order"] = list(self.winner_order)
+            delta["players"] = [
+                {**self._player_fields(player), "board_numbers": player.board_numbers}
+                for player in self.players
+            ]
+            return {"type": "game_started", "epoch": self.epoch, "seq": self.seq, "delta": delta}
+
+    def turn(self):
+        with self.lock:
+            return self._turn_fields()
+
+    def _player_marks(self):
+        return [(p.status, p.lines_completed, p.rank) for p in self.players]
+
+    def _player_fields(self, player):
+        return {
+            "user_id": player.user_id,
+            "status": player.status,
+            "lines_completed": player.lines_completed,
+            "rank": player.rank,
+        }
+
+    def _turn_fields(self):
+        current = self.by_user.get(self.current_turn_player_id)
+        return {
+            "room_id": self.room_id,
+            "status": self.status,
+            "current_turn_player_id": self.current_turn_player_id,
+            "current_turn_username": current.username if current else None,
+            "turn_deadline": self.turn_deadline.isoformat() if self.turn_deadline else None,
+        }
+
+    def _event(self, event_type, before, winners_before, **changes):
+        # Only what the event changed: turn fields always move, players and the
+        # winner order are included when they did.
+        self.seq += 1
+        delta = self._turn_fields()
+        delta.update(changes)
+        players = [
+            self._player_fields(player)
+            for player, marks in zip(self.players, before)
+            if (player.status, player.lines_completed, player.rank) != marks
+        ]
+        if players:
+            delta["players"] = players
+        if len(self.winner_order) != winners_before:
+            delta["winner_order"] = list(self.winner_order)
+        return {"type": event_type, "epoch": self.epoch, "seq": self.seq, "delta": delta}
+
+    def snapshot(self):
+        with self.lock:
+            current = self.by_user.get(self.current_turn_player_id)
+            return {
+                "epoch": self.epoch,
+                "seq": self.seq,
+                "room_id": self.room_id,
+                "owner_id": self.owner_id,
+                "owner_username": self.owner_username,
+                "status": self.status,
+                "max_players": self.max_players,
+                "current_turn_player_id": self.current_turn_player_id,
+                "current_turn_username": current.username if current else None,
+                "called_numbers": list(self.called_numbers),
+                "turn_deadline": self.turn_deadline.isoformat() if self.turn_deadline else None,
+                "winner_order": list(self.winner_order),
+                "players": [
+                    {
+                        "user_id": player.user_id,
+                        "username": player.username,
+                        "turn_order": player.turn_order,
+                        "status": player.status,
+                        "board_numbers": player.board_numbers,
+                        "lines_completed": player.lines_completed,
+                        "rank": player.rank,
+                    }
+                    for player in self.players
+                ],
+            }
+
+    def checkpoint(self):
+        # Caller holds ``lock``; returns a detached copy that is safe to write
+        # from another thread while moves keep being applied.
+        self.dirty = False
+        self.flushed_at = time.monotonic()
+        return {
+            "pk": self.pk,
+            "updated_at": self.updated_at,
+            "status": self.status,
+            "called_sequence": bytes(self.called_numbers),
+            "current_turn_player_id": self.current_turn_player_id,
+            "turn_deadline": self.turn_deadline,
+            "winner_order": list(self.winner_order),
+            "players": [
+                (player.pk, player.user_id, player.status, player.lines_completed, player.rank)
+                for player in self.players
+            ],
+        }
+
+
+class RoomEngine:
+    def __init__(self, flush_interval=FLUSH_INTERVAL_SECONDS):
+        self.flush_interval = flush_interval
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def get(self, room_id):
+        return self._rooms.get(room_id)
+
+    def rooms(self):
+        return list(self._rooms.values())
+
+    def load(self, room_id):
+        state = self._rooms.get(room_id)
+        if state is not None:
+            return state
+
+        room = Room.objects.select_related("owner").prefetch_related("players__user").get(room_id=room_id)
+        if room.status != GameStatus.STARTED:
+            return None
+
+        state = RoomState(room, sorted(room.players.all(), key=lambda entry: entry.turn_order))
+        with self._lock:
+            return self._rooms.setdefault(room_id, state)
+
+    def discard(self, room_id):
+        with self._lock:
+            self._rooms.pop(room_id, None)
+
+    def flush_due(self, state):
+        return state.dirty and (
+            state.status == GameStatus.ENDED or time.monotonic() - state.flushed_at >= self.flush_interval
+        )
+
+    def flush(self, state):
+        with state.lock:
+            if not state.dirty:
+                return False
+            record = state.checkpoint()
+
+        try:
+            state.updated_at = self._write(record)
+        except StaleRoomState:
+            # Something else wrote the room; this copy must not be used again.
+            self.discard(state.room_id)
+            raise
+        except Exception:
+            state.dirty = True
+            raise
+
+        if record["status"] == GameStatus.ENDED:
+            self.discard(state.room_id)
+        return True
+
+    def flush_all(self):
+        """Write every dirty room, for a worker that is shutting down."""
+        for state in self.rooms():
+            try:
+                self.flush(state)
+            except Exception:
+                logger.exception("Final checkpoint of room %s failed", state.room_id)
+
+    def _write(self, record):
+        entries = [
+            RoomPlayer(pk=pk, user_id=user_id, status=status, lines_completed=lines_completed, rank=rank)
+            for pk, user_id, status, lines_completed, rank in record["players"]
+        ]
+
+        updated_at = timezone.now()
+        with transaction.atomic():
+            written = Room.objects.filter(pk=record["pk"], updated_at=record["updated_at"]).update(
+                status=record["status"],
+                called_sequence=record["called_sequence"],
+                current_turn_player_id=record["current_turn_player_id"],
+                turn_deadline=record["turn_deadline"],
+                winner_order=record["winner_order"],
+                updated_at=updated_at,
+            )
+            if not written:
+                raise StaleRoomState(record["pk"])
+            RoomPlayer.objects.bulk_update(entries, ["status", "lines_completed", "rank"])
+            if record["status"] == GameStatus.ENDED:
+                log_game_result(
+                    record["pk"],
+                    GameType.BINGO,
+                    [(entry.user_id, bingo_outcome(entry.rank), entry.rank) for entry in entries],
+                )
+        return updated_at
+
+
+engine = RoomEngine()
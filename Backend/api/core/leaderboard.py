@@ -0,0 +1,366 @@
+import bisect
+import json
+import threading
+import time
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Profile
+
+PROFILE_FIELDS = (
+    "user_id", "user__username", "total_matches", "wins", "second_place", "losses", "points", "updated_at"
+)
+# Other processes (another worker's aggregator, the aggregate_results
+# command) change profiles too; a local board picks those up by updated_at
+# at most this often.
+LEADERBOARD_SYNC_SECONDS = 2.0
+# updated_at is stamped before commit, so a change stamped just before the
+# newest one seen can still land after it.
+SYNC_OVERLAP_SECONDS = 10.0
+
+
+def _score(win_rate, points):
+    # Win rate to 0.01% in the high digits, points below it. Both backends rank
+    # by this, then by user id, so they agree on ties.
+    return round(win_rate * 100) * 10**9 + min(points, 10**9 - 1)
+
+
+def _entry(values):
+    total = values["total_matches"]
+    win_rate = values["wins"] * 100.0 / total if total else 0.0
+    row = {
+        "username": values["user__username"],
+        "total_matches": total,
+        "wins": values["wins"],
+        "second_place": values["second_place"],
+        "losses": values["losses"],
+        "points": values["points"],
+        "win_rate": round(win_rate, 2),
+    }
+    return values["user_id"], win_rate, row
+
+
+def _profile_values(user_ids=None, since=None):
+    queryset = Profile.objects.all()
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    if since is not None:
+        queryset = queryset.filter(updated_at__gte=since)
+    return queryset.values(*PROFILE_FIELDS).iterator(chunk_size=2000)
+
+
+class SortedKeys:
+    """Sorted unique keys held in short runs.
+
+    Adding or removing a key shifts one run instead of the whole list. A
+    Fenwick tree over the run lengths finds a key's position, or the key at a
+    position, in O(log runs); it is only rebuilt when a run splits or empties.
+    """
+
+    RUN = 512
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self._runs = [keys[start:start + self.RUN] for start in range(0, len(keys), self.RUN)]
+        self._maxes = [run[-1] for run in self._runs]
+        self._len = len(keys)
+        self._rebuild()
+
+    def __len__(self):
+        return self._len
+
+    def _rebuild(self):
+        tree = [0] + [len(run) for run in self._runs]
+        for idx in range(1, len(tree)):
+            parent = idx + (idx & -idx)
+            if parent < len(tree):
+                tree[parent] += tree[idx]
+        self._tree = tree
+
+    def _resize(self, run_idx, delta):
+        self._len += delta
+        idx = run_idx + 1
+        while idx < len(self._tree):
+            self._tree[idx] += delta
+            idx += idx & -idx
+
+    def _ahead(self, run_idx):
+        # Keys in the runs before ``run_idx``.
+        total = 0
+        while run_idx:
+            total += self._tree[run_idx]
+            run_idx -= run_idx & -run_idx
+        return total
+
+    def _locate(self, position):
+        # The run holding ``position`` and the position within it.
+        run_idx = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = run_idx + step
+            if nxt < len(self._tree) and self._tree[nxt] <= position:
+                run_idx = nxt
+                position -= self._tree[nxt]
+            step >>= 1
+        return run_idx, position
+
+    def add(self, key):
+        if not self._runs:
+            self._runs.append([key])
+            self._maxes.append(key)
+            self._len = 1
+            self._rebuild()
+            return
+        idx = min(bisect.bisect_left(self._maxes, key), len(self._runs) - 1)
+        run = self._runs[idx]
+        bisect.insort(run, key)
+        self._maxes[idx] = run[-1]
+        if len(run) > 2 * self.RUN:
+            self._runs[idx:idx + 1] = [run[:self.RUN], run[self.RUN:]]
+            self._maxes[idx:idx + 1] = [run[self.RUN - 1], run[-1]]
+            self._len += 1
+            self._rebuild()
+        else:
+            self._resize(idx, 1)
+
+    def remove(self, key):
+        idx = bisect.bisect_left(self._maxes, key)
+        run = self._runs[idx]
+        del run[bisect.bisect_left(run, key)]
+        if run:
+            self._maxes[idx] = run[-1]
+            self._resize(idx, -1)
+        else:
+            del self._runs[idx]
+            del self._maxes[idx]
+            self._len -= 1
+            self._rebuild()
+
+    def index(self, key):
+        idx = bisect.bisect_left(self._maxes, key)
+        ahead = self._ahead(idx)
+        if idx == len(self._runs):
+            return ahead
+        return ahead + bisect.bisect_left(self._runs[idx], key)
+
+    def slice(self, start, stop):
+        stop = min(stop, self._len)
+        if start >= stop:
+            return []
+        idx, offset = self._locate(start)
+        keys = []
+        while len(keys) < stop - start:
+            keys.extend(self._runs[idx][offset:offset + stop - start - len(keys)])
+            idx += 1
+            offset = 0
+        return keys
+
+
+class LocalLeaderboard:
+    """Profiles kept sorted by win rate then points, like the old query.
+
+    Reads and writes find their place in the sorted keys in O(log runs) and
+    touch one run each, and writes only the profiles that changed. Changes
+    made in this process arrive through the signals below; reads also pick up
+    rows other processes changed, by updated_at, every ``sync_interval``
+    seconds.
+    """
+
+    def __init__(self, sync_interval=LEADERBOARD_SYNC_SECONDS, clock=time.monotonic):
+        self.sync_interval = sync_interval
+        self.clock = clock
+        self._keys = SortedKeys()
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._seen = None
+        self._synced_at = 0.0
+
+    @staticmethod
+    def _key(user_id, win_rate, row):
+        return (-_score(win_rate, row["points"]), user_id)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            self._sync()
+            return
+        rows = list(_profile_values())
+        with self._lock:
+            if self._loaded:
+                return
+            for user_id, win_rate, row in map(_entry, rows):
+                self._entries[user_id] = (self._key(user_id, win_rate, row), row)
+            self._keys = SortedKeys(key for key, _ in self._entries.values())
+            self._seen = max((values["updated_at"] for values in rows), default=None)
+            self._synced_at = self.clock()
+            self._loaded = True
+
+    def _sync(self):
+        now = self.clock()
+        if now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        since = self._seen - timedelta(seconds=SYNC_OVERLAP_SECONDS) if self._seen else None
+        rows = list(_profile_values(since=since))
+        if not rows:
+            return
+        with self._lock:
+            if not self._loaded:
+                return
+            self._apply({values["user_id"] for values in rows}, map(_entry, rows))
+            newest = max(values["updated_at"] for values in rows)
+            if self._seen is None or newest > self._seen:
+                self._seen = newest
+
+    def _apply(self, user_ids, entries):
+        # Caller holds ``_lock``.
+        for user_id in user_ids:
+            self._discard(user_id)
+        for user_id, win_rate, row in entries:
+            key = self._key(user_id, win_rate, row)
+            self._entries[user_id] = (key, row)
+            self._keys.add(key)
+
+    def _discard(self, user_id):
+        current = self._entries.pop(user_id, None)
+        if current is not None:
+            self._keys.remove(current[0])
+
+    def refresh(self, user_ids):
+        if not self._loaded:
+            return
+        user_ids = set(user_ids)
+        entries = [_entry(values) for values in _profile_values(user_ids)]
+        with self._lock:
+            self._apply(user_ids, entries)
+
+    def remove(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._discard(user_id)
+
+    def reload(self):
+        with self._lock:
+            self._keys = SortedKeys()
+            self._entries = {}
+            self._loaded = False
+            self._seen = None
+
+    def page(self, offset, limit):
+        self._ensure_loaded()
+        with self._lock:
+            keys = self._keys.slice(offset, offset + limit)
+            return [
+                {**self._entries[key[1]][1], "rank": offset + idx + 1}
+                for idx, key in enumerate(keys)
+            ]
+
+    def entry(self, user_id):
+        self._ensure_loaded()
+        with self._lock:
+            current = self._entries.get(user_id)
+            if current is None:
+                return None
+            key, row = current
+            return {**row, "rank": self._keys.index(key) + 1}
+
+
+class RedisLeaderboard:
+    """The same leaderboard as a sorted set, shared by every worker.
+
+    Scores are negated and members are zero-padded user ids, so ascending
+    order breaks ties by user id the way ``LocalLeaderboard`` does.
+    """
+
+    SCORES = "leaderboard:v2:scores"
+    ROWS = "leaderboard:v2:rows"
+    LOADED = "leaderboard:v2:loaded"
+
+    def __init__(self, url):
+        from redis import Redis
+
+        self._redis = Redis.from_url(url)
+
+    @staticmethod
+    def _member(user_id):
+        return f"{user_id:012d}"
+
+    def _write(self, pipe, entries):
+        for user_id, win_rate, row in entries:
+            member = self._member(user_id)
+            pipe.zadd(self.SCORES, {member: -_score(win_rate, row["points"])})
+            pipe.hset(self.ROWS, member, json.dumps(row))
+
+    def _ensure_loaded(self):
+        if self._redis.exists(self.LOADED):
+            return
+        pipe = self._redis.pipeline()
+        self._write(pipe, (_entry(values) for values in _profile_values()))
+        pipe.set(self.LOADED, 1)
+        pipe.execute()
+
+    def refresh(self, user_ids):
+        if not self._redis.exists(self.LOADED):
+            return
+        pipe = self._redis.pipeline()
+        self._write(pipe, (_entry(values) for values in _profile_values(set(user_ids))))
+        pipe.execute()
+
+    def remove(self, user_ids):
+        members = [self._member(user_id) for user_id in user_ids]
+        if members:
+            pipe = self._redis.pipeline()
+            pipe.zrem(self.SCORES, *members)
+            pipe.hdel(self.ROWS, *members)
+            pipe.execute()
+
+    def reload(self):
+        self._redis.delete(self.LOADED, self.SCORES, self.ROWS)
+
+    def page(self, offset, limit):
+        self._ensure_loaded()
+        members = self._redis.zrange(self.SCORES, offset, offset + limit - 1)
+        if not members:
+            return []
+        rows = self._redis.hmget(self.ROWS, members)
+        return [
+            {**json.loads(row), "rank": offset + idx + 1}
+            for idx, row in enumerate(rows)
+            if row is not None
+        ]
+
+    def entry(self, user_id):
+        self._ensure_loaded()
+        pipe = self._redis.pipeline()
+        member = self._member(user_id)
+        pipe.zrank(self.SCORES, member)
+        pipe.hget(self.ROWS, member)
+        rank, row = pipe.execute()
+        if rank is None or row is None:
+            return None
+        return {**json.loads(row), "rank": rank + 1}
+
+
+def get_leaderboard():
+    url = getattr(settings, "LEADERBOARD_REDIS_URL", None)
+    if url:
+        return RedisLeaderboard(url)
+    return LocalLeaderboard()
+
+
+board = get_leaderboard()
+
+
+@receiver(post_save, sender=Profile)
+def refresh_leaderboard_entry(sender, instance, **kwargs):
+    transaction.on_commit(partial(board.refresh, [instance.user_id]))
+
+
+@receiver(post_delete, sender=Profile)
+def remove_leaderboard_entry(sender, instance, **kwargs):
+    transaction.on_commit(partial(board.remove, [instance.user_id]))
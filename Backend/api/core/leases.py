@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# How long past a deadline the owner keeps its lease before a standby worker
+# may take the room over.
+LEASE_MARGIN_SECONDS = 3.0
+# A started Bingo room's engine state lives in one process, which renews its
+# lease on moves and skips; the turn timer keeps those coming well within it.
+OWNER_LEASE_SECONDS = 15.0
+OWNER_REPLY_SECONDS = 5.0
+
+_ACQUIRE_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current == false or current == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LocalLeaseBackend:
+    """In-process stand-in for the Redis backend, for single workers and tests."""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._leases = {}
+
+    async def acquire(self, key, owner, ttl):
+        now = self.clock()
+        current = self._leases.get(key)
+        if current is not None and current[0] != owner and current[1] > now:
+            return False
+        self._leases[key] = (owner, now + ttl)
+        return True
+
+    async def release(self, key, owner):
+        current = self._leases.get(key)
+        if current is not None and current[0] == owner:
+            del self._leases[key]
+
+    async def get(self, key):
+        current = self._leases.get(key)
+        if current is None or current[1] <= self.clock():
+            return None
+        return current[0]
+
+
+class RedisLeaseBackend:
+    def __init__(self, url):
+        from redis.asyncio import Redis
+
+        self._redis = Redis.from_url(url)
+        self._acquire = self._redis.register_script(_ACQUIRE_SCRIPT)
+        self._release = self._redis.register_script(_RELEASE_SCRIPT)
+
+    async def acquire(self, key, owner, ttl):
+        return bool(await self._acquire(keys=[key], args=[owner, max(int(ttl * 1000), 1)]))
+
+    async def release(self, key, owner):
+        await self._release(keys=[key], args=[owner])
+
+    async def get(self, key):
+        value = await self._redis.get(key)
+        return value.decode() if value is not None else None
+
+
+class DeadlineLeases:
+    """Decides which worker fires a room's turn deadline.
+
+    The worker that claims the lease schedules the deadline itself; the others
+    keep a standby timer that only fires if the lease lapses, which happens
+    when the owner dies before moving the deadline on.
+    """
+
+    def __init__(self, backend, owner=None, margin=LEASE_MARGIN_SECONDS, clock=time.time):
+        self.backend = backend
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.margin = margin
+        self.clock = clock
+
+    @staticmethod
+    def key(room_id):
+        return f"turn-deadline:{room_id}"
+
+    async def claim(self, room_id, deadline_iso):
+        remaining = datetime.fromisoformat(deadline_iso).timestamp() - self.clock()
+        try:
+            return await self.backend.acquire(self.key(room_id), self.owner, max(remaining, 0) + self.margin)
+        except Exception:
+            # Firing twice is safe, the skip checks the expected deadline;
+            # never firing would stall the room.
+            logger.exception("Could not claim turn deadline lease for %s", room_id)
+            return True
+
+    async def release(self, room_id):
+        try:
+            await self.backend.release(self.key(room_id), self.owner)
+        except Exception:
+            logger.exception("Could not release turn deadline lease for %s", room_id)
+
+
+class RoomOwnedElsewhere(Exception):
+    def __init__(self, owner):
+        super().__init__(owner)
+        self.owner = owner
+
+
+class RoomOwners:
+    """Which process holds each started Bingo room's engine state.
+
+    The lease value is the owner's command channel, so another process
+    forwards the room's commands there with ``ask`` instead of loading a
+    second copy of the room.
+    """
+
+    def __init__(self, backend, ttl=OWNER_LEASE_SECONDS, clock=time.time):
+        self.backend = backend
+        self.ttl = ttl
+        self.clock = clock
+        self.channel = None
+        self._renew_at = {}
+        self._task = None
+
+    @staticmethod
+    def key(room_id):
+        return f"room-owner:{room_id}"
+
+    async def listen(self, channel_layer, handler):
+        """Serve forwarded commands with ``handler(message)``, which returns the reply."""
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._task.get_loop() is loop:
+            return
+        if self.channel is None:
+            self.channel = await channel_layer.new_channel()
+        self._task = loop.create_task(self._receive(channel_layer, handler))
+
+    async def claim(self, room_id):
+        """True while this process holds the room, taking it when nobody does."""
+        if self.clock() < self._renew_at.get(room_id, 0):
+            return True
+        try:
+            held = await self.backend.acquire(self.key(room_id), self.channel, self.ttl)
+        except Exception:
+            # The compare-and-set on checkpoints still catches a second copy.
+            logger.exception("Could not claim room owner lease for %s", room_id)
+            return True
+        if held:
+            self._renew_at[room_id] = self.clock() + self.ttl / 2
+        else:
+            self._renew_at.pop(room_id, None)
+        return held
+
+    async def owner(self, room_id):
+        try:
+            return await self.backend.get(self.key(room_id))
+        except Exception:
+            logger.exception("Could not look up the owner of %s", room_id)
+            return None
+
+    async def release(self, room_id):
+        self._renew_at.pop(room_id, None)
+        try:
+            await self.backend.release(self.key(room_id), self.channel)
+        except Exception:
+            logger.exception("Could not release room owner lease for %s", room_id)
+
+    async def ask(self, channel_layer, owner, message, timeout=OWNER_REPLY_SECONDS):
+        """Send ``message`` to the owner's channel; its reply, or None if none came in time."""
+        reply_to = await channel_layer.new_channel()
+        await channel_layer.send(owner, {**message, "type": "room.command", "reply_to": reply_to})
+        try:
+            return await asyncio.wait_for(channel_layer.receive(reply_to), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("No reply from the owner of %s", message.get("room_id"))
+            return None
+
+    async def _receive(self, channel_layer, handler):
+        while True:
+            message = await channel_layer.receive(self.channel)
+            asyncio.ensure_future(self._answer(channel_layer, handler, message))
+
+    async def _answer(self, channel_layer, handler, message):
+        try:
+            reply = await handler(message)
+        except Exception:
+            logger.exception("Forwarded %s for %s failed", message.get("action"), message.get("room_id"))
+            reply = {"error": "Room command failed"}
+        await channel_layer.send(message["reply_to"], {**reply, "type": "room.reply"})
+
+
+def get_lease_backend():
+    url = getattr(settings, "TURN_LEASE_REDIS_URL", None)
+    if url:
+        return RedisLeaseBackend(url)
+    return LocalLeaseBackend()
+
+
+_backend = get_lease_backend()
+leases = DeadlineLeases(_backend)
+owners = RoomOwners(_backend)
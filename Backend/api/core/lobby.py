@@ -0,0 +1,59 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db.models import Count, F
+
+from .codec import dumps
+from .models import GameStatus, Room
+from .serializers import lobby_room_data
+
+LOBBY_PAGE_SIZE = 20
+LOBBY_MAX_PAGE_SIZE = 100
+
+
+def lobby_group(game_type):
+    return f"lobby_{game_type}"
+
+
+def open_rooms(game_type=None, cursor=None, limit=LOBBY_PAGE_SIZE):
+    """WAITING rooms with a free seat, newest first; returns (entries, next cursor).
+
+    The cursor is the id of the last room on the page, so pages stay stable
+    while rooms open and fill, and each page walks the open-rooms index.
+    """
+    rooms = (
+        Room.objects.filter(status=GameStatus.WAITING)
+        .annotate(current_players=Count("players"))
+        .filter(current_players__lt=F("max_players"))
+        .select_related("owner")
+        .order_by("-id")
+    )
+    if game_type:
+        rooms = rooms.filter(game_type=game_type)
+    if cursor:
+        rooms = rooms.filter(id__lt=cursor)
+
+    rooms = list(rooms[: limit + 1])
+    next_cursor = rooms[limit - 1].id if len(rooms) > limit else None
+    return [lobby_room_data(room, room.current_players) for room in rooms[:limit]], next_cursor
+
+
+def _lobby_message(room_id, game_type, entry):
+    # ``room`` is None once the room is no longer joinable.
+    payload = {"type": "lobby_room", "room_id": room_id, "game_type": game_type, "room": entry}
+    return {"type": "lobby.event", "text": dumps(payload)}
+
+
+def publish_room(room, current_players):
+    """Push a room's lobby entry, or its removal once full or started, to lobby sockets."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    entry = None
+    if room.status == GameStatus.WAITING and current_players < room.max_players:
+        entry = lobby_room_data(room, current_players)
+    async_to_sync(channel_layer.group_send)(lobby_group(room.game_type), _lobby_message(room.room_id, room.game_type, entry))
+
+
+async def publish_closed(channel_layer, room_id, game_type):
+    await channel_layer.group_send(lobby_group(game_type), _lobby_message(room_id, game_type, None))
+
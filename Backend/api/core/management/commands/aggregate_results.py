@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.results import AGGREGATE_BATCH_SIZE, AGGREGATE_INTERVAL_SECONDS, aggregate_pending, rebuild_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold logged game results into profile stats, or rebuild the stats from the log. "
+        "Without LEADERBOARD_REDIS_URL, web workers' leaderboards pick the changes up within "
+        "a couple of seconds of their next read."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=AGGREGATE_BATCH_SIZE)
+        parser.add_argument("--loop", action="store_true", help="Keep polling for new results.")
+        parser.add_argument("--interval", type=float, default=AGGREGATE_INTERVAL_SECONDS)
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Zero every profile and replay the whole log. Stats from before the log existed are lost.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if options["rebuild"]:
+            replayed = rebuild_stats(batch_size)
+            self.stdout.write(f"Replayed {replayed} results")
+            return
+
+        while True:
+            total = 0
+            while True:
+                processed = aggregate_pending(batch_size)
+                total += processed
+                if processed < batch_size:
+                    break
+            if total:
+                self.stdout.write(f"Aggregated {total} results")
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,117 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+
+from core.management.testdb import throwaway_database
+from core.models import GameStatus, GameType, Room, RoomPlayer
+
+
+def _create_rooms(count):
+    users = User.objects.bulk_create([User(username=f"bench{idx}") for idx in range(count * 2)])
+    rooms = Room.objects.bulk_create(
+        [
+            Room(
+                room_id=f"B{idx:05d}",
+                owner=users[idx * 2],
+                max_players=2,
+                game_type=GameType.OXO,
+                status=GameStatus.STARTED,
+                called_numbers=[None] * 9,
+                current_turn_player=users[idx * 2],
+            )
+            for idx in range(count)
+        ]
+    )
+    RoomPlayer.objects.bulk_create(
+        [
+            RoomPlayer(room=room, user=users[idx * 2 + seat], turn_order=seat + 1)
+            for idx, room in enumerate(rooms)
+            for seat in range(2)
+        ]
+    )
+    return [room.room_id for room in rooms]
+
+
+def _move(room_id, cell):
+    # The same statements as an OXO move: lock the room, read the players,
+    # write the board and turn, then read the snapshot back.
+    with transaction.atomic():
+        room = Room.objects.select_for_update().get(room_id=room_id)
+        players = list(room.players.select_related("user").order_by("turn_order"))
+        board = room.called_numbers
+        if all(value is not None for value in board):
+            board = [None] * 9
+        board[cell % 9] = room.current_turn_player_id
+        room.called_numbers = board
+        room.current_turn_player = next(p.user for p in players if p.user_id != room.current_turn_player_id)
+        room.turn_deadline = timezone.now() + timedelta(seconds=30)
+        room.save()
+    room = Room.objects.select_related("owner", "current_turn_player").prefetch_related("players__user").get(room_id=room_id)
+    return len(room.players.all())
+
+
+class Command(BaseCommand):
+    help = "Measure concurrent move throughput on the configured database backend, in a throwaway test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rooms", type=int, default=20)
+        parser.add_argument("--moves", type=int, default=50, help="Moves per room.")
+        parser.add_argument("--threads", type=int, default=20)
+        parser.add_argument("--fail-on-errors", action="store_true", help="Exit non-zero if any move failed.")
+
+    def handle(self, *args, **options):
+        with throwaway_database("bench_db"):
+            self._run(connection.vendor, options)
+
+    def _run(self, vendor, options):
+        room_ids = _create_rooms(options["rooms"])
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def play(room_id):
+            try:
+                for cell in range(options["moves"]):
+                    started = time.perf_counter()
+                    try:
+                        _move(room_id, cell)
+                    except OperationalError as exc:
+                        with lock:
+                            errors.append(str(exc))
+                        continue
+                    with lock:
+                        latencies.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["threads"]) as pool:
+            list(pool.map(play, room_ids))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000
+
+        self.stdout.write(f"backend      {vendor}")
+        self.stdout.write(f"rooms        {options['rooms']} x {options['moves']} moves, {options['threads']} threads")
+        self.stdout.write(f"moves/s      {len(latencies) / elapsed:.1f}")
+        self.stdout.write(
+            f"latency ms   p50 {percentile(0.5):.2f}  p95 {percentile(0.95):.2f}  p99 {percentile(0.99):.2f}"
+            f"  mean {statistics.fmean(latencies) * 1000 if latencies else 0.0:.2f}"
+        )
+        self.stdout.write(f"errors       {len(errors)}")
+        for message in sorted(set(errors))[:5]:
+            self.stdout.write(f"  {message}")
+        if errors and options["fail_on_errors"]:
+            raise CommandError(f"{len(errors)} moves failed")
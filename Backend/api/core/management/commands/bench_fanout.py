@@ -0,0 +1,101 @@
+import asyncio
+import random
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from core.codec import get_dumps
+
+
+def _payload(players):
+    # A Bingo room_snapshot-shaped event; more players means a bigger frame.
+    numbers = list(range(1, 26))
+    return {
+        "type": "room_snapshot",
+        "data": {
+            "room_id": "ABC123",
+            "owner_id": 1,
+            "owner_username": "player1",
+            "status": "STARTED",
+            "max_players": players,
+            "current_turn_player_id": 1,
+            "current_turn_username": "player1",
+            "called_numbers": random.sample(numbers, 12),
+            "turn_deadline": "2026-01-01T12:00:10.000000+00:00",
+            "winner_order": [],
+            "players": [
+                {
+                    "user_id": idx,
+                    "username": f"player{idx}",
+                    "turn_order": idx,
+                    "status": "PLAYING",
+                    "board_numbers": random.sample(numbers, 25),
+                    "lines_completed": 2,
+                    "rank": None,
+                }
+                for idx in range(1, players + 1)
+            ],
+        },
+    }
+
+
+async def _fanout(group_size, payload, dumps, events, pre_encoded):
+    layer = InMemoryChannelLayer(capacity=events + 1)
+    channels = [await layer.new_channel() for _ in range(group_size)]
+    for channel in channels:
+        await layer.group_add("room", channel)
+
+    sent = 0
+    started = time.process_time()
+    for _ in range(events):
+        if pre_encoded:
+            await layer.group_send("room", {"type": "room.event", "text": dumps(payload)})
+        else:
+            await layer.group_send("room", {"type": "room.event", "payload": payload})
+        for channel in channels:
+            event = await layer.receive(channel)
+            # What room_event hands to the socket.
+            text = event["text"] if pre_encoded else dumps(event["payload"])
+            sent += len(text)
+    return time.process_time() - started, sent
+
+
+class Command(BaseCommand):
+    help = "Measure CPU per group event: encoding per socket vs once at the sender."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=200)
+        parser.add_argument("--group-sizes", default="2,5,20,100")
+        parser.add_argument("--players", default="2,5,20", help="Players per snapshot, which sets the payload size.")
+        parser.add_argument("--codecs", default="json,ujson,orjson")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        events = options["events"]
+        group_sizes = [int(size) for size in options["group_sizes"].split(",")]
+        payloads = [_payload(int(players)) for players in options["players"].split(",")]
+
+        codecs = []
+        for name in options["codecs"].split(","):
+            try:
+                codecs.append((name, get_dumps(name)))
+            except ImportError:
+                self.stdout.write(f"skipping {name}: not installed")
+
+        baseline = get_dumps("json")
+        self.stdout.write(
+            f"{'codec':>7} {'group':>5} {'bytes':>6} {'per-socket us/event':>20} {'pre-encoded us/event':>21} {'speedup':>8}"
+        )
+        for name, dumps in codecs:
+            for payload in payloads:
+                size = len(baseline(payload))
+                for group_size in group_sizes:
+                    per_socket, per_socket_bytes = asyncio.run(_fanout(group_size, payload, dumps, events, False))
+                    shared, shared_bytes = asyncio.run(_fanout(group_size, payload, dumps, events, True))
+                    assert per_socket_bytes == shared_bytes
+                    self.stdout.write(
+                        f"{name:>7} {group_size:>5} {size:>6} {per_socket / events * 1e6:>20.1f}"
+                        f" {shared / events * 1e6:>21.1f} {per_socket / shared:>7.1f}x"
+                    )
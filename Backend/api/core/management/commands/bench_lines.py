@@ -0,0 +1,90 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.bingo import BingoBoard, calculate_completed_lines
+
+
+def _set_scan_completed_lines(board_numbers, eliminated_numbers):
+    # The set-and-scan implementation calculate_completed_lines replaced.
+    if len(board_numbers) != 25:
+        return 0
+
+    marked = set(eliminated_numbers)
+    lines = 0
+    for row in range(5):
+        if all(board_numbers[row * 5 + col] in marked for col in range(5)):
+            lines += 1
+    for col in range(5):
+        if all(board_numbers[row * 5 + col] in marked for row in range(5)):
+            lines += 1
+    if all(board_numbers[i * 5 + i] in marked for i in range(5)):
+        lines += 1
+    if all(board_numbers[i * 5 + (4 - i)] in marked for i in range(5)):
+        lines += 1
+    return lines
+
+
+def _shuffled():
+    numbers = list(range(1, 26))
+    random.shuffle(numbers)
+    return numbers
+
+
+class Command(BaseCommand):
+    help = "Compare Bingo line detection strategies over simulated full games."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--games", type=int, default=2000)
+        parser.add_argument("--players", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        games = [
+            ([_shuffled() for _ in range(options["players"])], _shuffled())
+            for _ in range(options["games"])
+        ]
+
+        def per_move_rescan(count_lines):
+            total = 0
+            for boards, calls in games:
+                called = []
+                for number in calls:
+                    called.append(number)
+                    for board in boards:
+                        total += count_lines(board, called)
+            return total
+
+        def incremental():
+            total = 0
+            for boards, calls in games:
+                states = [BingoBoard(board) for board in boards]
+                for number in calls:
+                    for state in states:
+                        state.mark(number)
+                        total += state.completed
+            return total
+
+        results = []
+        for label, run in (
+            ("set scan (previous)", lambda: per_move_rescan(_set_scan_completed_lines)),
+            ("bitmask rescan (wrapper)", lambda: per_move_rescan(calculate_completed_lines)),
+            ("bitmask incremental", incremental),
+        ):
+            started = time.perf_counter()
+            checksum = run()
+            results.append((label, time.perf_counter() - started, checksum))
+
+        checksums = {checksum for _, _, checksum in results}
+        if len(checksums) != 1:
+            self.stderr.write(self.style.ERROR(f"Strategies disagree: {sorted(checksums)}"))
+            return
+
+        moves = options["games"] * 25
+        baseline = results[0][1]
+        for label, elapsed, _ in results:
+            self.stdout.write(
+                f"{label:<26} {elapsed * 1e6 / moves:8.2f} us/move  {baseline / elapsed:5.1f}x"
+            )
@@ -0,0 +1,103 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.management.testdb import throwaway_database
+from core.matchmaking import FILL_WAIT_SECONDS, MATCH_INTERVAL_SECONDS, Matchmaker, create_match_rooms
+from core.models import GameType
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate users arriving in the matchmaking queues and report how fast rooms are formed and written, "
+        "in a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20000)
+        parser.add_argument("--arrivals", type=int, default=1000, help="Users queueing per tick.")
+        parser.add_argument("--bingo-share", type=float, default=0.5, help="Share of users queueing for Bingo.")
+        parser.add_argument("--tick", type=float, default=MATCH_INTERVAL_SECONDS, help="Simulated seconds per tick.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        with throwaway_database("bench_matchmaking"):
+            self._run(connection.vendor, options)
+
+    def _run(self, vendor, options):
+        rng = random.Random(options["seed"])
+        user_ids = [user.pk for user in User.objects.bulk_create(User(username=f"mm{idx}") for idx in range(options["users"]))]
+        clock = SimulatedClock()
+        matchmaker = Matchmaker(clock=clock)
+        queued_at = {}
+        waits = []
+        queries = 0
+        match_seconds = 0.0
+        write_seconds = 0.0
+        rooms = {GameType.BINGO: 0, GameType.OXO: 0}
+        seated = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        pending = iter(user_ids)
+        arrived_all_at = None
+        ticks = 0
+        started = time.perf_counter()
+        while True:
+            tick_started = time.perf_counter()
+            for _ in range(options["arrivals"]):
+                user_id = next(pending, None)
+                if user_id is None:
+                    if arrived_all_at is None:
+                        arrived_all_at = clock.now
+                    break
+                game_type = GameType.BINGO if rng.random() < options["bingo_share"] else GameType.OXO
+                matchmaker.enqueue(user_id, game_type)
+                queued_at[user_id] = clock.now
+            matches = matchmaker.take_matches()
+            match_seconds += time.perf_counter() - tick_started
+
+            if matches:
+                write_started = time.perf_counter()
+                with connection.execute_wrapper(count):
+                    create_match_rooms(matches)
+                write_seconds += time.perf_counter() - write_started
+                for game_type, group in matches:
+                    rooms[game_type] += 1
+                    seated += len(group)
+                    waits.extend(clock.now - queued_at[user_id] for user_id in group)
+            clock.now += options["tick"]
+            ticks += 1
+            # Past the last arrival, run until the leftovers had their fill wait.
+            if arrived_all_at is not None and (
+                seated == len(user_ids) or clock.now - arrived_all_at > FILL_WAIT_SECONDS + options["tick"]
+            ):
+                break
+        elapsed = time.perf_counter() - started
+
+        batches = max(ticks, 1)
+        self.stdout.write(f"backend          {vendor}")
+        self.stdout.write(f"users            {len(user_ids)} ({options['arrivals']} per {options['tick']}s tick)")
+        self.stdout.write(f"rooms            {rooms[GameType.BINGO]} bingo, {rooms[GameType.OXO]} oxo")
+        self.stdout.write(f"seated           {seated}, still queued {len(user_ids) - seated}")
+        self.stdout.write(f"seated/s         {seated / elapsed:.0f} (matching {match_seconds * 1000:.1f} ms, writes {write_seconds * 1000:.1f} ms)")
+        self.stdout.write(f"queries/tick     {queries / batches:.2f}")
+        if waits:
+            waits.sort()
+            self.stdout.write(
+                f"simulated wait s p50 {waits[len(waits) // 2]:.2f}  p95 {waits[int(len(waits) * 0.95)]:.2f}  max {waits[-1]:.2f}"
+            )
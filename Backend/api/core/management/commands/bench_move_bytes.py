@@ -0,0 +1,80 @@
+import random
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.models import GameType, Room
+
+
+class ParamBytes:
+    """Counts the text and binary parameter bytes of every query run under it."""
+
+    def __init__(self):
+        self.total = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        for value in params or ():
+            if isinstance(value, str):
+                self.total += len(value.encode())
+            elif isinstance(value, (bytes, bytearray, memoryview)):
+                self.total += len(value)
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the called-number bytes written per Bingo move: JSON lists vs the packed sequence. "
+        "Runs the real updates against a scratch room and rolls them back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--players", type=int, default=5)
+        parser.add_argument("--moves", type=int, default=25)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        players = options["players"]
+        calls = random.sample(range(1, 26), min(options["moves"], 25))
+
+        with transaction.atomic():
+            owner = User.objects.create(username=f"bench-{uuid.uuid4().hex[:12]}")
+            room = Room.objects.create(
+                room_id=uuid.uuid4().hex[:6].upper(), owner=owner, game_type=GameType.BINGO, max_players=players
+            )
+            rows = self._measure(room.pk, calls, players)
+            transaction.set_rollback(True)
+
+        json_total = 0
+        packed_total = 0
+        self.stdout.write(f"{'move':>4} {'json room+players':>18} {'packed room':>12}")
+        for move, (json_bytes, packed_bytes) in enumerate(rows, start=1):
+            json_total += json_bytes
+            packed_total += packed_bytes
+            if move in (1, 5, 10, 15, 20, 25) or move == len(calls):
+                self.stdout.write(f"{move:>4} {json_bytes:>18} {packed_bytes:>12}")
+
+        moves = len(calls)
+        self.stdout.write(
+            f"avg  {json_total / moves:>18.1f} {packed_total / moves:>12.1f}"
+            f"  ({json_total / packed_total:.1f}x fewer bytes)"
+        )
+
+    def _measure(self, pk, calls, players):
+        rows = []
+        for move in range(1, len(calls) + 1):
+            called = calls[:move]
+            # Before: the room's JSON list plus an identical eliminated_numbers
+            # copy per player, each sent the way a JSONField update sends it.
+            json_bytes = self._update_bytes(pk, called_numbers=called) * (1 + players)
+            packed_bytes = self._update_bytes(pk, called_sequence=bytes(called))
+            rows.append((json_bytes, packed_bytes))
+        return rows
+
+    def _update_bytes(self, pk, **fields):
+        counter = ParamBytes()
+        with connection.execute_wrapper(counter):
+            Room.objects.filter(pk=pk).update(**fields)
+        return counter.total
@@ -0,0 +1,296 @@
+import asyncio
+import json
+import random
+import time
+
+from asgiref.sync import sync_to_async
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+
+from core.management.testdb import throwaway_database
+from core.writers import deferred_sqlite, writers
+
+RECEIVE_TIMEOUT_SECONDS = 10
+
+
+def _percentiles(samples):
+    if not samples:
+        return {"count": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    samples = sorted(samples)
+
+    def at(p):
+        return round(samples[min(int(len(samples) * p), len(samples) - 1)] * 1000, 3)
+
+    return {"count": len(samples), "p50": at(0.5), "p95": at(0.95), "p99": at(0.99), "max": round(samples[-1] * 1000, 3)}
+
+
+class QueryCounter:
+    """Counts queries on every connection opened while it is installed."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def attach(self, sender, connection, **kwargs):
+        # The wrapper outlives reconnects of the same thread's connection.
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def install(self):
+        connection.execute_wrappers.append(self)
+        connection_created.connect(self.attach)
+
+    def uninstall(self):
+        connection_created.disconnect(self.attach)
+
+
+class Game:
+    """Client-side view of a room, enough to pick legal moves."""
+
+    def __init__(self, kind, room_id, players, rng):
+        self.kind = kind
+        self.room_id = room_id
+        self.players = players
+        self.rng = rng
+        self.current = None
+        self.taken = set()
+        self.ended = False
+
+    @property
+    def path(self):
+        prefix = "gamify" if self.kind == "BINGO" else "oxo"
+        return f"/ws/{prefix}/{self.room_id}/"
+
+    def apply(self, message):
+        if self.kind == "BINGO":
+            delta = message["delta"]
+            self.taken.update(delta.get("called_numbers", ()))
+            if "number" in delta:
+                self.taken.add(delta["number"])
+        else:
+            delta = message["data"]
+            self.taken = {idx for idx, cell in enumerate(delta["called_numbers"]) if cell is not None}
+        self.current = delta["current_turn_player_id"]
+        self.ended = message["type"] == "game_ended" or delta["status"] == "ENDED"
+
+    def next_move(self):
+        choices = range(1, 26) if self.kind == "BINGO" else range(9)
+        return self.rng.choice([value for value in choices if value not in self.taken])
+
+
+class Command(BaseCommand):
+    help = (
+        "Play concurrent Bingo and OXO games through the ASGI application and report move latency, "
+        "broadcast latency, queries per move and throughput. Runs against a throwaway database; "
+        "e.g. `manage.py loadtest --bingo-rooms 1 --oxo-rooms 1 --max-errors 0` as a smoke test, "
+        "which core.tests also runs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bingo-rooms", type=int, default=20)
+        parser.add_argument("--bingo-players", type=int, default=4)
+        parser.add_argument("--oxo-rooms", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+        parser.add_argument("--output", help="Also write the JSON results to this file.")
+        parser.add_argument("--max-errors", type=int, default=None, help="Exit non-zero above this many errors.")
+
+    def handle(self, *args, **options):
+        if not 2 <= options["bingo_players"] <= 5:
+            raise CommandError("--bingo-players must be between 2 and 5")
+
+        # Hashing passwords is not what is being measured.
+        with throwaway_database("loadtest"), override_settings(
+            PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"]
+        ):
+            results = asyncio.run(self._run(options))
+            writers.shutdown()
+
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self._report(results)
+        if options["max_errors"] is not None and results["errors"] > options["max_errors"]:
+            raise CommandError(f"{results['errors']} errors")
+
+    async def _run(self, options):
+        from api.asgi import application
+
+        self.application = application
+        self.rng = random.Random(options["seed"])
+        self.errors = []
+        self.move_latency = []
+        self.broadcast_latency = []
+        self.moves = 0
+        counter = QueryCounter()
+        counter.install()
+
+        try:
+            specs = [("BINGO", options["bingo_players"])] * options["bingo_rooms"] + [("OXO", 2)] * options["oxo_rooms"]
+            started = time.perf_counter()
+            setups = [self._setup(idx, kind, players) for idx, (kind, players) in enumerate(specs)]
+            if deferred_sqlite():
+                # Concurrent joins there fail with "database is locked" rather
+                # than wait; setup is not what is measured, so it runs in turn.
+                games = [await setup for setup in setups]
+            else:
+                games = await asyncio.gather(*setups)
+            games = [game for game in games if game is not None]
+            setup_seconds = time.perf_counter() - started
+            setup_queries = counter.count
+
+            counter.count = 0
+            started = time.perf_counter()
+            sockets = await asyncio.gather(*(self._connect(game) for game in games))
+            connect_seconds = time.perf_counter() - started
+            connect_queries = counter.count
+
+            counter.count = 0
+            started = time.perf_counter()
+            finished = await asyncio.gather(*(self._play(game, comms) for game, comms in zip(games, sockets) if comms))
+            play_seconds = time.perf_counter() - started
+            play_queries = counter.count
+
+            for comms in sockets:
+                for comm in comms or ():
+                    try:
+                        await comm.disconnect()
+                    except (Exception, asyncio.CancelledError) as exc:
+                        self.errors.append(f"disconnect: {exc!r}")
+            await sync_to_async(connections.close_all)()
+        finally:
+            counter.uninstall()
+
+        return {
+            "backend": connection.vendor,
+            "rooms": {"bingo": options["bingo_rooms"], "oxo": options["oxo_rooms"]},
+            "bingo_players": options["bingo_players"],
+            "seed": options["seed"],
+            "games_completed": sum(finished),
+            "moves": self.moves,
+            "setup_seconds": round(setup_seconds, 3),
+            "setup_queries": setup_queries,
+            "connect_seconds": round(connect_seconds, 3),
+            "queries_per_connect": round(connect_queries / max(sum(len(c or ()) for c in sockets), 1), 3),
+            "play_seconds": round(play_seconds, 3),
+            "moves_per_second": round(self.moves / play_seconds, 1) if play_seconds else 0.0,
+            "queries_per_move": round(play_queries / self.moves, 3) if self.moves else 0.0,
+            "move_latency_ms": _percentiles(self.move_latency),
+            "broadcast_latency_ms": _percentiles(self.broadcast_latency),
+            "errors": len(self.errors),
+            "error_samples": sorted(set(self.errors))[:10],
+        }
+
+    async def _request(self, method, path, body=None, token=None):
+        content = json.dumps(body or {}).encode()
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(content)).encode())]
+        if token:
+            headers.append((b"authorization", f"Bearer {token}".encode()))
+        communicator = HttpCommunicator(self.application, method, path, body=content, headers=headers)
+        response = await communicator.get_response(timeout=RECEIVE_TIMEOUT_SECONDS)
+        # Let the handler's disconnect listener finish like a closed client.
+        await communicator.send_input({"type": "http.disconnect"})
+        await communicator.wait(timeout=RECEIVE_TIMEOUT_SECONDS)
+        return response["status"], json.loads(response["body"] or b"null")
+
+    async def _user(self, name):
+        status, user = await self._request("POST", "/register/", {"username": name, "password": "load-test-pw"})
+        if status != 201:
+            raise RuntimeError(f"register {status}: {user}")
+        status, body = await self._request("POST", "/login/", {"username": name, "password": "load-test-pw"})
+        if status != 200:
+            raise RuntimeError(f"login {status}: {body}")
+        return user["id"], body["access"]
+
+    async def _setup(self, idx, kind, player_count):
+        try:
+            players = [await self._user(f"load{idx}_{seat}") for seat in range(player_count)]
+            status, room = await self._request(
+                "POST", "/rooms/create/", {"game_type": kind, "max_players": player_count}, players[0][1]
+            )
+            if status != 201:
+                raise RuntimeError(f"create {status}: {room}")
+            for _, token in players[1:]:
+                status, room = await self._request("POST", "/rooms/join/", {"room_id": room["room_id"]}, token)
+                if status != 200:
+                    raise RuntimeError(f"join {status}: {room}")
+        except Exception as exc:
+            self.errors.append(f"setup: {exc}")
+            return None
+        return Game(kind, room["room_id"], players, random.Random(self.rng.random()))
+
+    async def _connect(self, game):
+        comms = []
+        try:
+            for _, token in game.players:
+                comm = WebsocketCommunicator(self.application, f"{game.path}?token={token}")
+                connected, _ = await comm.connect(timeout=RECEIVE_TIMEOUT_SECONDS)
+                if not connected:
+                    raise RuntimeError("connect rejected")
+                comms.append(comm)
+                await comm.receive_json_from(timeout=RECEIVE_TIMEOUT_SECONDS)
+        except Exception as exc:
+            self.errors.append(f"connect: {exc!r}")
+            for comm in comms:
+                try:
+                    await comm.disconnect()
+                except (Exception, asyncio.CancelledError):
+                    pass
+            return None
+        return comms
+
+    async def _arrival(self, comm, started):
+        message = await comm.receive_json_from(timeout=RECEIVE_TIMEOUT_SECONDS)
+        return message, time.perf_counter() - started
+
+    async def _play(self, game, comms):
+        ids = [user_id for user_id, _ in game.players]
+        try:
+            await comms[0].send_json_to({"action": "start_game"})
+            arrivals = await asyncio.gather(*(self._arrival(comm, 0) for comm in comms))
+            game.apply(arrivals[0][0])
+            while not game.ended:
+                mover = comms[ids.index(game.current)]
+                started = time.perf_counter()
+                await mover.send_json_to({"action": "mark_number", "number": game.next_move()})
+                arrivals = await asyncio.gather(*(self._arrival(comm, started) for comm in comms))
+                message, elapsed = arrivals[ids.index(game.current)]
+                if message["type"] == "error":
+                    raise RuntimeError(message["message"])
+                self.moves += 1
+                self.move_latency.append(elapsed)
+                self.broadcast_latency.append(max(elapsed for _, elapsed in arrivals))
+                game.apply(message)
+        except Exception as exc:
+            self.errors.append(f"{game.kind.lower()} play: {exc!r}")
+            return False
+        return True
+
+    def _report(self, results):
+        move = results["move_latency_ms"]
+        broadcast = results["broadcast_latency_ms"]
+        self.stdout.write(f"backend            {results['backend']}")
+        self.stdout.write(
+            f"rooms              {results['rooms']['bingo']} bingo x {results['bingo_players']} players,"
+            f" {results['rooms']['oxo']} oxo"
+        )
+        self.stdout.write(f"games completed    {results['games_completed']} ({results['moves']} moves)")
+        self.stdout.write(f"throughput         {results['moves_per_second']} moves/s")
+        self.stdout.write(f"move latency ms    p50 {move['p50']}  p95 {move['p95']}  p99 {move['p99']}  max {move['max']}")
+        self.stdout.write(
+            f"broadcast ms       p50 {broadcast['p50']}  p95 {broadcast['p95']}  p99 {broadcast['p99']}  max {broadcast['max']}"
+        )
+        self.stdout.write(f"queries per move   {results['queries_per_move']}")
+        self.stdout.write(f"queries per socket {results['queries_per_connect']}")
+        self.stdout.write(f"errors             {results['errors']}")
+        for sample in results["error_samples"]:
+            self.stdout.write(f"  {sample}")
@@ -0,0 +1,41 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from core.reaper import ENDED_TTL, REAP_BATCH_SIZE, REAP_PAUSE_SECONDS, STARTED_TTL, WAITING_TTL, reap_rooms
+
+
+def _minutes(ttl):
+    return ttl.total_seconds() / 60
+
+
+class Command(BaseCommand):
+    help = "Expire idle WAITING and STARTED rooms and move ENDED rooms into the archive, in throttled batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--waiting-minutes", type=float, default=_minutes(WAITING_TTL))
+        parser.add_argument("--started-minutes", type=float, default=_minutes(STARTED_TTL))
+        parser.add_argument("--ended-minutes", type=float, default=_minutes(ENDED_TTL))
+        parser.add_argument("--batch-size", type=int, default=REAP_BATCH_SIZE)
+        parser.add_argument("--pause", type=float, default=REAP_PAUSE_SECONDS, help="Seconds to sleep between batches.")
+        parser.add_argument("--loop", action="store_true", help="Keep reaping every --interval seconds.")
+        parser.add_argument("--interval", type=float, default=60.0)
+
+    def handle(self, *args, **options):
+        while True:
+            counts = reap_rooms(
+                waiting_ttl=timedelta(minutes=options["waiting_minutes"]),
+                started_ttl=timedelta(minutes=options["started_minutes"]),
+                ended_ttl=timedelta(minutes=options["ended_minutes"]),
+                batch_size=options["batch_size"],
+                pause=options["pause"],
+            )
+            if any(counts.values()):
+                self.stdout.write(
+                    f"Expired {counts['expired_waiting']} waiting and {counts['expired_started']} started rooms,"
+                    f" archived {counts['archived']}"
+                )
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
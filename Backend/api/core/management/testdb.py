@@ -0,0 +1,25 @@
+import os
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+
+@contextmanager
+def throwaway_database(name):
+    """Run against a fresh test database of the configured backend, then drop it."""
+    path = None
+    if connection.vendor == "sqlite":
+        # An in-memory test database would hide the file locking under test.
+        path = str(settings.BASE_DIR / f"{name}.sqlite3")
+        connection.settings_dict["TEST"]["NAME"] = path
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.close()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        for suffix in ("-wal", "-shm"):
+            if path and os.path.exists(path + suffix):
+                os.remove(path + suffix)
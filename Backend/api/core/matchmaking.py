@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import random
+import time
+
+from channels.layers import get_channel_layer
+from django.db import IntegrityError, connection, transaction
+
+from .cache import room_members
+from .codec import dumps
+from .models import GameType, Room, RoomPlayer
+from .rooms import ROOM_ID_ATTEMPTS, generate_room_id
+from .writers import writers
+
+logger = logging.getLogger(__name__)
+
+ROOM_SIZES = {GameType.BINGO: (2, 5), GameType.OXO: (2, 2)}
+# A Bingo queue short of a full room waits this long for more players before
+# the ones it has are seated together.
+FILL_WAIT_SECONDS = 5.0
+MATCH_INTERVAL_SECONDS = 0.2
+
+
+def match_group(user_id):
+    return f"matchmaking_user_{user_id}"
+
+
+def _board():
+    numbers = list(range(1, 26))
+    random.shuffle(numbers)
+    return numbers
+
+
+def create_match_rooms(matches):
+    """Create a full room for each (game_type, user_ids) in one transaction.
+
+    Rooms and seats go in as two bulk inserts whatever the batch size; the
+    first user of each match owns the room. Returns the room ids in order.
+    """
+    for attempt in range(ROOM_ID_ATTEMPTS):
+        rooms = [
+            Room(room_id=generate_room_id(), owner_id=user_ids[0], max_players=len(user_ids), game_type=game_type)
+            for game_type, user_ids in matches
+        ]
+        try:
+            with transaction.atomic():
+                Room.objects.bulk_create(rooms)
+                if not connection.features.can_return_rows_from_bulk_insert:
+                    pks = dict(Room.objects.filter(room_id__in=[room.room_id for room in rooms]).values_list("room_id", "pk"))
+                    for room in rooms:
+                        room.pk = pks[room.room_id]
+                RoomPlayer.objects.bulk_create(
+                    [
+                        RoomPlayer(
+                            room=room,
+                            user_id=user_id,
+                            turn_order=order,
+                            board_numbers=_board() if game_type == GameType.BINGO else [],
+                        )
+                        for room, (game_type, user_ids) in zip(rooms, matches)
+                        for order, user_id in enumerate(user_ids, start=1)
+                    ]
+                )
+        except IntegrityError:
+            # One id in the batch was taken; the whole batch draws new ones.
+            if attempt == ROOM_ID_ATTEMPTS - 1:
+                raise
+            continue
+        return [room.room_id for room in rooms]
+
+
+class Matchmaker:
+    """Per-process queues of users waiting for a game, seated in batches.
+
+    Queueing and leaving are dict operations on the event loop; a loop
+    forms every possible room each tick and writes them all with
+    ``create_match_rooms``, then tells each player their room_id on their
+    matchmaking group.
+
+    The queues are not shared between processes: users queued on different
+    workers never meet, so matchmaking sockets need a single worker (or a
+    route pinning /ws/matchmaking/ to one) until the queues move to Redis.
+    """
+
+    def __init__(self, interval=MATCH_INTERVAL_SECONDS, fill_wait=FILL_WAIT_SECONDS, clock=time.monotonic):
+        self.interval = interval
+        self.fill_wait = fill_wait
+        self.clock = clock
+        # Insertion-ordered, so the first entries waited longest.
+        self._queues = {game_type: {} for game_type in ROOM_SIZES}
+        self._queued = {}
+        # The socket each user last queued from; only closing that one leaves.
+        self._channels = {}
+        self._task = None
+
+    def enqueue(self, user_id, game_type, channel=None):
+        """Queue a user for ``game_type``, leaving any other queue; returns how many are waiting."""
+        if self._queued.get(user_id) != game_type:
+            self.cancel(user_id)
+            self._queues[game_type][user_id] = self.clock()
+            self._queued[user_id] = game_type
+        self._channels[user_id] = channel
+        return len(self._queues[game_type])
+
+    def cancel(self, user_id, channel=None):
+        """Take a user out of their queue; with ``channel``, only if they queued from it."""
+        if channel is not None and self._channels.get(user_id) != channel:
+            return
+        self._channels.pop(user_id, None)
+        game_type = self._queued.pop(user_id, None)
+        if game_type is not None:
+            del self._queues[game_type][user_id]
+
+    def depth(self, game_type):
+        return len(self._queues[game_type])
+
+    def take_matches(self):
+        """Remove and return every room that can be formed now, as (game_type, user_ids)."""
+        now = self.clock()
+        matches = []
+        for game_type, queue in self._queues.items():
+            smallest, largest = ROOM_SIZES[game_type]
+            user_ids = list(queue)
+            groups = [user_ids[start : start + largest] for start in range(0, len(user_ids) - largest + 1, largest)]
+            rest = user_ids[len(groups) * largest :]
+            if len(rest) >= smallest and now - queue[rest[0]] >= self.fill_wait:
+                groups.append(rest)
+            for group in groups:
+                for user_id in group:
+                    del queue[user_id]
+                    del self._queued[user_id]
+                    self._channels.pop(user_id, None)
+                matches.append((game_type, group))
+        return matches
+
+    def requeue(self, matches):
+        # Puts users from a failed batch back at the front of their queue.
+        for game_type, user_ids in matches:
+            queue = self._queues[game_type]
+            now = self.clock()
+            restored = {user_id: now - self.fill_wait for user_id in user_ids if user_id not in self._queued}
+            self._queues[game_type] = {**restored, **queue}
+            self._queued.update(dict.fromkeys(restored, game_type))
+
+    def ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    async def form_rooms(self):
+        matches = self.take_matches()
+        if not matches:
+            return 0
+        try:
+            room_ids = await writers.run("matchmaking", create_match_rooms, matches)
+        except Exception:
+            self.requeue(matches)
+            raise
+
+        channel_layer = get_channel_layer()
+        for room_id, (game_type, user_ids) in zip(room_ids, matches):
+            text = dumps({"type": "match_found", "room_id": room_id, "game_type": game_type, "players": user_ids})
+            for user_id in user_ids:
+                room_members.delete((room_id, user_id))
+                await channel_layer.group_send(match_group(user_id), {"type": "matchmaking.event", "text": text})
+        return len(matches)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.form_rooms()
+            except Exception:
+                logger.exception("Matchmaking failed")
+            await asyncio.sleep(self.interval)
+
+
+matchmaker = Matchmaker()
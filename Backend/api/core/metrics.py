@@ -0,0 +1,162 @@
+import bisect
+import contextvars
+import logging
+import time
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ("start_game", "mark_number", "rematch", "room_state", "auto_skip")
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# The action being measured in this task, and in the threads it hands work to.
+current = contextvars.ContextVar("current_action", default=None)
+
+
+class Measurement:
+    __slots__ = ("lock_wait", "queries", "sent_bytes", "error")
+
+    def __init__(self):
+        self.lock_wait = 0.0
+        self.queries = 0
+        self.sent_bytes = 0
+        self.error = False
+
+
+class ActionStats:
+    __slots__ = ("count", "errors", "seconds", "buckets", "lock_wait", "queries", "sent_bytes")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(SECONDS_BUCKETS) + 1)
+        self.lock_wait = 0.0
+        self.queries = 0
+        self.sent_bytes = 0
+
+
+class ActionMetrics:
+    """Per-action cost of the room consumers: wall time, time queued behind the
+    room's other commands and writes, SQL queries and bytes sent.
+
+    Disabled, ``run`` just awaits the action and nothing else is touched.
+    """
+
+    def __init__(self, enabled=None, slow_ms=None, clock=time.perf_counter):
+        self.enabled = getattr(settings, "ACTION_METRICS", False) if enabled is None else enabled
+        self.slow_ms = getattr(settings, "SLOW_ACTION_MS", None) if slow_ms is None else slow_ms
+        self.clock = clock
+        self._stats = {}
+
+    async def run(self, game, action, func):
+        if not self.enabled:
+            return await func()
+
+        action = action if action in ACTIONS else "unknown"
+        measurement = Measurement()
+        token = current.set(measurement)
+        started = self.clock()
+        try:
+            return await func()
+        except Exception:
+            measurement.error = True
+            raise
+        finally:
+            current.reset(token)
+            self.record(game, action, self.clock() - started, measurement)
+
+    def record(self, game, action, seconds, measurement):
+        stats = self._stats.get((game, action))
+        if stats is None:
+            stats = self._stats[(game, action)] = ActionStats()
+        stats.count += 1
+        stats.errors += measurement.error
+        stats.seconds += seconds
+        stats.buckets[bisect.bisect_left(SECONDS_BUCKETS, seconds)] += 1
+        stats.lock_wait += measurement.lock_wait
+        stats.queries += measurement.queries
+        stats.sent_bytes += measurement.sent_bytes
+
+        if self.slow_ms is not None and seconds * 1000 >= self.slow_ms:
+            logger.warning(
+                "Slow %s %s: %.1f ms, %.1f ms waiting, %d queries, %d bytes sent",
+                game,
+                action,
+                seconds * 1000,
+                measurement.lock_wait * 1000,
+                measurement.queries,
+                measurement.sent_bytes,
+            )
+
+    def prometheus(self):
+        lines = [
+            "# HELP room_action_seconds Wall time of room consumer actions.",
+            "# TYPE room_action_seconds histogram",
+        ]
+        for (game, action), stats in sorted(self._stats.items()):
+            labels = f'game="{game}",action="{action}"'
+            cumulative = 0
+            for bound, count in zip(SECONDS_BUCKETS, stats.buckets):
+                cumulative += count
+                lines.append(f'room_action_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'room_action_seconds_bucket{{{labels},le="+Inf"}} {stats.count}')
+            lines.append(f"room_action_seconds_sum{{{labels}}} {stats.seconds:.6f}")
+            lines.append(f"room_action_seconds_count{{{labels}}} {stats.count}")
+
+        for name, help_text, attr in (
+            ("room_action_errors_total", "Actions answered with an error.", "errors"),
+            ("room_action_lock_wait_seconds_total", "Time actions spent queued behind their room.", "lock_wait"),
+            ("room_action_queries_total", "SQL queries run by actions.", "queries"),
+            ("room_action_sent_bytes_total", "Frame bytes produced by actions.", "sent_bytes"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (game, action), stats in sorted(self._stats.items()):
+                value = getattr(stats, attr)
+                value = f"{value:.6f}" if isinstance(value, float) else value
+                lines.append(f'{name}{{game="{game}",action="{action}"}} {value}')
+        return lines
+
+
+actions = ActionMetrics()
+
+
+def add_lock_wait(seconds):
+    measurement = current.get()
+    if measurement is not None:
+        measurement.lock_wait += seconds
+
+
+def add_sent(text):
+    measurement = current.get()
+    if measurement is not None:
+        measurement.sent_bytes += len(text.encode())
+
+
+def mark_error():
+    measurement = current.get()
+    if measurement is not None:
+        measurement.error = True
+
+
+def count_query(execute, sql, params, many, context):
+    measurement = current.get()
+    if measurement is not None:
+        measurement.queries += 1
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    if actions.enabled and count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def append_metric(lines, name, help_text, value, kind="gauge"):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    lines.append(f"{name} {value}")
@@ -0,0 +1,49 @@
+# Generated by Django 6.0.2 on 2026-10-18 00:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_room_game_type'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('game_type', models.CharField(choices=[('BINGO', 'Bingo'), ('OXO', 'Tic-Tac-Toe')], max_length=10)),
+                ('finished_at', models.DateTimeField(auto_now_add=True)),
+                ('aggregated_at', models.DateTimeField(blank=True, null=True)),
+                ('room', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='results', to='core.room')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GameResultPlayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('outcome', models.CharField(choices=[('WIN', 'Win'), ('SECOND', 'Second place'), ('LOSS', 'Loss'), ('DRAW', 'Draw')], max_length=10)),
+                ('rank', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField()),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='players', to='core.gameresult')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='game_results', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='gameresult',
+            index=models.Index(condition=models.Q(('aggregated_at__isnull', True)), fields=['id'], name='gameresult_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gameresultplayer',
+            index=models.Index(fields=['user', '-finished_at'], name='gameresultplayer_history_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='gameresultplayer',
+            unique_together={('result', 'user')},
+        ),
+    ]
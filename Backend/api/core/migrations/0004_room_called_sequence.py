@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+
+def pack_called_numbers(apps, schema_editor):
+    Room = apps.get_model("core", "Room")
+    RoomPlayer = apps.get_model("core", "RoomPlayer")
+    rooms = Room.objects.filter(game_type="BINGO").only("pk", "called_numbers")
+    for room in rooms.iterator(chunk_size=500):
+        numbers = [n for n in room.called_numbers or [] if isinstance(n, int) and 1 <= n <= 25]
+        Room.objects.filter(pk=room.pk).update(called_sequence=bytes(numbers), called_numbers=[])
+    RoomPlayer.objects.update(eliminated_numbers=[])
+
+
+def unpack_called_numbers(apps, schema_editor):
+    Room = apps.get_model("core", "Room")
+    RoomPlayer = apps.get_model("core", "RoomPlayer")
+    rooms = Room.objects.filter(game_type="BINGO").only("pk", "called_sequence")
+    for room in rooms.iterator(chunk_size=500):
+        numbers = list(bytes(room.called_sequence))
+        Room.objects.filter(pk=room.pk).update(called_numbers=numbers)
+        RoomPlayer.objects.filter(room_id=room.pk).update(eliminated_numbers=numbers)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_game_results'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='called_sequence',
+            field=models.BinaryField(blank=True, default=bytes),
+        ),
+        migrations.RunPython(pack_called_numbers, unpack_called_numbers),
+        migrations.RemoveField(
+            model_name='roomplayer',
+            name='eliminated_numbers',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_room_called_sequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['status', 'updated_at'], name='room_status_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roomplayer',
+            index=models.Index(fields=['room', 'turn_order'], name='roomplayer_room_turn_idx'),
+        ),
+    ]
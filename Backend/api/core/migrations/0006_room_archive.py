@@ -0,0 +1,34 @@
+# Generated by Django 6.0.2 on 2026-10-18 10:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='room',
+            options={},
+        ),
+        migrations.CreateModel(
+            name='ArchivedRoom',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('room_id', models.CharField(db_index=True, max_length=12)),
+                ('game_type', models.CharField(choices=[('BINGO', 'Bingo'), ('OXO', 'Tic-Tac-Toe')], max_length=10)),
+                ('players', models.JSONField(blank=True, default=list)),
+                ('winner_order', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-18 10:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_room_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(condition=models.Q(('status', 'WAITING')), fields=['game_type', '-id'], name='room_open_idx'),
+        ),
+    ]
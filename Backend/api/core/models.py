@@ -29,7 +29,8 @@ class Profile(models.Model):
     losses = models.PositiveIntegerField(default=0)
     points = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    # Indexed for local leaderboards catching up on other processes' changes.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     @property
     def win_rate(self):
@@ -55,13 +56,29 @@ class Room(models.Model):
         related_name="turn_rooms",
     )
     called_numbers = models.JSONField(default=list, blank=True)
+    # Bingo calls in order, one byte per number; OXO keeps its board in called_numbers.
+    called_sequence = models.BinaryField(default=bytes, blank=True)
     turn_deadline = models.DateTimeField(null=True, blank=True)
     winner_order = models.JSONField(default=list, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["status", "updated_at"], name="room_status_updated_idx"),
+            # The lobby: only WAITING rooms, newest first per game type.
+            models.Index(
+                fields=["game_type", "-id"],
+                condition=models.Q(status="WAITING"),
+                name="room_open_idx",
+            ),
+        ]
+
+    @property
+    def current_called_numbers(self):
+        if self.game_type == GameType.BINGO:
+            return list(bytes(self.called_sequence))
+        return self.called_numbers
 
     def __str__(self):
         return f"{self.room_id} ({self.status})"
@@ -73,7 +90,6 @@ class RoomPlayer(models.Model):
     turn_order = models.PositiveSmallIntegerField()
     status = models.CharField(max_length=10, choices=PlayerStatus.choices, default=PlayerStatus.PLAYING)
     board_numbers = models.JSONField(default=list, blank=True)
-    eliminated_numbers = models.JSONField(default=list, blank=True)
     lines_completed = models.PositiveSmallIntegerField(default=0)
     rank = models.PositiveSmallIntegerField(null=True, blank=True)
     joined_at = models.DateTimeField(auto_now_add=True)
@@ -81,11 +97,74 @@ class RoomPlayer(models.Model):
     class Meta:
         unique_together = ("room", "user")
         ordering = ["turn_order", "joined_at"]
+        indexes = [
+            models.Index(fields=["room", "turn_order"], name="roomplayer_room_turn_idx"),
+        ]
 
     def __str__(self):
         return f"{self.room.room_id} - {self.user.username}"
 
 
+class ArchivedRoom(models.Model):
+    """What is kept of a room once the reaper removes it from the hot tables."""
+
+    room_id = models.CharField(max_length=12, db_index=True)
+    game_type = models.CharField(max_length=10, choices=GameType.choices)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    # User ids in turn order.
+    players = models.JSONField(default=list, blank=True)
+    winner_order = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField()
+    ended_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.room_id} (archived)"
+
+
+class GameOutcome(models.TextChoices):
+    WIN = "WIN", "Win"
+    SECOND = "SECOND", "Second place"
+    LOSS = "LOSS", "Loss"
+    DRAW = "DRAW", "Draw"
+
+
+class GameResult(models.Model):
+    room = models.ForeignKey(Room, null=True, blank=True, on_delete=models.SET_NULL, related_name="results")
+    game_type = models.CharField(max_length=10, choices=GameType.choices)
+    finished_at = models.DateTimeField(auto_now_add=True)
+    aggregated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=models.Q(aggregated_at__isnull=True),
+                name="gameresult_pending_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.game_type} result #{self.pk}"
+
+
+class GameResultPlayer(models.Model):
+    result = models.ForeignKey(GameResult, on_delete=models.CASCADE, related_name="players")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="game_results")
+    outcome = models.CharField(max_length=10, choices=GameOutcome.choices)
+    rank = models.PositiveSmallIntegerField(null=True, blank=True)
+    finished_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("result", "user")
+        indexes = [
+            models.Index(fields=["user", "-finished_at"], name="gameresultplayer_history_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.outcome} in result #{self.result_id}"
+
+
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+from .metrics import add_lock_wait
+
+
+class RoomQueue:
+    __slots__ = ("lock", "depth", "max_depth", "commands", "wait_total", "wait_max")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+        self.max_depth = 0
+        self.commands = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "commands": self.commands,
+            "wait_avg_ms": round(self.wait_total / self.commands * 1000, 3) if self.commands else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+        }
+
+
+class RoomCommandQueues:
+    """Runs each room's commands one at a time, in arrival order.
+
+    Commands for a room never overlap inside this process, so they do not
+    queue up on the room's row lock in the database. Idle rooms keep their
+    counters until ``max_rooms`` is reached, oldest first out.
+    """
+
+    def __init__(self, clock=time.monotonic, max_rooms=10000):
+        self.clock = clock
+        self.max_rooms = max_rooms
+        self._rooms = {}
+
+    def _queue(self, key):
+        queue = self._rooms.get(key)
+        if queue is None:
+            for idle_key in list(self._rooms):
+                if len(self._rooms) < self.max_rooms:
+                    break
+                if not self._rooms[idle_key].depth:
+                    del self._rooms[idle_key]
+            queue = self._rooms[key] = RoomQueue()
+        return queue
+
+    def depth(self, key):
+        queue = self._rooms.get(key)
+        return queue.depth if queue else 0
+
+    async def run(self, key, command):
+        queue = self._queue(key)
+        queue.depth += 1
+        queue.max_depth = max(queue.max_depth, queue.depth)
+        queued_at = self.clock()
+        try:
+            async with queue.lock:
+                waited = self.clock() - queued_at
+                queue.commands += 1
+                queue.wait_total += waited
+                queue.wait_max = max(queue.wait_max, waited)
+                add_lock_wait(waited)
+                return await command()
+        finally:
+            queue.depth -= 1
+
+    def stats(self):
+        rooms = {key: queue.stats() for key, queue in self._rooms.items()}
+        return {
+            "rooms": rooms,
+            "depth": sum(room["depth"] for room in rooms.values()),
+            "commands": sum(room["commands"] for room in rooms.values()),
+        }
+
+
+commands = RoomCommandQueues()
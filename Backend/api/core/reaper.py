@@ -0,0 +1,145 @@
+import time
+from datetime import timedelta
+from functools import partial
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import snapshots
+from .codec import dumps
+from .engine import engine
+from .lobby import publish_closed
+from .models import ArchivedRoom, GameStatus, Room, RoomPlayer
+from .replay import replay
+from .rooms import room_read_queryset
+from .serializers import room_data
+
+WAITING_TTL = timedelta(hours=1)
+STARTED_TTL = timedelta(minutes=30)
+# Long enough for an OXO rematch.
+ENDED_TTL = timedelta(minutes=15)
+REAP_BATCH_SIZE = 200
+REAP_PAUSE_SECONDS = 0.1
+
+
+def _claim_idle(status, cutoff, batch_size):
+    # Rows a move is holding are skipped and picked up by a later pass.
+    return list(
+        Room.objects.select_for_update(skip_locked=True)
+        .filter(status=status, updated_at__lt=cutoff)
+        .order_by("updated_at")[:batch_size]
+    )
+
+
+def _publish_closed(rooms):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    for room in rooms:
+        async_to_sync(publish_closed)(channel_layer, room.room_id, room.game_type)
+
+
+def _publish_ended(room_pks):
+    # Sockets still on the room would otherwise wait on a turn that never
+    # comes. Sent without a seq, like a REST join, so replay starts over.
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    for room in room_read_queryset().filter(pk__in=room_pks):
+        prefix = "ttt_room" if room.game_type == "OXO" else "bingo_room"
+        replay.clear(room.room_id)
+        snapshots.invalidate(room.room_id)
+        text = dumps({"type": "game_ended", "data": room_data(room)})
+        async_to_sync(channel_layer.group_send)(
+            f"{prefix}_{room.room_id}", {"type": "room.event", "text": text, "origin": snapshots.origin}
+        )
+
+
+def expire_waiting(cutoff, batch_size=REAP_BATCH_SIZE):
+    """Delete WAITING rooms idle since ``cutoff`` and take them out of the lobby;
+    nothing was played, so nothing is archived."""
+    with transaction.atomic():
+        rooms = _claim_idle(GameStatus.WAITING, cutoff, batch_size)
+        Room.objects.filter(pk__in=[room.pk for room in rooms]).delete()
+        transaction.on_commit(partial(_publish_closed, rooms))
+    return len(rooms)
+
+
+def expire_started(cutoff, batch_size=REAP_BATCH_SIZE):
+    """End STARTED rooms idle since ``cutoff`` and tell their sockets; they are
+    archived once ENDED_TTL passes. Abandoned games log no result, so they
+    count toward nobody's matches.
+
+    Moving updated_at on fences off any engine still holding the room: its
+    next checkpoint fails instead of writing over the end.
+    """
+    with transaction.atomic():
+        rooms = _claim_idle(GameStatus.STARTED, cutoff, batch_size)
+        Room.objects.filter(pk__in=[room.pk for room in rooms]).update(
+            status=GameStatus.ENDED, turn_deadline=None, current_turn_player=None, updated_at=timezone.now()
+        )
+        transaction.on_commit(partial(_publish_ended, [room.pk for room in rooms]))
+    for room in rooms:
+        engine.discard(room.room_id)
+    return len(rooms)
+
+
+def archive_ended(cutoff, batch_size=REAP_BATCH_SIZE):
+    """Move ENDED rooms idle since ``cutoff`` into ArchivedRoom and delete them with their players."""
+    with transaction.atomic():
+        rooms = _claim_idle(GameStatus.ENDED, cutoff, batch_size)
+        players = {room.pk: [] for room in rooms}
+        for room_pk, user_id in (
+            RoomPlayer.objects.filter(room__in=rooms).order_by("room_id", "turn_order").values_list("room_id", "user_id")
+        ):
+            players[room_pk].append(user_id)
+
+        ArchivedRoom.objects.bulk_create(
+            [
+                ArchivedRoom(
+                    room_id=room.room_id,
+                    game_type=room.game_type,
+                    owner_id=room.owner_id,
+                    players=players[room.pk],
+                    winner_order=room.winner_order,
+                    created_at=room.created_at,
+                    ended_at=room.updated_at,
+                )
+                for room in rooms
+            ]
+        )
+        Room.objects.filter(pk__in=players).delete()
+    return len(rooms)
+
+
+def reap_rooms(
+    now=None,
+    waiting_ttl=WAITING_TTL,
+    started_ttl=STARTED_TTL,
+    ended_ttl=ENDED_TTL,
+    batch_size=REAP_BATCH_SIZE,
+    pause=REAP_PAUSE_SECONDS,
+    sleep=time.sleep,
+):
+    """Run every pass to completion, pausing between batches; returns the counts.
+
+    Each batch is its own short transaction, so live rooms are never blocked
+    behind a long delete.
+    """
+    now = now or timezone.now()
+    counts = {}
+    for name, step, ttl in (
+        ("expired_waiting", expire_waiting, waiting_ttl),
+        ("expired_started", expire_started, started_ttl),
+        ("archived", archive_ended, ended_ttl),
+    ):
+        counts[name] = 0
+        while True:
+            processed = step(now - ttl, batch_size)
+            counts[name] += processed
+            if processed < batch_size:
+                break
+            sleep(pause)
+    return counts
@@ -0,0 +1,94 @@
+import threading
+import uuid
+from collections import deque
+
+REPLAY_BUFFER_EVENTS = 64
+
+
+class ReplayLog:
+    """The last ``size`` encoded events of each room, by sequence number.
+
+    A room's numbering starts over whenever its counter does, on an engine
+    reload or a process numbering OXO events afresh, so each run of numbers
+    has an epoch. A socket reconnecting with the epoch and last seq it saw is
+    sent the frames it missed instead of a fresh snapshot, as long as they
+    are all still here. Least recently written rooms are dropped first once
+    ``max_rooms`` is reached.
+    """
+
+    def __init__(self, size=REPLAY_BUFFER_EVENTS, max_rooms=10000):
+        self.size = size
+        self.max_rooms = max_rooms
+        # room_id -> (epoch, events)
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def epoch(self, room_id):
+        """The epoch of the room's events; a room without any starts a new one."""
+        with self._lock:
+            entry = self._rooms.get(room_id)
+            if entry is None:
+                entry = self._start(room_id, uuid.uuid4().hex[:8])
+            return entry[0]
+
+    def last_seq(self, room_id):
+        entry = self._rooms.get(room_id)
+        return entry[1][-1][0] if entry and entry[1] else 0
+
+    def latest(self, room_id):
+        """The newest frame held for the room, or None."""
+        entry = self._rooms.get(room_id)
+        return entry[1][-1][1] if entry and entry[1] else None
+
+    def next_seq(self, room_id):
+        return self.last_seq(room_id) + 1
+
+    def record(self, room_id, seq, text, epoch=None, restart=False):
+        """Keep ``text`` as event ``seq`` of ``epoch``; an event without a seq makes
+        the room's buffer unusable, so it is dropped.
+
+        Events already held are ignored, since every socket in the process
+        passes on the same group message. An event from another epoch, or
+        with ``restart``, the sender's own, at or below the last seq means
+        the room's counter started over, and the old events go.
+        """
+        with self._lock:
+            entry = self._rooms.pop(room_id, None)
+            if seq is None:
+                return
+            if entry is not None and entry[0] == epoch and entry[1] and seq <= entry[1][-1][0]:
+                if not restart:
+                    self._rooms[room_id] = entry
+                    return
+                entry = None
+            if entry is None or entry[0] != epoch:
+                entry = self._start(room_id, epoch)
+            else:
+                self._rooms[room_id] = entry
+            entry[1].append((seq, text))
+
+    def _start(self, room_id, epoch):
+        # Caller holds ``_lock`` and has taken any old entry for the room out.
+        while len(self._rooms) >= self.max_rooms:
+            self._rooms.pop(next(iter(self._rooms)))
+        entry = self._rooms[room_id] = (epoch, deque(maxlen=self.size))
+        return entry
+
+    def clear(self, room_id):
+        with self._lock:
+            self._rooms.pop(room_id, None)
+
+    def since(self, room_id, epoch, seq):
+        """Frames after ``seq`` of ``epoch`` in order, or None when some of them are gone."""
+        entry = self._rooms.get(room_id)
+        if entry is None or entry[0] != epoch:
+            return None
+        events = entry[1]
+        if not events:
+            return [] if seq == 0 else None
+        if seq > events[-1][0] or seq < events[0][0] - 1:
+            return None
+        return [text for event_seq, text in list(events) if event_seq > seq]
+
+
+replay = ReplayLog()
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from collections import defaultdict
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .leaderboard import board
+from .models import GameOutcome, GameResult, GameResultPlayer, Profile
+from .writers import writers
+
+logger = logging.getLogger(__name__)
+
+WIN = GameOutcome.WIN
+SECOND = GameOutcome.SECOND
+LOSS = GameOutcome.LOSS
+DRAW = GameOutcome.DRAW
+
+STAT_FIELDS = ("total_matches", "wins", "second_place", "losses", "points")
+
+STAT_DELTAS = {
+    WIN: {"total_matches": 1, "wins": 1, "points": 10},
+    SECOND: {"total_matches": 1, "second_place": 1, "points": 5},
+    LOSS: {"total_matches": 1, "losses": 1},
+    DRAW: {"total_matches": 1},
+}
+
+AGGREGATE_BATCH_SIZE = 500
+AGGREGATE_INTERVAL_SECONDS = 2.0
+
+
+def bingo_outcome(rank):
+    if rank == 1:
+        return WIN
+    if rank == 2:
+        return SECOND
+    return LOSS
+
+
+def log_game_result(room_pk, game_type, placements):
+    """Append a finished game to the result log, given as (user_id, outcome, rank).
+
+    This is the only write on the move path; profile stats catch up when the
+    aggregator consumes the log.
+    """
+    result = GameResult.objects.create(room_id=room_pk, game_type=game_type)
+    GameResultPlayer.objects.bulk_create(
+        [
+            GameResultPlayer(result=result, user_id=user_id, outcome=outcome, rank=rank, finished_at=result.finished_at)
+            for user_id, outcome, rank in placements
+        ]
+    )
+    return result
+
+
+def apply_stat_deltas(deltas):
+    """Add {user_id: {field: amount}} to profiles in a constant number of queries.
+
+    Missing profiles are created in one insert and every field is bumped with
+    a single CASE over the users, so concurrent writers never overwrite each
+    other's increments.
+    """
+    if not deltas:
+        return
+
+    Profile.objects.bulk_create([Profile(user_id=user_id) for user_id in deltas], ignore_conflicts=True)
+
+    changes = {}
+    for field in STAT_FIELDS:
+        whens = [
+            When(user_id=user_id, then=Value(amounts[field]))
+            for user_id, amounts in deltas.items()
+            if amounts.get(field)
+        ]
+        if whens:
+            changes[field] = F(field) + Case(*whens, default=Value(0), output_field=IntegerField())
+
+    Profile.objects.filter(user_id__in=deltas).update(updated_at=timezone.now(), **changes)
+    # update() skips the post_save signal that keeps the leaderboard current.
+    transaction.on_commit(partial(board.refresh, list(deltas)))
+
+
+class _ClaimLost(Exception):
+    pass
+
+
+def aggregate_pending(batch_size=AGGREGATE_BATCH_SIZE):
+    """Fold the oldest unaggregated results into profiles; returns how many."""
+    result_ids = list(
+        GameResult.objects.filter(aggregated_at__isnull=True).order_by("id").values_list("id", flat=True)[:batch_size]
+    )
+    if not result_ids:
+        return 0
+
+    try:
+        with transaction.atomic():
+            # Claiming first takes the write locks, so a second aggregator that
+            # read the same batch finds fewer rows to claim and backs off.
+            claimed = GameResult.objects.filter(id__in=result_ids, aggregated_at__isnull=True).update(
+                aggregated_at=timezone.now()
+            )
+            if claimed != len(result_ids):
+                raise _ClaimLost
+
+            deltas = defaultdict(lambda: defaultdict(int))
+            for user_id, outcome in GameResultPlayer.objects.filter(result_id__in=result_ids).values_list(
+                "user_id", "outcome"
+            ):
+                for field, amount in STAT_DELTAS[outcome].items():
+                    deltas[user_id][field] += amount
+            apply_stat_deltas(deltas)
+    except _ClaimLost:
+        return 0
+    return len(result_ids)
+
+
+def rebuild_stats(batch_size=AGGREGATE_BATCH_SIZE):
+    """Reset every profile and replay the whole result log."""
+    with transaction.atomic():
+        Profile.objects.update(**{field: 0 for field in STAT_FIELDS}, updated_at=timezone.now())
+        GameResult.objects.update(aggregated_at=None)
+
+    replayed = 0
+    while True:
+        processed = aggregate_pending(batch_size)
+        if not processed:
+            break
+        replayed += processed
+    transaction.on_commit(board.reload)
+    return replayed
+
+
+class ResultAggregator:
+    """Per-process loop that drains the result log in batches."""
+
+    def __init__(self, batch_size=AGGREGATE_BATCH_SIZE, interval=AGGREGATE_INTERVAL_SECONDS):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._task = None
+
+    def ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                # On the writer threads like the rooms' writes, so deferred-mode
+                # SQLite, with its single writer, never sees two at once.
+                processed = await writers.run("results", aggregate_pending, self.batch_size)
+            except Exception:
+                logger.exception("Result aggregation failed")
+                processed = 0
+            if processed < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+
+aggregator = ResultAggregator()
@@ -0,0 +1,39 @@
+import random
+import string
+
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
+
+from .models import Room, RoomPlayer
+
+ROOM_ID_ALPHABET = string.ascii_uppercase + string.digits
+ROOM_ID_LENGTH = 6
+ROOM_ID_ATTEMPTS = 8
+
+_random = random.SystemRandom()
+
+
+def generate_room_id(length=ROOM_ID_LENGTH):
+    return "".join(_random.choices(ROOM_ID_ALPHABET, k=length))
+
+
+def create_room_with_id(generate=generate_room_id, attempts=ROOM_ID_ATTEMPTS, **fields):
+    """Insert a Room under a fresh random room_id, letting the unique index catch collisions.
+
+    With 36^6 ids and the reaper keeping the table small a collision is
+    rare, so this is one INSERT in practice; a collision rolls back its
+    savepoint and tries the next id.
+    """
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                return Room.objects.create(room_id=generate(), **fields)
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
+
+
+def room_read_queryset():
+    """Rooms with everything a snapshot or RoomSerializer reads: two queries for any player count."""
+    players = RoomPlayer.objects.select_related("user").order_by("turn_order")
+    return Room.objects.select_related("owner", "current_turn_player").prefetch_related(Prefetch("players", queryset=players))
@@ -1,9 +1,20 @@
 from django.urls import re_path
 
-from .consumers import BingoRoomConsumer, TttRoomConsumer
+from .consumers import (
+    BingoRoomConsumer,
+    BingoSpectatorConsumer,
+    LobbyConsumer,
+    MatchmakingConsumer,
+    TttRoomConsumer,
+    TttSpectatorConsumer,
+)
 
 
 websocket_urlpatterns = [
     re_path(r"^ws/gamify/(?P<room_id>[A-Za-z0-9_-]+)/$", BingoRoomConsumer.as_asgi()),
     re_path(r"^ws/oxo/(?P<room_id>[A-Za-z0-9_-]+)/$", TttRoomConsumer.as_asgi()),
+    re_path(r"^ws/gamify/(?P<room_id>[A-Za-z0-9_-]+)/watch/$", BingoSpectatorConsumer.as_asgi()),
+    re_path(r"^ws/oxo/(?P<room_id>[A-Za-z0-9_-]+)/watch/$", TttSpectatorConsumer.as_asgi()),
+    re_path(r"^ws/lobby/$", LobbyConsumer.as_asgi()),
+    re_path(r"^ws/matchmaking/$", MatchmakingConsumer.as_asgi()),
 ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from .models import Profile, Room, RoomPlayer
 
 
@@ -33,6 +34,15 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
 
 
+class UsernameTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        # Lets the WebSocket auth build the user from the token alone.
+        token["username"] = user.username
+        return token
+
+
 class RoomPlayerSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source="user.username", read_only=True)
 
@@ -54,6 +64,7 @@ class RoomSerializer(serializers.ModelSerializer):
     current_turn_username = serializers.CharField(source="current_turn_player.username", read_only=True)
     players = RoomPlayerSerializer(many=True, read_only=True)
     current_players = serializers.SerializerMethodField()
+    called_numbers = serializers.ListField(source="current_called_numbers", read_only=True)
 
     class Meta:
         model = Room
@@ -75,7 +86,52 @@ class RoomSerializer(serializers.ModelSerializer):
         ]
 
     def get_current_players(self, obj):
-        return obj.players.count()
+        # Served from the prefetch when the room came from room_read_queryset.
+        return len(obj.players.all())
+
+
+_datetime = serializers.DateTimeField()
+
+
+def _datetime_or_none(value):
+    return _datetime.to_representation(value) if value is not None else None
+
+
+def room_data(room, players=None):
+    """RoomSerializer(room).data as a plain dict, without DRF's per-field machinery.
+
+    ``players`` defaults to ``room.players.all()``; views that just added a
+    player pass the list they already hold.
+    """
+    if players is None:
+        players = room.players.all()
+    return {
+        "room_id": room.room_id,
+        "owner": room.owner_id,
+        "owner_username": room.owner.username,
+        "max_players": room.max_players,
+        "current_players": len(players),
+        "game_type": room.game_type,
+        "status": room.status,
+        "current_turn_player": room.current_turn_player_id,
+        "current_turn_username": room.current_turn_player.username if room.current_turn_player_id else None,
+        "called_numbers": room.current_called_numbers,
+        "turn_deadline": _datetime_or_none(room.turn_deadline),
+        "winner_order": room.winner_order,
+        "players": [
+            {
+                "user": entry.user_id,
+                "username": entry.user.username,
+                "turn_order": entry.turn_order,
+                "status": entry.status,
+                "lines_completed": entry.lines_completed,
+                "rank": entry.rank,
+                "joined_at": _datetime_or_none(entry.joined_at),
+            }
+            for entry in players
+        ],
+        "created_at": _datetime_or_none(room.created_at),
+    }
 
 
 class CreateRoomSerializer(serializers.Serializer):
@@ -85,3 +141,14 @@ class CreateRoomSerializer(serializers.Serializer):
 
 class JoinRoomSerializer(serializers.Serializer):
     room_id = serializers.CharField(max_length=12)
+
+
+def lobby_room_data(room, current_players):
+    return {
+        "room_id": room.room_id,
+        "game_type": room.game_type,
+        "owner_username": room.owner.username,
+        "max_players": room.max_players,
+        "current_players": current_players,
+        "created_at": _datetime_or_none(room.created_at),
+    }
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import time
+
+from channels.layers import get_channel_layer
+
+from .cache import TTLCache, snapshots
+from .leases import get_lease_backend
+
+logger = logging.getLogger(__name__)
+
+SPECTATOR_UPDATES_PER_SECOND = 2.0
+# A process with spectators on a room keeps it marked as watched, renewing
+# at half this; player consumers only poke rooms that are.
+WATCHED_SECONDS = 30.0
+# How long a player process trusts its last look at that mark.
+WATCHED_LOOKUP_SECONDS = 1.0
+
+
+def spectator_group(room_group):
+    return f"watch_{room_group}"
+
+
+def spectator_view(snapshot):
+    """A room snapshot without the players' boards."""
+    return {
+        **snapshot,
+        "players": [
+            {key: value for key, value in player.items() if key != "board_numbers"} for player in snapshot["players"]
+        ],
+    }
+
+
+class WatchedRoom:
+    __slots__ = ("room_id", "viewers", "build", "channel", "changed", "frame", "next_at", "tasks")
+
+    def __init__(self, room_id, build):
+        self.room_id = room_id
+        self.viewers = set()
+        self.build = build
+        self.channel = None
+        self.changed = asyncio.Event()
+        self.frame = None
+        self.next_at = 0
+        self.tasks = ()
+
+
+class SpectatorHub:
+    """Per-process fan-out of room updates to spectator sockets.
+
+    Player consumers only poke the room's spectator group, which holds one
+    channel per watching process rather than one per spectator. Each process
+    rebuilds the spectator view at most ``rate`` times a second however many
+    pokes arrived, encodes it once and hands the same frame to every local
+    viewer, so spectators add no work to the players' turn handling.
+
+    Rooms nobody watches are not poked at all: ``watched`` answers from the
+    local viewers, then from the mark watching processes keep in the lease
+    backend, looked up at most once per ``lookup_ttl``.
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        rate=SPECTATOR_UPDATES_PER_SECOND,
+        lookup_ttl=WATCHED_LOOKUP_SECONDS,
+        clock=time.monotonic,
+        autostart=True,
+    ):
+        self.backend = backend
+        self.rate = rate
+        self.lookup_ttl = lookup_ttl
+        self.clock = clock
+        self.autostart = autostart
+        self._rooms = {}
+        self._lookups = TTLCache(lookup_ttl, clock=clock)
+
+    @staticmethod
+    def key(room_group):
+        return f"watched:{room_group}"
+
+    def viewers(self, room_group):
+        room = self._rooms.get(room_group)
+        return len(room.viewers) if room else 0
+
+    async def watched(self, room_group):
+        """Whether any process has spectators on the room."""
+        if room_group in self._rooms:
+            return True
+        if self.backend is None:
+            return False
+        watched = self._lookups.get(room_group)
+        if watched is None:
+            try:
+                watched = await self.backend.get(self.key(room_group)) is not None
+            except Exception:
+                logger.exception("Could not look up spectators of %s", room_group)
+                watched = True
+            self._lookups.set(room_group, watched)
+        return watched
+
+    async def watch(self, room_group, room_id, viewer, build, frame=None):
+        """Add ``viewer`` to the room and return the current frame; ``build`` is an
+        async callable returning it fresh, and ``frame`` one the caller just built."""
+        room = self._rooms.get(room_group)
+        if room is None:
+            room = self._rooms[room_group] = WatchedRoom(room_id, build)
+            await self._mark(room_group)
+            channel_layer = get_channel_layer()
+            room.channel = await channel_layer.new_channel()
+            room.tasks = (asyncio.ensure_future(self._relay(room_group, room, channel_layer)),)
+            if self.autostart:
+                room.tasks += (
+                    asyncio.ensure_future(self._flush(room_group, room)),
+                    asyncio.ensure_future(self._keep_marked(room_group, room)),
+                )
+            await channel_layer.group_add(spectator_group(room_group), room.channel)
+        room.viewers.add(viewer)
+        if room.frame is None or room.changed.is_set():
+            room.frame = frame if frame is not None else await room.build()
+        return room.frame
+
+    async def leave(self, room_group, viewer):
+        room = self._rooms.get(room_group)
+        if room is None:
+            return
+        room.viewers.discard(viewer)
+        if not room.viewers:
+            del self._rooms[room_group]
+            for task in room.tasks:
+                task.cancel()
+            await get_channel_layer().group_discard(spectator_group(room_group), room.channel)
+
+    def changed(self, room_group, room_id=None, origin=None):
+        room = self._rooms.get(room_group)
+        if room is None:
+            return
+        if room_id and origin != snapshots.origin:
+            # Another process changed the room; its snapshot here is stale.
+            snapshots.invalidate(room_id)
+        room.changed.set()
+
+    async def flush_due(self):
+        """Send every changed room whose next slot has come; returns how many."""
+        now = self.clock()
+        due = [
+            (room_group, room)
+            for room_group, room in list(self._rooms.items())
+            if room.changed.is_set() and room.next_at <= now
+        ]
+        for room_group, room in due:
+            await self._send(room_group, room)
+        return len(due)
+
+    async def _send(self, room_group, room):
+        room.changed.clear()
+        room.next_at = self.clock() + 1 / self.rate
+        try:
+            room.frame = await room.build()
+        except Exception:
+            logger.exception("Spectator update for %s failed", room_group)
+        else:
+            for viewer in list(room.viewers):
+                await viewer.send(text_data=room.frame)
+
+    async def _relay(self, room_group, room, channel_layer):
+        while True:
+            event = await channel_layer.receive(room.channel)
+            self.changed(room_group, event.get("room_id"), event.get("origin"))
+
+    async def _flush(self, room_group, room):
+        while True:
+            await room.changed.wait()
+            delay = room.next_at - self.clock()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._send(room_group, room)
+
+    async def _mark(self, room_group):
+        if self.backend is None:
+            return
+        try:
+            await self.backend.acquire(self.key(room_group), "watched", WATCHED_SECONDS)
+        except Exception:
+            logger.exception("Could not mark %s as watched", room_group)
+
+    async def _keep_marked(self, room_group, room):
+        # Other processes may have looked the room up as unwatched just before
+        # it was marked; one rebuild once their lookups expire catches any
+        # change they did not poke.
+        await asyncio.sleep(self.lookup_ttl)
+        self.changed(room_group, room.room_id)
+        while True:
+            await asyncio.sleep(WATCHED_SECONDS / 2 - self.lookup_ttl)
+            await self._mark(room_group)
+
+
+spectators = SpectatorHub(get_lease_backend())
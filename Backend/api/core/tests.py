@@ -1,3 +1,1627 @@
-from django.test import TestCase
+import asyncio
+import bisect
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import partial
+from types import SimpleNamespace
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone as django_timezone
+
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .bingo import CELL_LINE_MASKS, LINE_MASKS, BingoBoard, calculate_completed_lines
+from .cache import SnapshotCache, TTLCache
+from .codec import _json_dumps, get_dumps
+from .consumers import BingoRoomConsumer, LobbyConsumer, TttRoomConsumer, checkpoints
+from .engine import RoomEngine, RoomState, StaleRoomState, engine
+from .leaderboard import LocalLeaderboard, RedisLeaderboard, SortedKeys
+from .leases import DeadlineLeases, LocalLeaseBackend, RoomOwners, leases, owners
+from .lobby import lobby_group, publish_closed
+from .matchmaking import Matchmaker, create_match_rooms
+from .metrics import ActionMetrics, add_sent, count_query, mark_error
+from .models import (
+    ArchivedRoom,
+    GameResult,
+    GameResultPlayer,
+    GameStatus,
+    GameType,
+    PlayerStatus,
+    Profile,
+    Room,
+    RoomPlayer,
+)
+from .queues import RoomCommandQueues
+from .reaper import reap_rooms
+from .replay import ReplayLog
+from .results import DRAW, LOSS, SECOND, WIN, aggregate_pending, log_game_result, rebuild_stats
+from .rooms import create_room_with_id, generate_room_id, room_read_queryset
+from .serializers import RoomSerializer, room_data
+from .spectators import WATCHED_LOOKUP_SECONDS, SpectatorHub, spectator_view
+from .timers import DeadlineScheduler, scheduler
+from .writers import RoomWriterPool
+from .ws_auth import ClaimsUser, get_user_for_token
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def iso_at(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc).isoformat()
+
+
+class BingoBoardTests(SimpleTestCase):
+    LINES = (
+        [[row * 5 + col for col in range(5)] for row in range(5)]
+        + [[row * 5 + col for row in range(5)] for col in range(5)]
+        + [[idx * 6 for idx in range(5)], [idx * 4 + 4 for idx in range(5)]]
+    )
+
+    def recount(self, board_numbers, called):
+        return sum(all(board_numbers[cell] in called for cell in line) for line in self.LINES)
+
+    def test_masks_cover_the_twelve_lines(self):
+        self.assertEqual(sorted(LINE_MASKS), sorted(sum(1 << cell for cell in line) for line in self.LINES))
+        through = [len(masks) for masks in CELL_LINE_MASKS]
+        # Two lines through every cell, three on a diagonal, four in the middle.
+        self.assertEqual((through[1], through[0], through[4], through[12]), (2, 3, 3, 4))
+        self.assertEqual(sum(through), 12 * 5)
+
+    def test_incremental_counts_match_a_full_recount(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            board_numbers = rng.sample(range(1, 26), 25)
+            board = BingoBoard(board_numbers)
+            called = []
+            for number in rng.sample(range(1, 26), 25):
+                before = board.completed
+                added = board.mark(number)
+                called.append(number)
+                self.assertEqual(board.completed, before + added)
+                self.assertEqual(board.completed, calculate_completed_lines(board_numbers, called))
+                self.assertEqual(board.completed, self.recount(board_numbers, set(called)))
+                if len(called) == 10:
+                    self.assertEqual(BingoBoard(board_numbers, called).completed, board.completed)
+            self.assertEqual(board.completed, 12)
+
+    def test_repeated_and_unknown_numbers_add_nothing(self):
+        board = BingoBoard(list(range(1, 26)), [1, 2, 3, 4])
+        self.assertEqual(board.mark(5), 1)
+        self.assertEqual((board.mark(5), board.mark(26), board.completed), (0, 0, 1))
+        self.assertEqual(calculate_completed_lines([1, 2, 3], [1, 2, 3]), 0)
+
+
+class DeadlineSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = DeadlineScheduler(clock=self.clock, grace=0.1, late_after=1.0, autostart=False)
+        self.fired = []
+
+    async def handler(self, room_id, deadline_iso):
+        self.fired.append((room_id, deadline_iso))
+
+    def schedule(self, room_id, seconds_from_now):
+        deadline = iso_at(self.clock() + seconds_from_now)
+        self.scheduler.schedule(room_id, deadline, self.handler)
+        return deadline
+
+    async def test_fires_only_due_deadlines_in_one_batch(self):
+        first = self.schedule("AAAAAA", 5)
+        second = self.schedule("BBBBBB", 5)
+        self.schedule("CCCCCC", 30)
+
+        self.clock.advance(5)
+        self.assertEqual(await self.scheduler.fire_due(), 0)
+
+        self.clock.advance(0.2)
+        self.assertEqual(await self.scheduler.fire_due(), 2)
+        await self.scheduler.join()
+        self.assertCountEqual(self.fired, [("AAAAAA", first), ("BBBBBB", second)])
+        self.assertEqual(self.scheduler.stats(), {"pending": 1, "fired": 2, "fired_late": 0})
+
+    async def test_rescheduling_a_room_replaces_its_deadline(self):
+        self.schedule("AAAAAA", 5)
+        latest = self.schedule("AAAAAA", 10)
+        self.assertEqual(self.scheduler.pending, 1)
+
+        self.clock.advance(6)
+        self.assertEqual(await self.scheduler.fire_due(), 0)
+        self.clock.advance(5)
+        self.assertEqual(await self.scheduler.fire_due(), 1)
+        await self.scheduler.join()
+        self.assertEqual(self.fired, [("AAAAAA", latest)])
+
+    async def test_same_deadline_is_not_queued_twice(self):
+        deadline = self.schedule("AAAAAA", 5)
+        self.scheduler.schedule("AAAAAA", deadline, self.handler)
+        self.assertEqual(len(self.scheduler._heap), 1)
+
+    async def test_cancelled_deadline_does_not_fire(self):
+        self.schedule("AAAAAA", 5)
+        self.scheduler.cancel("AAAAAA")
+        self.assertEqual(self.scheduler.pending, 0)
+
+        self.clock.advance(10)
+        self.assertEqual(await self.scheduler.fire_due(), 0)
+        self.assertIsNone(self.scheduler.next_due())
+
+    async def test_counts_late_fires(self):
+        self.schedule("AAAAAA", 5)
+        self.schedule("BBBBBB", 8)
+
+        self.clock.advance(7)
+        await self.scheduler.fire_due()
+        self.clock.advance(1.5)
+        await self.scheduler.fire_due()
+        self.assertEqual(self.scheduler.fired_late, 1)
+        self.assertEqual(self.scheduler.fired, 2)
+
+    async def test_failing_handler_does_not_drop_the_batch(self):
+        async def broken(room_id, deadline_iso):
+            raise RuntimeError("boom")
+
+        self.scheduler.schedule("AAAAAA", iso_at(self.clock() + 1), broken)
+        self.schedule("BBBBBB", 1)
+        self.clock.advance(2)
+        with self.assertLogs("core.timers", level="ERROR"):
+            self.assertEqual(await self.scheduler.fire_due(), 2)
+            await self.scheduler.join()
+        self.assertEqual([room_id for room_id, _ in self.fired], ["BBBBBB"])
+
+    async def test_slow_handler_does_not_hold_up_later_deadlines(self):
+        release = asyncio.Event()
+
+        async def slow(room_id, deadline_iso):
+            await release.wait()
+            self.fired.append((room_id, deadline_iso))
+
+        self.scheduler.schedule("AAAAAA", iso_at(self.clock() + 1), slow)
+        later = self.schedule("BBBBBB", 3)
+        self.clock.advance(2)
+        self.assertEqual(await self.scheduler.fire_due(), 1)
+
+        self.clock.advance(2)
+        self.assertEqual(await self.scheduler.fire_due(), 1)
+        await asyncio.sleep(0)
+        self.assertEqual(self.fired, [("BBBBBB", later)])
+
+        release.set()
+        await self.scheduler.join()
+        self.assertEqual([room_id for room_id, _ in self.fired], ["BBBBBB", "AAAAAA"])
+
+
+class DeadlineLeasesTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        backend = LocalLeaseBackend(clock=self.clock)
+        self.first = DeadlineLeases(backend, owner="worker-1", margin=3.0, clock=self.clock)
+        self.second = DeadlineLeases(backend, owner="worker-2", margin=3.0, clock=self.clock)
+
+    async def test_only_one_worker_owns_a_deadline(self):
+        deadline = iso_at(self.clock() + 10)
+        self.assertTrue(await self.first.claim("AAAAAA", deadline))
+        self.assertFalse(await self.second.claim("AAAAAA", deadline))
+        self.assertTrue(await self.second.claim("BBBBBB", deadline))
+
+    async def test_owner_renews_for_the_next_deadline(self):
+        self.assertTrue(await self.first.claim("AAAAAA", iso_at(self.clock() + 10)))
+        self.clock.advance(10)
+        self.assertTrue(await self.first.claim("AAAAAA", iso_at(self.clock() + 10)))
+        self.clock.advance(5)
+        self.assertFalse(await self.second.claim("AAAAAA", iso_at(self.clock() + 5)))
+
+    async def test_ownership_fails_over_when_the_lease_lapses(self):
+        deadline = iso_at(self.clock() + 10)
+        self.assertTrue(await self.first.claim("AAAAAA", deadline))
+        self.clock.advance(12.9)
+        self.assertFalse(await self.second.claim("AAAAAA", deadline))
+        self.clock.advance(0.2)
+        self.assertTrue(await self.second.claim("AAAAAA", deadline))
+        self.assertFalse(await self.first.claim("AAAAAA", deadline))
+
+    async def test_release_frees_the_room(self):
+        deadline = iso_at(self.clock() + 10)
+        await self.first.claim("AAAAAA", deadline)
+        await self.second.release("AAAAAA")
+        self.assertFalse(await self.second.claim("AAAAAA", deadline))
+        await self.first.release("AAAAAA")
+        self.assertTrue(await self.second.claim("AAAAAA", deadline))
+
+
+class RoomOwnersTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        backend = LocalLeaseBackend(clock=self.clock)
+        self.here = RoomOwners(backend, ttl=10.0, clock=self.clock)
+        self.there = RoomOwners(backend, ttl=10.0, clock=self.clock)
+
+    async def listen(self, owners, handler):
+        await owners.listen(get_channel_layer(), handler)
+        self.addCleanup(owners._task.cancel)
+
+    async def test_commands_are_forwarded_to_the_owner(self):
+        received = []
+
+        async def handler(message):
+            received.append(message)
+            return {"error": "Not your turn"}
+
+        await self.listen(self.there, handler)
+        self.assertTrue(await self.there.claim("ROOM01"))
+        self.assertFalse(await self.here.claim("ROOM01"))
+
+        owner = await self.here.owner("ROOM01")
+        self.assertEqual(owner, self.there.channel)
+        reply = await self.here.ask(get_channel_layer(), owner, {"action": "mark_number", "room_id": "ROOM01", "number": 5})
+        self.assertEqual(reply["error"], "Not your turn")
+        self.assertEqual((received[0]["action"], received[0]["number"]), ("mark_number", 5))
+
+    async def test_the_room_moves_once_the_owner_lets_go(self):
+        await self.listen(self.there, None)
+        await self.listen(self.here, None)
+        await self.there.claim("ROOM01")
+        self.clock.advance(6)
+        # Renewed past half the lease, so it outlives the first ten seconds.
+        self.assertTrue(await self.there.claim("ROOM01"))
+        self.clock.advance(6)
+        self.assertFalse(await self.here.claim("ROOM01"))
+
+        await self.there.release("ROOM01")
+        self.assertTrue(await self.here.claim("ROOM01"))
+        self.assertEqual(await self.there.owner("ROOM01"), self.here.channel)
+
+
+# 22 to 25 block every line but the last row and column, so these players
+# finish after the first one, who holds 1..25 in order.
+OTHER_BOARD = [22, 1, 2, 3, 4, 5, 6, 7, 23, 8, 9, 24, 10, 11, 12, 13, 14, 25, 15, 16, 17, 18, 19, 20, 21]
+
+
+def started_bingo_room(room_id, users, called=b""):
+    room = Room.objects.create(
+        room_id=room_id,
+        owner=users[0],
+        max_players=len(users),
+        status=GameStatus.STARTED,
+        called_sequence=called,
+        current_turn_player=users[0],
+        turn_deadline=django_timezone.now() + timedelta(seconds=30),
+    )
+    for order, user in enumerate(users, start=1):
+        board = list(range(1, 26)) if order == 1 else OTHER_BOARD
+        RoomPlayer.objects.create(room=room, user=user, turn_order=order, status=PlayerStatus.PLAYING, board_numbers=board)
+    return room
+
+
+class RoomEngineTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f"engine{idx}") for idx in range(3)]
+        self.engine = RoomEngine(flush_interval=5.0)
+
+    def load(self, players, called=b""):
+        self.room = started_bingo_room("ENGINE", self.users[:players], called)
+        return self.engine.load("ENGINE")
+
+    def test_moves_follow_turn_order(self):
+        state = self.load(3)
+        with self.assertRaisesMessage(ValueError, "Not your turn"):
+            state.apply_move(self.users[1].id, 5)
+        with self.assertRaisesMessage(ValueError, "Number must be in range 1..25"):
+            state.apply_move(self.users[0].id, 26)
+
+        event = state.apply_move(self.users[0].id, 5)
+        self.assertEqual((event["type"], event["seq"]), ("turn_changed", 1))
+        self.assertEqual(event["delta"]["current_turn_player_id"], self.users[1].id)
+        with self.assertRaisesMessage(ValueError, "Number already eliminated"):
+            state.apply_move(self.users[1].id, 5)
+        state.apply_move(self.users[1].id, 6)
+        state.apply_move(self.users[2].id, 7)
+        self.assertEqual(state.current_turn_player_id, self.users[0].id)
+        self.assertEqual(list(state.called_numbers), [5, 6, 7])
+
+    def test_events_are_numbered_and_carry_only_what_changed(self):
+        state = self.load(2)
+        self.assertEqual(state.start_event()["seq"], 1)
+
+        events = [state.apply_move(self.users[idx % 2].id, number) for idx, number in enumerate(range(1, 6))]
+        self.assertEqual([event["seq"] for event in events], [2, 3, 4, 5, 6])
+        for event in events[:4]:
+            self.assertNotIn("players", event["delta"])
+            self.assertNotIn("winner_order", event["delta"])
+            self.assertIn("turn_deadline", event["delta"])
+        self.assertEqual(events[0]["delta"]["number"], 1)
+        self.assertEqual(events[0]["delta"]["called_by"], self.users[0].id)
+        # Calling 5 completes the first player's top row and nobody else's.
+        self.assertEqual(events[4]["delta"]["players"], [
+            {"user_id": self.users[0].id, "status": PlayerStatus.PLAYING, "lines_completed": 1, "rank": None}
+        ])
+        self.assertNotIn("winner_order", events[4]["delta"])
+        self.assertEqual(state.snapshot()["seq"], 6)
+
+    def test_expired_turns_are_rejected_then_skipped(self):
+        state = self.load(3)
+        state.turn_deadline = django_timezone.now() - timedelta(seconds=1)
+        with self.assertRaisesMessage(ValueError, "Turn expired"):
+            state.apply_move(self.users[0].id, 5)
+
+        deadline = state.turn_deadline.isoformat()
+        self.assertIsNone(state.skip_turn("2000-01-01T00:00:00+00:00"))
+        event = state.skip_turn(deadline)
+        self.assertEqual(event["type"], "turn_auto_skipped")
+        self.assertEqual(event["delta"]["players"], [
+            {"user_id": self.users[0].id, "status": PlayerStatus.SKIPPED, "lines_completed": 0, "rank": None}
+        ])
+        self.assertEqual(state.current_turn_player_id, self.users[1].id)
+        self.assertIsNone(state.skip_turn(deadline))
+
+        state.apply_move(self.users[1].id, 5)
+        state.apply_move(self.users[2].id, 6)
+        state.apply_move(self.users[0].id, 7)
+        self.assertEqual(state.by_user[self.users[0].id].status, PlayerStatus.PLAYING)
+
+    def test_three_players_end_once_two_are_ranked(self):
+        state = self.load(3, called=bytes(range(1, 21)))
+        event = state.apply_move(self.users[0].id, 21)
+        self.assertEqual(event["type"], "turn_changed")
+        self.assertEqual(event["delta"]["winner_order"], [self.users[0].id])
+        self.assertEqual(state.by_user[self.users[0].id].status, PlayerStatus.FINISHED)
+        self.assertEqual(state.current_turn_player_id, self.users[1].id)
+
+        # 22 completes both other boards at once; they rank in turn order.
+        event = state.apply_move(self.users[1].id, 22)
+        self.assertEqual(event["type"], "game_ended")
+        self.assertEqual([state.by_user[user.id].rank for user in self.users], [1, 2, 3])
+        self.assertEqual(state.winner_order, [user.id for user in self.users])
+        self.assertIsNone(state.current_turn_player_id)
+
+    def test_checkpoints_wait_for_the_interval_until_the_game_ends(self):
+        state = self.load(2)
+        state.apply_move(self.users[0].id, 5)
+        self.assertFalse(self.engine.flush_due(state))
+        state.flushed_at -= 5.0
+        self.assertTrue(self.engine.flush_due(state))
+        with self.assertNumQueries(4):
+            self.assertTrue(self.engine.flush(state))
+        self.assertFalse(self.engine.flush(state))
+        self.room.refresh_from_db()
+        self.assertEqual((bytes(self.room.called_sequence), self.room.current_turn_player_id), (bytes([5]), self.users[1].id))
+
+    def test_flushing_the_end_stores_the_ranks_and_logs_the_result(self):
+        state = self.load(2, called=bytes(range(1, 21)))
+        self.assertEqual(state.apply_move(self.users[0].id, 21)["type"], "game_ended")
+        self.assertTrue(self.engine.flush_due(state))
+        self.assertTrue(self.engine.flush(state))
+        self.assertIsNone(self.engine.get("ENGINE"))
+
+        self.room.refresh_from_db()
+        self.assertEqual((self.room.status, self.room.winner_order), (GameStatus.ENDED, [self.users[0].id]))
+        self.assertEqual(
+            dict(RoomPlayer.objects.filter(room=self.room).values_list("user_id", "rank")),
+            {self.users[0].id: 1, self.users[1].id: None},
+        )
+        result = GameResult.objects.get(room=self.room)
+        self.assertEqual(result.game_type, GameType.BINGO)
+        self.assertEqual(
+            dict(result.players.values_list("user_id", "outcome")), {self.users[0].id: WIN, self.users[1].id: LOSS}
+        )
+
+    def test_checkpoint_over_a_newer_row_is_refused(self):
+        state = self.load(2)
+        state.apply_move(self.users[0].id, 5)
+        self.assertTrue(self.engine.flush(state))
+
+        state.apply_move(self.users[1].id, 6)
+        Room.objects.filter(pk=self.room.pk).update(status=GameStatus.ENDED, updated_at=django_timezone.now())
+        with self.assertRaises(StaleRoomState):
+            self.engine.flush(state)
+        self.assertIsNone(self.engine.get("ENGINE"))
+        self.room.refresh_from_db()
+        self.assertEqual((self.room.status, bytes(self.room.called_sequence)), (GameStatus.ENDED, bytes([5])))
+
+    def test_shutdown_writes_every_room_it_can(self):
+        # The stale room comes first, and must not stop the other being written.
+        other = started_bingo_room("OTHER1", self.users[:2])
+        stale = self.engine.load("OTHER1")
+        stale.apply_move(self.users[0].id, 9)
+        Room.objects.filter(pk=other.pk).update(updated_at=django_timezone.now())
+        state = self.load(2)
+        state.apply_move(self.users[0].id, 5)
+
+        with self.assertLogs("core.engine", "ERROR"):
+            self.engine.flush_all()
+        self.room.refresh_from_db()
+        self.assertEqual(bytes(self.room.called_sequence), bytes([5]))
+        self.assertFalse(state.dirty)
+
+
+class BingoConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f"bingo{idx}") for idx in range(2)]
+
+    async def connect(self, room_id, user):
+        communicator = WebsocketCommunicator(BingoRoomConsumer.as_asgi(), f"/ws/gamify/{room_id}/")
+        communicator.scope["user"] = user
+        communicator.scope["url_route"] = {"kwargs": {"room_id": room_id}}
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())["type"], "room_snapshot")
+        return communicator
+
+    async def stop(self, *communicators):
+        for communicator in communicators:
+            await communicator.disconnect()
+        owners._task.cancel()
+
+    async def room(self, room_id):
+        return await Room.objects.aget(room_id=room_id)
+
+    async def test_a_game_is_played_to_the_end_over_sockets(self):
+        room = await Room.objects.acreate(room_id="PLAY01", owner=self.users[0], max_players=2)
+        for order, user in enumerate(self.users, start=1):
+            await RoomPlayer.objects.acreate(room=room, user=user, turn_order=order)
+        sockets = {user.id: await self.connect("PLAY01", user) for user in self.users}
+        first, second = sockets.values()
+
+        await second.send_json_to({"action": "start_game"})
+        self.assertEqual(await second.receive_json_from(), {"type": "error", "message": "Only room owner can start the game"})
+        # A refused start leaves the room's owner lease alone.
+        self.assertIsNone(await owners.owner("PLAY01"))
+        await first.send_json_to({"action": "start_game"})
+        events = [await socket.receive_json_from() for socket in sockets.values()]
+        self.assertEqual([(event["type"], event["seq"]) for event in events], [("game_started", 1)] * 2)
+        delta = events[0]["delta"]
+        self.assertEqual(delta["current_turn_player_id"], self.users[0].id)
+        self.assertEqual(len({tuple(player["board_numbers"]) for player in delta["players"]}), 2)
+
+        await second.send_json_to({"action": "mark_number", "number": 1})
+        self.assertEqual(await second.receive_json_from(), {"type": "error", "message": "Not your turn"})
+
+        turns = []
+        for number in range(1, 26):
+            turns.append(delta["current_turn_player_id"])
+            await sockets[delta["current_turn_player_id"]].send_json_to({"action": "mark_number", "number": number})
+            events = [await socket.receive_json_from() for socket in sockets.values()]
+            self.assertEqual(events[0], events[1])
+            delta = events[0]["delta"]
+            self.assertEqual((events[0]["seq"], delta["number"]), (number + 1, number))
+            if events[0]["type"] == "game_ended":
+                break
+        self.assertEqual(turns[:4], [self.users[0].id, self.users[1].id] * 2)
+        self.assertEqual(delta["status"], GameStatus.ENDED)
+
+        # The end is written as soon as it happens, with the game's result.
+        room = await self.room("PLAY01")
+        self.assertEqual((room.status, len(room.called_sequence)), (GameStatus.ENDED, len(turns)))
+        self.assertEqual(room.winner_order, delta["winner_order"])
+        result = await GameResult.objects.aget(room=room)
+        outcomes = {row["user_id"]: row["outcome"] async for row in result.players.values("user_id", "outcome")}
+        self.assertEqual(outcomes[room.winner_order[0]], WIN)
+        self.assertIsNone(engine.get("PLAY01"))
+        await self.stop(first, second)
+
+    async def test_a_failed_final_checkpoint_is_broadcast_and_retried(self):
+        # Player 0 holds rows one to four and completes the 21..5 diagonal.
+        await sync_to_async(started_bingo_room)("FLUSH1", self.users, called=bytes(range(1, 21)))
+        player = await self.connect("FLUSH1", self.users[0])
+        write = RoomEngine._write
+        calls = []
+
+        def flaky_write(engine, record):
+            calls.append(record["status"])
+            if len(calls) == 1:
+                raise OperationalError("database is locked")
+            return write(engine, record)
+
+        with mock.patch.object(RoomEngine, "_write", flaky_write), mock.patch("core.consumers.FLUSH_RETRY_SECONDS", 0.05):
+            with self.assertLogs("core.consumers", "ERROR"):
+                await player.send_json_to({"action": "mark_number", "number": 21})
+                event = await player.receive_json_from()
+            self.assertEqual((event["type"], event["delta"]["winner_order"]), ("game_ended", [self.users[0].id]))
+            self.assertEqual((await self.room("FLUSH1")).status, GameStatus.STARTED)
+            for _ in range(50):
+                if engine.get("FLUSH1") is None:
+                    break
+                await asyncio.sleep(0.02)
+
+        self.assertEqual(calls, [GameStatus.ENDED, GameStatus.ENDED])
+        self.assertEqual((await self.room("FLUSH1")).status, GameStatus.ENDED)
+        self.assertEqual(await GameResult.objects.filter(room__room_id="FLUSH1").acount(), 1)
+        await self.stop(player)
+
+    async def test_the_last_socket_to_leave_hands_the_room_off(self):
+        await sync_to_async(started_bingo_room)("HAND01", self.users)
+        first, second = [await self.connect("HAND01", user) for user in self.users]
+        await first.send_json_to({"action": "mark_number", "number": 1})
+        await first.receive_json_from()
+        await second.receive_json_from()
+        self.assertEqual(bytes((await self.room("HAND01")).called_sequence), b"")
+
+        await first.disconnect()
+        self.assertIsNotNone(engine.get("HAND01"))
+        await self.stop(second)
+        self.assertEqual(bytes((await self.room("HAND01")).called_sequence), b"\x01")
+        self.assertIsNone(engine.get("HAND01"))
+        self.assertIsNone(await owners.owner("HAND01"))
+        scheduler.cancel("HAND01")
+
+    async def test_an_idle_room_is_checkpointed_by_the_tick(self):
+        await sync_to_async(started_bingo_room)("IDLE01", self.users)
+        player = await self.connect("IDLE01", self.users[0])
+        await player.send_json_to({"action": "mark_number", "number": 1})
+        await player.receive_json_from()
+        self.assertEqual(await checkpoints.flush_due(), 0)
+        self.assertEqual(bytes((await self.room("IDLE01")).called_sequence), b"")
+
+        with mock.patch.object(engine, "flush_interval", 0):
+            self.assertEqual(await checkpoints.flush_due(), 1)
+        self.assertEqual(bytes((await self.room("IDLE01")).called_sequence), b"\x01")
+        self.assertFalse(engine.get("IDLE01").dirty)
+        await self.stop(player)
+        scheduler.cancel("IDLE01")
+
+    async def test_a_reconnect_gets_what_it_missed_and_arms_the_timer(self):
+        await sync_to_async(started_bingo_room)("BACK01", self.users)
+        player = await self.connect("BACK01", self.users[0])
+        await player.send_json_to({"action": "mark_number", "number": 1})
+        event = await player.receive_json_from()
+        epoch = engine.get("BACK01").epoch
+        self.assertEqual((event["epoch"], event["seq"]), (epoch, 1))
+        # As on a worker that has not seen the room's timer yet.
+        scheduler.cancel("BACK01")
+
+        other = WebsocketCommunicator(BingoRoomConsumer.as_asgi(), f"/ws/gamify/BACK01/?epoch={epoch}&last_seq=0")
+        other.scope["user"] = self.users[1]
+        other.scope["url_route"] = {"kwargs": {"room_id": "BACK01"}}
+        with mock.patch.object(BingoRoomConsumer, "_room_snapshot") as build:
+            self.assertTrue((await other.connect())[0])
+            self.assertEqual(await other.receive_json_from(), event)
+        build.assert_not_called()
+        self.assertEqual(scheduler._entries["BACK01"][1], event["delta"]["turn_deadline"])
+        # Without the engine here, the newest buffered event has the turn.
+        consumer = BingoRoomConsumer()
+        consumer.room_id = "BACK01"
+        with mock.patch.object(engine, "get", return_value=None):
+            self.assertEqual(consumer._replayed_turn()["turn_deadline"], event["delta"]["turn_deadline"])
+
+        # Seq 0 of another load is not this one's.
+        stale = WebsocketCommunicator(BingoRoomConsumer.as_asgi(), "/ws/gamify/BACK01/?epoch=gone&last_seq=0")
+        stale.scope["user"] = self.users[1]
+        stale.scope["url_route"] = {"kwargs": {"room_id": "BACK01"}}
+        self.assertTrue((await stale.connect())[0])
+        snapshot = await stale.receive_json_from()
+        self.assertEqual((snapshot["type"], snapshot["data"]["epoch"], snapshot["data"]["seq"]), ("room_snapshot", epoch, 1))
+        await self.stop(player, other, stale)
+        scheduler.cancel("BACK01")
+
+    async def test_standby_leaves_a_live_owner_its_room(self):
+        await sync_to_async(started_bingo_room)("LIVE01", self.users)
+        await owners.backend.acquire(owners.key("LIVE01"), "elsewhere", owners.ttl)
+        consumer = BingoRoomConsumer()
+        consumer.channel_layer = get_channel_layer()
+        deadline = django_timezone.now().isoformat()
+
+        with mock.patch.object(owners, "ask", mock.AsyncMock(return_value=None)) as ask:
+            await consumer._standby_deadline_expired("LIVE01", deadline)
+        ask.assert_awaited_once()
+        self.assertEqual(ask.await_args.args[2], {"action": "auto_skip", "room_id": "LIVE01", "deadline": deadline})
+        self.assertIsNone(engine.get("LIVE01"))
+        # With no answer it looks again once the owner lease could have lapsed.
+        token = scheduler._entries["LIVE01"][0]
+        due = next(due for due, entry, key in scheduler._heap if entry == token)
+        self.assertGreater(due, time.time() + owners.ttl - 1)
+        scheduler.cancel("LIVE01")
+        await owners.backend.release(owners.key("LIVE01"), "elsewhere")
+
+    async def test_standby_takes_over_a_room_whose_owner_is_gone(self):
+        await sync_to_async(started_bingo_room)("TAKE01", self.users, called=b"\x01")
+        player = await self.connect("TAKE01", self.users[0])
+        scheduler.cancel("TAKE01")
+        await leases.release("TAKE01")
+        deadline = django_timezone.now() - timedelta(seconds=1)
+        await Room.objects.filter(room_id="TAKE01").aupdate(turn_deadline=deadline, updated_at=django_timezone.now())
+
+        consumer = BingoRoomConsumer()
+        consumer.channel_layer = get_channel_layer()
+        with self.assertLogs("core.consumers", "WARNING"):
+            await consumer._standby_deadline_expired("TAKE01", deadline.isoformat())
+        resync = await player.receive_json_from()
+        self.assertEqual((resync["type"], resync["data"]["called_numbers"]), ("room_snapshot", [1]))
+        self.assertNotIn("seq", resync)
+        skipped = await player.receive_json_from(timeout=2)
+        self.assertEqual(skipped["type"], "turn_auto_skipped")
+        self.assertEqual(skipped["delta"]["current_turn_player_id"], self.users[1].id)
+        await self.stop(player)
+        scheduler.cancel("TAKE01")
+        engine.discard("TAKE01")
+        await owners.release("TAKE01")
+
+
+class SortedKeysTests(SimpleTestCase):
+    def test_matches_a_sorted_list_across_runs(self):
+        class SmallRuns(SortedKeys):
+            RUN = 8
+
+        rng = random.Random(7)
+        keys = SmallRuns(rng.sample(range(10000), 300))
+        expected = sorted(keys.slice(0, 300))
+        for _ in range(500):
+            if expected and rng.random() < 0.4:
+                key = expected.pop(rng.randrange(len(expected)))
+                keys.remove(key)
+            else:
+                key = rng.randrange(10000)
+                if key in expected:
+                    continue
+                keys.add(key)
+                expected = sorted(expected + [key])
+            self.assertEqual(keys.index(key), bisect.bisect_left(expected, key))
+        self.assertEqual(len(keys), len(expected))
+        self.assertEqual(keys.slice(0, len(expected)), expected)
+        self.assertEqual(keys.slice(17, 40), expected[17:40])
+
+    def test_pages_deep_into_a_large_table(self):
+        rng = random.Random(11)
+        expected = sorted(rng.sample(range(10_000_000), 200_000))
+        keys = SortedKeys(expected)
+        for key in rng.sample(expected, 2000):
+            keys.remove(key)
+            expected.remove(key)
+        for key in rng.sample(range(10_000_000, 10_100_000), 2000):
+            keys.add(key)
+            bisect.insort(expected, key)
+
+        for offset in (0, 1023, 99_990, len(expected) - 20, len(expected) - 5):
+            self.assertEqual(keys.slice(offset, offset + 20), expected[offset:offset + 20])
+        for position in (0, 511, 150_000, len(expected) - 1):
+            self.assertEqual(keys.index(expected[position]), position)
+        self.assertEqual(keys.slice(len(expected), len(expected) + 20), [])
+        # The tree covers every run, however many splits and removals made them.
+        self.assertEqual(keys._locate(len(expected) - 1), (len(keys._runs) - 1, len(keys._runs[-1]) - 1))
+
+
+class LeaderboardTestsMixin:
+    # Shared by both backends, which must rank every profile the same way.
+    def make_board(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.board = self.make_board()
+        self.users = {}
+        for username, matches, wins, points in (
+            ("ana", 4, 2, 20),
+            ("ben", 2, 2, 20),
+            ("cy", 4, 2, 25),
+            ("dee", 0, 0, 0),
+            ("eve", 3, 1, 10),
+            ("fay", 3, 1, 10),
+        ):
+            user = User.objects.create_user(username=username, password="pw")
+            user.profile.total_matches = matches
+            user.profile.wins = wins
+            user.profile.points = points
+            user.profile.save()
+            self.users[username] = user
+
+    def test_orders_by_win_rate_then_points_then_user(self):
+        rows = self.board.page(0, 10)
+        self.assertEqual([row["username"] for row in rows], ["ben", "cy", "ana", "eve", "fay", "dee"])
+        self.assertEqual([row["rank"] for row in rows], [1, 2, 3, 4, 5, 6])
+        self.assertEqual(self.board.page(1, 2)[0], {**rows[1], "rank": 2})
+        self.assertEqual(self.board.entry(self.users["fay"].id)["rank"], 5)
+
+    def test_refresh_moves_only_the_changed_profile(self):
+        self.assertEqual(self.board.entry(self.users["dee"].id)["rank"], 6)
+
+        profile = self.users["dee"].profile
+        profile.total_matches = 1
+        profile.wins = 1
+        profile.points = 10
+        profile.save()
+        self.assertEqual(self.board.entry(self.users["dee"].id)["rank"], 6)
+
+        with self.assertNumQueries(1):
+            self.board.refresh([self.users["dee"].id])
+        self.assertEqual(self.board.entry(self.users["dee"].id)["rank"], 2)
+        self.assertEqual(self.board.entry(self.users["ben"].id)["rank"], 1)
+        self.assertEqual(self.board.entry(self.users["ana"].id)["rank"], 4)
+
+    def test_removed_profiles_leave_the_ranking(self):
+        self.board.page(0, 10)
+        self.board.remove([self.users["ben"].id])
+        self.assertIsNone(self.board.entry(self.users["ben"].id))
+        self.assertEqual(self.board.entry(self.users["cy"].id)["rank"], 1)
+
+
+class LocalLeaderboardTests(LeaderboardTestsMixin, TestCase):
+    def make_board(self):
+        self.clock = FakeClock()
+        return LocalLeaderboard(sync_interval=2.0, clock=self.clock)
+
+    def test_picks_up_changes_made_by_other_processes(self):
+        self.assertEqual(self.board.entry(self.users["dee"].id)["rank"], 6)
+        # As another process would: no signal reaches this board.
+        Profile.objects.filter(user=self.users["dee"]).update(
+            total_matches=1, wins=1, points=10, updated_at=django_timezone.now()
+        )
+        self.assertEqual(self.board.entry(self.users["dee"].id)["rank"], 6)
+
+        self.clock.advance(2.5)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.board.entry(self.users["dee"].id)["rank"], 2)
+        self.assertEqual(self.board.entry(self.users["ana"].id)["rank"], 4)
+
+
+@skipUnless(os.getenv("TEST_REDIS_URL"), "set TEST_REDIS_URL to run against Redis")
+class RedisLeaderboardTests(LeaderboardTestsMixin, TestCase):
+    def make_board(self):
+        board = RedisLeaderboard(os.environ["TEST_REDIS_URL"])
+        board.reload()
+        self.addCleanup(board.reload)
+        return board
+
+
+class GameResultLogTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f"player{idx}", password="pw") for idx in range(5)]
+
+    def stats(self):
+        return {
+            row["user_id"]: row
+            for row in Profile.objects.values("user_id", "total_matches", "wins", "second_place", "losses", "points")
+        }
+
+    def log_bingo_game(self, winner, second):
+        placements = [(user.id, LOSS, 3) for user in self.users if user not in (winner, second)]
+        placements += [(winner.id, WIN, 1), (second.id, SECOND, 2)]
+        return log_game_result(None, GameType.BINGO, placements)
+
+    def test_logging_a_game_leaves_profiles_untouched(self):
+        with self.assertNumQueries(2):
+            self.log_bingo_game(self.users[0], self.users[1])
+        self.assertTrue(all(row["total_matches"] == 0 for row in self.stats().values()))
+        self.assertEqual(GameResultPlayer.objects.filter(user=self.users[0], outcome=WIN).count(), 1)
+
+    def test_aggregates_a_batch_in_a_fixed_number_of_queries(self):
+        Profile.objects.filter(user=self.users[4]).delete()
+        for _ in range(3):
+            self.log_bingo_game(self.users[0], self.users[1])
+        self.log_bingo_game(self.users[1], self.users[4])
+
+        with self.assertNumQueries(7):
+            self.assertEqual(aggregate_pending(), 4)
+        self.assertEqual(aggregate_pending(), 0)
+
+        stats = self.stats()
+        self.assertEqual(stats[self.users[0].id]["wins"], 3)
+        self.assertEqual(stats[self.users[0].id]["losses"], 1)
+        self.assertEqual(stats[self.users[0].id]["points"], 30)
+        self.assertEqual(stats[self.users[1].id]["wins"], 1)
+        self.assertEqual(stats[self.users[1].id]["second_place"], 3)
+        self.assertEqual(stats[self.users[1].id]["points"], 25)
+        self.assertEqual(stats[self.users[4].id]["second_place"], 1)
+        self.assertTrue(all(row["total_matches"] == 4 for row in stats.values()))
+
+    def test_draws_only_count_the_match(self):
+        log_game_result(None, GameType.OXO, [(self.users[0].id, DRAW, None), (self.users[1].id, DRAW, None)])
+        aggregate_pending()
+        stats = self.stats()[self.users[0].id]
+        self.assertEqual((stats["total_matches"], stats["wins"], stats["losses"], stats["points"]), (1, 0, 0, 0))
+
+    def test_rebuild_replays_the_log(self):
+        self.log_bingo_game(self.users[0], self.users[1])
+        self.log_bingo_game(self.users[2], self.users[0])
+        aggregate_pending()
+        before = self.stats()
+
+        Profile.objects.filter(user=self.users[0]).update(wins=99, points=999)
+        self.assertEqual(rebuild_stats(batch_size=1), 2)
+        self.assertEqual(self.stats(), before)
+
+
+class ConnectFastPathTests(SimpleTestCase):
+    def test_cache_entries_expire(self):
+        clock = FakeClock()
+        cache = TTLCache(60, clock=clock)
+        cache.set(("ROOM01", 1), True)
+        cache.set(("ROOM01", 2), False, ttl=5)
+        clock.advance(10)
+        self.assertIs(cache.get(("ROOM01", 1)), True)
+        self.assertIsNone(cache.get(("ROOM01", 2)))
+
+    def test_cache_drops_oldest_entry_when_full(self):
+        cache = TTLCache(60, max_entries=2)
+        for key in ("a", "b", "c"):
+            cache.set(key, key)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("c"), "c")
+
+    def test_claims_user_matches_database_ids(self):
+        token = AccessToken()
+        token["user_id"] = "42"
+        token["username"] = "alice"
+        user = ClaimsUser(token)
+        self.assertEqual(user.id, 42)
+        self.assertEqual(user.username, "alice")
+        self.assertFalse(user.is_anonymous)
+
+
+class SocketUserTests(TestCase):
+    async def test_deleted_users_lose_socket_access_unless_claims_are_trusted(self):
+        user = await User.objects.acreate(username="gone")
+        token = AccessToken.for_user(user)
+        user_id = user.id
+        await user.adelete()
+
+        self.assertTrue((await get_user_for_token(token)).is_anonymous)
+        with override_settings(WS_TRUST_TOKEN_CLAIMS=True):
+            self.assertEqual((await get_user_for_token(token)).id, user_id)
+
+
+class CodecTests(SimpleTestCase):
+    payload = {"type": "room_snapshot", "data": {"room_id": "ROOM01", "username": "Zoë", "called": [3, 1]}}
+
+    def fake_orjson(self):
+        # orjson returns bytes; the codec must hand frames on as text.
+        return SimpleNamespace(dumps=lambda content: json.dumps(content, ensure_ascii=False).encode())
+
+    def assertEncodes(self, dumps):
+        text = dumps(self.payload)
+        self.assertIsInstance(text, str)
+        self.assertIn("Zoë", text)
+        self.assertEqual(json.loads(text), self.payload)
+
+    def test_auto_prefers_orjson(self):
+        with mock.patch.dict(sys.modules, {"orjson": self.fake_orjson()}):
+            dumps = get_dumps("auto")
+            self.assertEncodes(dumps)
+        self.assertNotEqual(dumps, _json_dumps)
+
+    def test_auto_falls_back_to_ujson(self):
+        fake_ujson = SimpleNamespace(dumps=mock.Mock(side_effect=lambda content, **kwargs: json.dumps(content, **kwargs)))
+        with mock.patch.dict(sys.modules, {"orjson": None, "ujson": fake_ujson}):
+            self.assertEncodes(get_dumps("auto"))
+        fake_ujson.dumps.assert_called_once_with(self.payload, ensure_ascii=False)
+
+    def test_auto_falls_back_to_the_standard_library(self):
+        with mock.patch.dict(sys.modules, {"orjson": None, "ujson": None}):
+            dumps = get_dumps("auto")
+        self.assertIs(dumps, _json_dumps)
+        self.assertEncodes(dumps)
+        self.assertEqual(dumps([1, 2]), "[1,2]")
+
+    def test_named_codec_must_be_installed(self):
+        with mock.patch.dict(sys.modules, {"orjson": None}):
+            with self.assertRaises(ImportError):
+                get_dumps("orjson")
+        with override_settings(WS_JSON_CODEC="json"):
+            self.assertIs(get_dumps(), _json_dumps)
+
+
+class SnapshotCacheTests(SimpleTestCase):
+    def test_build_racing_a_mutation_is_not_stored(self):
+        cache = SnapshotCache()
+        version = cache.version("ROOM01")
+        cache.invalidate("ROOM01")
+        self.assertFalse(cache.set("ROOM01", version, {"status": "WAITING"}))
+        self.assertIsNone(cache.get("ROOM01"))
+
+    def test_snapshot_is_reused_until_invalidated(self):
+        cache = SnapshotCache()
+        cache.set("ROOM01", cache.version("ROOM01"), {"status": "WAITING"})
+        self.assertEqual(cache.get("ROOM01"), {"status": "WAITING"})
+        cache.invalidate("ROOM01")
+        self.assertIsNone(cache.get("ROOM01"))
+
+    def test_frame_is_encoded_once_per_version(self):
+        cache = SnapshotCache()
+        snapshot = {"status": "WAITING"}
+        cache.set("ROOM01", cache.version("ROOM01"), snapshot)
+        calls = []
+
+        def encode(message):
+            calls.append(message)
+            return "frame"
+
+        cache.frame("ROOM01", snapshot, encode)
+        cache.frame("ROOM01", snapshot, encode)
+        self.assertEqual(len(calls), 1)
+
+
+class RoomCommandQueueTests(SimpleTestCase):
+    async def test_commands_for_a_room_run_one_at_a_time(self):
+        queues = RoomCommandQueues()
+        running = []
+        order = []
+
+        async def command(name):
+            running.append(name)
+            self.assertEqual(len(running), 1)
+            await asyncio.sleep(0)
+            order.append(name)
+            running.remove(name)
+
+        await asyncio.gather(*(queues.run("room", partial(command, idx)) for idx in range(5)))
+        self.assertEqual(order, list(range(5)))
+        stats = queues.stats()["rooms"]["room"]
+        self.assertEqual((stats["depth"], stats["max_depth"], stats["commands"]), (0, 5, 5))
+
+    def test_stale_moves_are_rejected_from_the_cached_snapshot(self):
+        snapshot = {
+            "status": GameStatus.STARTED,
+            "current_turn_player_id": 1,
+            "turn_deadline": None,
+            "called_numbers": [7],
+        }
+        consumer = BingoRoomConsumer()
+        with self.assertRaisesMessage(ValueError, "Not your turn"):
+            consumer._check_move(snapshot, 2, 5)
+        with self.assertRaisesMessage(ValueError, "Number already eliminated"):
+            consumer._check_move(snapshot, 1, 7)
+        consumer._check_move(snapshot, 1, 5)
+        consumer._check_move(snapshot, 2, 99)
+
+        snapshot["called_numbers"] = [1, None, None, None, None, None, None, None, None]
+        with self.assertRaisesMessage(ValueError, "Cell already occupied"):
+            TttRoomConsumer()._check_move(snapshot, 1, 0)
+
+
+SQLITE_TEST_PRAGMAS = {"journal_mode": "WAL", "synchronous": "NORMAL", "busy_timeout": 20000, "mmap_size": 1 << 20}
+
+
+@override_settings(SQLITE_PRAGMAS=SQLITE_TEST_PRAGMAS)
+class SqliteConcurrentModeTests(SimpleTestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+
+    def wrapper(self):
+        settings_dict = {
+            **connection.settings_dict,
+            "NAME": self.path,
+            "OPTIONS": {"transaction_mode": "IMMEDIATE", "timeout": 20},
+        }
+        return DatabaseWrapper(settings_dict, alias="sqlite_stress")
+
+    def test_new_connections_get_the_pragmas(self):
+        db = self.wrapper()
+        try:
+            with db.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode")
+                self.assertEqual(cursor.fetchone()[0], "wal")
+                cursor.execute("PRAGMA busy_timeout")
+                self.assertEqual(cursor.fetchone()[0], 20000)
+        finally:
+            db.close()
+
+    def test_parallel_read_modify_write_transactions_all_commit(self):
+        setup = self.wrapper()
+        with setup.cursor() as cursor:
+            cursor.execute("CREATE TABLE room (id INTEGER PRIMARY KEY, moves INTEGER NOT NULL)")
+            cursor.executemany("INSERT INTO room (id, moves) VALUES (%s, 0)", [(idx,) for idx in range(20)])
+        setup.close()
+        errors = []
+
+        def play(room):
+            db = self.wrapper()
+            try:
+                for _ in range(10):
+                    # Read then write in one transaction, like a move does.
+                    with db.cursor() as cursor:
+                        cursor.execute("BEGIN IMMEDIATE")
+                        cursor.execute("SELECT moves FROM room WHERE id = %s", [room])
+                        moves = cursor.fetchone()[0]
+                        cursor.execute("UPDATE room SET moves = %s WHERE id = %s", [moves + 1, room])
+                        cursor.execute("COMMIT")
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                db.close()
+
+        threads = [threading.Thread(target=play, args=(room,)) for room in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        check = self.wrapper()
+        with check.cursor() as cursor:
+            cursor.execute("SELECT SUM(moves) FROM room")
+            self.assertEqual(cursor.fetchone()[0], 200)
+        check.close()
+
+
+class RoomWriterPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.pool = RoomWriterPool(size=4)
+
+    def rooms_on_different_threads(self):
+        first = "ROOM00"
+        other = next(
+            f"ROOM{idx:02d}" for idx in range(1, 100)
+            if self.pool.partition(f"ROOM{idx:02d}") is not self.pool.partition(first)
+        )
+        return first, other
+
+    @override_settings(ROOM_WRITE_THREADS=4)
+    def test_deferred_sqlite_gets_a_single_writer(self):
+        options = {**connection.settings_dict.get("OPTIONS", {})}
+        options.pop("transaction_mode", None)
+        with mock.patch.dict(connection.settings_dict, {"OPTIONS": options}):
+            with self.assertLogs("core.writers", "WARNING"):
+                self.assertEqual(len(RoomWriterPool().partitions), 1)
+        with mock.patch.dict(connection.settings_dict, {"OPTIONS": {**options, "transaction_mode": "IMMEDIATE"}}):
+            self.assertEqual(len(RoomWriterPool().partitions), 4)
+
+    async def test_a_room_always_uses_the_same_thread(self):
+        names = {await self.pool.run("ROOM01", lambda: threading.current_thread().name) for _ in range(5)}
+        self.assertEqual(len(names), 1)
+
+    async def test_other_rooms_progress_while_one_is_blocked(self):
+        blocked, other = self.rooms_on_different_threads()
+        release = threading.Event()
+        stuck = asyncio.ensure_future(self.pool.run(blocked, release.wait, 5))
+        await asyncio.sleep(0.01)
+        self.assertEqual(await self.pool.run(other, lambda: "done"), "done")
+        stats = self.pool.stats()
+        self.assertEqual((stats["threads"], stats["busy"]), (4, 1))
+        release.set()
+        await stuck
+        self.assertEqual(self.pool.stats()["completed"], 2)
+
+
+class LoadtestSmokeTests(SimpleTestCase):
+    def test_one_room_of_each_game_plays_without_errors(self):
+        # A separate process: the command creates and drops its own database.
+        result = subprocess.run(
+            [sys.executable, "manage.py", "loadtest", "--bingo-rooms", "1", "--oxo-rooms", "1", "--max-errors", "0"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            timeout=300,
+        )
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        self.assertIn("games completed    2 ", result.stdout)
+
+
+class ActionMetricsTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.metrics = ActionMetrics(enabled=True, slow_ms=100, clock=self.clock)
+        self.queues = RoomCommandQueues()
+
+    async def action(self, seconds=0.0):
+        await self.queues.run("room", lambda: asyncio.sleep(0))
+        count_query(lambda *args: None, "SELECT 1", None, False, {})
+        add_sent('{"type":"room_snapshot"}')
+        self.clock.advance(seconds)
+        return "done"
+
+    async def test_records_wall_time_queries_and_bytes(self):
+        self.assertEqual(await self.metrics.run("bingo", "mark_number", self.action), "done")
+        text = "\n".join(self.metrics.prometheus())
+        self.assertIn('room_action_seconds_count{game="bingo",action="mark_number"} 1', text)
+        self.assertIn('room_action_queries_total{game="bingo",action="mark_number"} 1', text)
+        self.assertIn('room_action_sent_bytes_total{game="bingo",action="mark_number"} 24', text)
+        self.assertIn('room_action_errors_total{game="bingo",action="mark_number"} 0', text)
+
+    async def test_counts_errors_and_buckets_unknown_actions(self):
+        async def failing():
+            mark_error()
+
+        await self.metrics.run("oxo", "dance", failing)
+        self.assertIn('room_action_errors_total{game="oxo",action="unknown"} 1', self.metrics.prometheus())
+
+    async def test_logs_slow_actions(self):
+        with self.assertLogs("core.metrics", "WARNING") as logs:
+            await self.metrics.run("bingo", "start_game", partial(self.action, 0.25))
+        self.assertIn("Slow bingo start_game: 250.0 ms", logs.output[0])
+
+    async def test_disabled_records_nothing(self):
+        metrics = ActionMetrics(enabled=False, slow_ms=0, clock=self.clock)
+        self.assertEqual(await metrics.run("bingo", "mark_number", self.action), "done")
+        self.assertNotIn("room_action_seconds_count", "\n".join(metrics.prometheus()))
+
+
+class RoomReaperTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f"reaper{idx}") for idx in range(2)]
+        self.now = django_timezone.now()
+
+    def room(self, room_id, status, idle_minutes):
+        room = Room.objects.create(
+            room_id=room_id, owner=self.users[0], game_type=GameType.OXO, status=status, winner_order=[self.users[1].id]
+        )
+        for order, user in enumerate(self.users, start=1):
+            RoomPlayer.objects.create(room=room, user=user, turn_order=order)
+        Room.objects.filter(pk=room.pk).update(updated_at=self.now - timedelta(minutes=idle_minutes))
+        return room
+
+    def test_expires_idle_rooms_and_archives_ended_ones(self):
+        self.room("WAIT01", GameStatus.WAITING, 120)
+        self.room("WAIT02", GameStatus.WAITING, 5)
+        self.room("LIVE01", GameStatus.STARTED, 60)
+        ended = self.room("DONE01", GameStatus.ENDED, 30)
+        self.room("DONE02", GameStatus.ENDED, 5)
+        result = GameResult.objects.create(room=ended, game_type=GameType.OXO)
+
+        pauses = []
+        with mock.patch("core.reaper.publish_closed", mock.AsyncMock()) as closed:
+            with self.captureOnCommitCallbacks(execute=True):
+                counts = reap_rooms(now=self.now, batch_size=1, sleep=pauses.append)
+
+        self.assertEqual(counts, {"expired_waiting": 1, "expired_started": 1, "archived": 1})
+        self.assertEqual(len(pauses), 3)
+        self.assertEqual(
+            dict(Room.objects.values_list("room_id", "status")),
+            {"WAIT02": GameStatus.WAITING, "LIVE01": GameStatus.ENDED, "DONE02": GameStatus.ENDED},
+        )
+        self.assertFalse(RoomPlayer.objects.filter(room__room_id__in=["WAIT01", "DONE01"]).exists())
+        archived = ArchivedRoom.objects.get()
+        self.assertEqual((archived.room_id, archived.players), ("DONE01", [user.id for user in self.users]))
+        self.assertEqual(archived.winner_order, [self.users[1].id])
+        self.assertIsNone(GameResult.objects.get(pk=result.pk).room)
+        # The deleted lobby room is taken off lobby sockets.
+        self.assertEqual([call.args[1:] for call in closed.await_args_list], [("WAIT01", GameType.OXO)])
+
+    def test_expired_games_end_on_their_sockets_and_fence_off_their_engine(self):
+        room = started_bingo_room("IDLE01", self.users)
+        self.room("IDLE02", GameStatus.STARTED, 60)
+        # Another process's engine holding a move it has not written yet.
+        other = RoomEngine()
+        state = other.load("IDLE01")
+        state.apply_move(self.users[0].id, 7)
+        Room.objects.filter(pk=room.pk).update(updated_at=self.now - timedelta(minutes=60))
+        state.updated_at = Room.objects.get(pk=room.pk).updated_at
+
+        layer = mock.Mock(group_send=mock.AsyncMock())
+        with mock.patch("core.reaper.get_channel_layer", return_value=layer):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(reap_rooms(now=self.now)["expired_started"], 2)
+        with self.assertRaises(StaleRoomState):
+            other.flush(state)
+        room.refresh_from_db()
+        self.assertEqual((room.status, bytes(room.called_sequence)), (GameStatus.ENDED, b""))
+
+        # Abandoned games are not scored.
+        self.assertFalse(GameResult.objects.exists())
+        sent = {call.args[0]: json.loads(call.args[1]["text"]) for call in layer.group_send.await_args_list}
+        self.assertEqual(set(sent), {"bingo_room_IDLE01", "ttt_room_IDLE02"})
+        self.assertEqual(sent["bingo_room_IDLE01"]["type"], "game_ended")
+        self.assertEqual(sent["bingo_room_IDLE01"]["data"]["status"], GameStatus.ENDED)
+
+
+class RoomIdAllocationTests(TransactionTestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username="owner")
+
+    def test_retries_a_taken_id_without_checking_first(self):
+        create_room_with_id(generate=lambda: "TAKEN1", owner=self.owner)
+        ids = iter(["TAKEN1", "FRESH1"])
+        # The failed insert and its savepoint, then the second insert.
+        with self.assertNumQueries(6):
+            room = create_room_with_id(generate=lambda: next(ids), owner=self.owner)
+        self.assertEqual(room.room_id, "FRESH1")
+
+    def test_gives_up_after_the_last_attempt(self):
+        create_room_with_id(generate=lambda: "TAKEN1", owner=self.owner)
+        with self.assertRaises(IntegrityError):
+            create_room_with_id(generate=lambda: "TAKEN1", attempts=3, owner=self.owner)
+
+    def test_a_collision_inside_a_transaction_leaves_it_usable(self):
+        create_room_with_id(generate=lambda: "TAKEN1", owner=self.owner)
+        ids = iter(["TAKEN1", "FRESH1"])
+        with transaction.atomic():
+            room = create_room_with_id(generate=lambda: next(ids), owner=self.owner)
+            RoomPlayer.objects.create(room=room, user=self.owner, turn_order=1)
+        self.assertTrue(RoomPlayer.objects.filter(room__room_id="FRESH1").exists())
+
+    def test_parallel_creates_get_distinct_ids(self):
+        # Every create draws a taken id first, then two-character ids, of which
+        # there are only 1296, so the threads also collide with each other.
+        create_room_with_id(generate=lambda: "TAKEN1", owner=self.owner)
+        draws = []
+
+        def taken_first():
+            first = iter(["TAKEN1"])
+
+            def generate():
+                draws.append(None)
+                return next(first, None) or generate_room_id(2)
+
+            return generate
+
+        errors = []
+        # The shared in-memory SQLite test database fails a second writer
+        # outright instead of waiting, so there the inserts take turns.
+        writer = threading.Lock() if connection.vendor == "sqlite" else contextlib.nullcontext()
+
+        def create(_):
+            try:
+                for _ in range(10):
+                    with writer:
+                        create_room_with_id(generate=taken_first(), attempts=50, owner_id=self.owner.id)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=create, args=(idx,)) for idx in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Room.objects.values("room_id").distinct().count(), 81)
+        self.assertGreaterEqual(len(draws), 160)
+
+
+class RoomReadQueryTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f"reader{idx}") for idx in range(6)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[-1])
+
+    def room(self, room_id, player_count, max_players=5):
+        room = Room.objects.create(room_id=room_id, owner=self.users[0], max_players=max_players)
+        for order, user in enumerate(self.users[:player_count], start=1):
+            RoomPlayer.objects.create(room=room, user=user, turn_order=order, board_numbers=list(range(1, 26)))
+        return room
+
+    def test_plain_dict_matches_the_serializer(self):
+        room = self.room("SAME01", 3)
+        Room.objects.filter(pk=room.pk).update(
+            status=GameStatus.STARTED,
+            current_turn_player=self.users[1],
+            turn_deadline=django_timezone.now(),
+            called_sequence=bytes([4, 9]),
+        )
+        room = room_read_queryset().get(pk=room.pk)
+        self.assertEqual(room_data(room), RoomSerializer(room).data)
+
+    def test_room_detail_queries_do_not_grow_with_players(self):
+        self.room("FEW001", 2)
+        self.room("MANY01", 5)
+        with self.assertNumQueries(2):
+            few = self.client.get("/rooms/FEW001/")
+        with self.assertNumQueries(2):
+            many = self.client.get("/rooms/MANY01/")
+        self.assertEqual((few.data["current_players"], len(many.data["players"])), (2, 5))
+
+    def test_join_queries_do_not_grow_with_players(self):
+        self.room("FEW001", 1)
+        self.room("MANY01", 4, max_players=6)
+        with self.assertNumQueries(5):
+            self.client.post("/rooms/join/", {"room_id": "FEW001"}, format="json")
+        with self.assertNumQueries(5):
+            response = self.client.post("/rooms/join/", {"room_id": "MANY01"}, format="json")
+        self.assertEqual([player["turn_order"] for player in response.data["players"]], [1, 2, 3, 4, 5])
+
+
+class CalledSequenceTests(TestCase):
+    def test_memoryview_sequences_read_like_bytes(self):
+        users = [User.objects.create(username=f"seq{idx}") for idx in range(2)]
+        room = started_bingo_room("SEQ001", users, called=b"\x03\x01")
+        self.assertEqual(bytes(Room.objects.get(pk=room.pk).called_sequence), b"\x03\x01")
+
+        # Postgres hands BinaryField values back as memoryview.
+        room.called_sequence = memoryview(b"\x03\x01")
+        self.assertEqual(room.current_called_numbers, [3, 1])
+        state = RoomState(room, list(room.players.select_related("user").order_by("turn_order")))
+        self.assertEqual(list(state.called_numbers), [3, 1])
+        self.assertEqual(state.called_mask, 1 << 1 | 1 << 3)
+
+    def test_bench_counts_the_bytes_each_update_sends(self):
+        out = io.StringIO()
+        call_command("bench_move_bytes", players=2, moves=3, seed=4, stdout=out)
+        random.seed(4)
+        called = random.sample(range(1, 26), 3)
+        # A JSONField sends the list as json.dumps text, once per row.
+        self.assertIn(f"   3 {len(json.dumps(called)) * 3:>18} {3:>12}", out.getvalue().splitlines())
+        self.assertFalse(Room.objects.exists())
+
+
+class CalledSequenceMigrationTests(TransactionTestCase):
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([("core", target)])
+        return executor.loader.project_state([("core", target)]).apps
+
+    def test_0004_packs_and_unpacks_called_numbers(self):
+        latest = MigrationExecutor(connection).loader.graph.leaf_nodes("core")[0][1]
+        self.addCleanup(self.migrate, latest)
+        apps = self.migrate("0003_game_results")
+        user = apps.get_model("auth", "User").objects.create(username="packed")
+        OldRoom = apps.get_model("core", "Room")
+        bingo = OldRoom.objects.create(room_id="PACK01", owner=user, game_type="BINGO", called_numbers=[5, 9, 30, "x", 2])
+        oxo = OldRoom.objects.create(room_id="PACK02", owner=user, game_type="OXO", called_numbers=[1, None, 2])
+        apps.get_model("core", "RoomPlayer").objects.create(
+            room=bingo, user=user, turn_order=1, eliminated_numbers=[5, 9, 2]
+        )
+
+        apps = self.migrate("0004_room_called_sequence")
+        NewRoom = apps.get_model("core", "Room")
+        self.assertEqual(bytes(NewRoom.objects.get(pk=bingo.pk).called_sequence), b"\x05\x09\x02")
+        self.assertEqual(NewRoom.objects.get(pk=bingo.pk).called_numbers, [])
+        self.assertEqual(NewRoom.objects.get(pk=oxo.pk).called_numbers, [1, None, 2])
+
+        apps = self.migrate("0003_game_results")
+        self.assertEqual(apps.get_model("core", "Room").objects.get(pk=bingo.pk).called_numbers, [5, 9, 2])
+        player = apps.get_model("core", "RoomPlayer").objects.get(room_id=bingo.pk)
+        self.assertEqual(player.eliminated_numbers, [5, 9, 2])
+
+
+class LobbyTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f"lobby{idx}") for idx in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[-1])
+
+    def room(self, room_id, game_type=GameType.BINGO, players=1, max_players=5, status=GameStatus.WAITING):
+        room = Room.objects.create(
+            room_id=room_id, owner=self.users[0], game_type=game_type, max_players=max_players, status=status
+        )
+        for order, user in enumerate(self.users[:players], start=1):
+            RoomPlayer.objects.create(room=room, user=user, turn_order=order)
+        return room
+
+    def test_lists_open_rooms_newest_first_one_page_at_a_time(self):
+        for idx in range(3):
+            self.room(f"OPEN0{idx}")
+        self.room("FULL01", game_type=GameType.OXO, players=2, max_players=2)
+        self.room("LIVE01", players=2, status=GameStatus.STARTED)
+        self.room("DUEL01", game_type=GameType.OXO)
+
+        with self.assertNumQueries(1):
+            page = self.client.get("/rooms/open/", {"game_type": "bingo", "limit": 2}).data
+        self.assertEqual([room["room_id"] for room in page["results"]], ["OPEN02", "OPEN01"])
+        rest = self.client.get("/rooms/open/", {"game_type": "bingo", "cursor": page["next"]}).data
+        self.assertEqual(([room["room_id"] for room in rest["results"]], rest["next"]), (["OPEN00"], None))
+
+        everything = self.client.get("/rooms/open/").data["results"]
+        self.assertEqual([room["room_id"] for room in everything], ["DUEL01", "OPEN02", "OPEN01", "OPEN00"])
+        self.assertEqual(self.client.get("/rooms/open/", {"game_type": "chess"}).status_code, 400)
+
+    def test_joining_the_last_seat_removes_the_room_from_the_lobby(self):
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(lobby_group(GameType.OXO), channel)
+        self.room("DUEL01", game_type=GameType.OXO, max_players=2)
+
+        self.client.post("/rooms/join/", {"room_id": "DUEL01"}, format="json")
+        message = json.loads(async_to_sync(layer.receive)(channel)["text"])
+        self.assertEqual((message["room_id"], message["room"]), ("DUEL01", None))
+
+    async def test_lobby_socket_gets_changes_for_its_game_type(self):
+        communicator = WebsocketCommunicator(LobbyConsumer.as_asgi(), "/ws/lobby/?game_type=oxo")
+        communicator.scope["user"] = self.users[0]
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        layer = get_channel_layer()
+        await publish_closed(layer, "GAME01", GameType.BINGO)
+        await publish_closed(layer, "DUEL01", GameType.OXO)
+        self.assertEqual((await communicator.receive_json_from())["room_id"], "DUEL01")
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+
+class MatchmakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.matchmaker = Matchmaker(fill_wait=5.0, clock=self.clock)
+
+    def test_seats_full_rooms_first_and_short_bingo_rooms_after_the_wait(self):
+        for user_id in range(1, 8):
+            self.matchmaker.enqueue(user_id, GameType.BINGO)
+        for user_id in range(10, 13):
+            self.matchmaker.enqueue(user_id, GameType.OXO)
+
+        self.assertEqual(
+            self.matchmaker.take_matches(),
+            [(GameType.BINGO, [1, 2, 3, 4, 5]), (GameType.OXO, [10, 11])],
+        )
+        self.clock.advance(5)
+        self.assertEqual(self.matchmaker.take_matches(), [(GameType.BINGO, [6, 7])])
+        self.assertEqual((self.matchmaker.depth(GameType.BINGO), self.matchmaker.depth(GameType.OXO)), (0, 1))
+
+    def test_a_user_waits_in_one_queue_at_a_time(self):
+        self.matchmaker.enqueue(1, GameType.BINGO)
+        self.assertEqual(self.matchmaker.enqueue(1, GameType.OXO), 1)
+        self.assertEqual(self.matchmaker.depth(GameType.BINGO), 0)
+        self.matchmaker.enqueue(2, GameType.OXO)
+        self.matchmaker.cancel(2)
+        self.assertEqual(self.matchmaker.take_matches(), [])
+
+    def test_only_the_socket_that_queued_leaves_the_queue_on_close(self):
+        self.matchmaker.enqueue(1, GameType.OXO, "socket-a")
+        self.matchmaker.cancel(1, "socket-b")
+        self.assertEqual(self.matchmaker.depth(GameType.OXO), 1)
+        # Queueing again from another socket hands the entry to it.
+        self.matchmaker.enqueue(1, GameType.OXO, "socket-b")
+        self.matchmaker.cancel(1, "socket-a")
+        self.assertEqual(self.matchmaker.depth(GameType.OXO), 1)
+        self.matchmaker.cancel(1, "socket-b")
+        self.assertEqual(self.matchmaker.depth(GameType.OXO), 0)
+
+    def test_failed_batch_goes_back_to_the_front(self):
+        self.matchmaker.enqueue(1, GameType.OXO)
+        self.matchmaker.enqueue(2, GameType.OXO)
+        matches = self.matchmaker.take_matches()
+        self.matchmaker.enqueue(3, GameType.OXO)
+        self.matchmaker.requeue(matches)
+        self.assertEqual(self.matchmaker.take_matches(), [(GameType.OXO, [1, 2])])
+
+    async def test_rooms_are_written_on_the_matchmaking_writer(self):
+        self.matchmaker.enqueue(1, GameType.OXO)
+        self.matchmaker.enqueue(2, GameType.OXO)
+        locked = mock.AsyncMock(side_effect=OperationalError("database is locked"))
+        with mock.patch("core.matchmaking.writers.run", locked), self.assertRaises(OperationalError):
+            await self.matchmaker.form_rooms()
+        locked.assert_awaited_once_with("matchmaking", create_match_rooms, [(GameType.OXO, [1, 2])])
+        self.assertEqual(self.matchmaker.depth(GameType.OXO), 2)
+
+
+class MatchRoomCreationTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f"queued{idx}") for idx in range(12)]
+
+    def test_a_batch_is_two_inserts_whatever_its_size(self):
+        ids = [user.id for user in self.users]
+        matches = [(GameType.BINGO, ids[:5]), (GameType.BINGO, ids[5:8])] + [
+            (GameType.OXO, ids[idx : idx + 2]) for idx in range(8, 12, 2)
+        ]
+        with self.assertNumQueries(4):
+            room_ids = create_match_rooms(matches)
+
+        rooms = {room.room_id: room for room in room_read_queryset().filter(room_id__in=room_ids)}
+        first = rooms[room_ids[0]]
+        self.assertEqual((first.owner_id, first.max_players, first.status), (ids[0], 5, GameStatus.WAITING))
+        self.assertEqual([entry.user_id for entry in first.players.all()], ids[:5])
+        self.assertEqual(len(first.players.all()[0].board_numbers), 25)
+        self.assertEqual([entry.turn_order for entry in rooms[room_ids[3]].players.all()], [1, 2])
+
+
+class FakeViewer:
+    def __init__(self):
+        self.frames = []
+
+    async def send(self, text_data=None):
+        self.frames.append(text_data)
+
+
+class SpectatorHubTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.hub = SpectatorHub(rate=5, clock=self.clock, autostart=False)
+        self.builds = 0
+
+    async def build(self):
+        self.builds += 1
+        return f"frame {self.builds}"
+
+    def test_view_hides_the_boards(self):
+        snapshot = {"status": "STARTED", "players": [{"user_id": 1, "board_numbers": [1, 2, 3], "rank": None}]}
+        self.assertEqual(spectator_view(snapshot)["players"], [{"user_id": 1, "rank": None}])
+
+    async def test_bursts_of_changes_are_coalesced_and_shared(self):
+        viewers = [FakeViewer() for _ in range(3)]
+        self.assertEqual(await self.hub.watch("bingo_room_ROOM01", "ROOM01", viewers[0], self.build, "frame 0"), "frame 0")
+        for viewer in viewers[1:]:
+            self.assertEqual(await self.hub.watch("bingo_room_ROOM01", "ROOM01", viewer, self.build), "frame 0")
+        self.assertEqual(self.builds, 0)
+
+        for _ in range(5):
+            self.hub.changed("bingo_room_ROOM01")
+        # The first change goes out at once; the rest wait for the next slot.
+        self.assertEqual(await self.hub.flush_due(), 1)
+        self.hub.changed("bingo_room_ROOM01")
+        self.clock.advance(0.1)
+        self.assertEqual(await self.hub.flush_due(), 0)
+        self.clock.advance(0.1)
+        self.assertEqual(await self.hub.flush_due(), 1)
+        self.assertEqual(self.builds, 2)
+        self.assertEqual([viewer.frames for viewer in viewers], [["frame 1", "frame 2"]] * 3)
+
+        for viewer in viewers:
+            await self.hub.leave("bingo_room_ROOM01", viewer)
+        self.assertEqual(self.hub.viewers("bingo_room_ROOM01"), 0)
+
+    async def test_rooms_watched_in_another_process_are_poked(self):
+        backend = LocalLeaseBackend(clock=self.clock)
+        watching = SpectatorHub(backend, clock=self.clock, autostart=False)
+        playing = SpectatorHub(backend, clock=self.clock, autostart=False)
+        self.assertFalse(await playing.watched("bingo_room_ROOM01"))
+
+        viewer = FakeViewer()
+        await watching.watch("bingo_room_ROOM01", "ROOM01", viewer, self.build)
+        # The earlier lookup is trusted until it expires.
+        self.assertFalse(await playing.watched("bingo_room_ROOM01"))
+        self.clock.advance(WATCHED_LOOKUP_SECONDS)
+        self.assertTrue(await playing.watched("bingo_room_ROOM01"))
+        await watching.leave("bingo_room_ROOM01", viewer)
+
+    async def test_unwatched_rooms_are_not_poked(self):
+        consumer = BingoRoomConsumer()
+        consumer.channel_layer = mock.Mock(group_send=mock.AsyncMock())
+        with mock.patch("core.consumers.spectators", self.hub):
+            await consumer._poke_spectators("bingo_room_ROOM01", "ROOM01")
+            consumer.channel_layer.group_send.assert_not_called()
+
+            viewer = FakeViewer()
+            await self.hub.watch("bingo_room_ROOM01", "ROOM01", viewer, self.build)
+            await consumer._poke_spectators("bingo_room_ROOM01", "ROOM01")
+            consumer.channel_layer.group_send.assert_called_once()
+            await self.hub.leave("bingo_room_ROOM01", viewer)
+
+
+class ReplayLogTests(SimpleTestCase):
+    def setUp(self):
+        self.log = ReplayLog(size=3)
+        for seq in range(1, 5):
+            self.log.record("ROOM01", seq, f"event {seq}", "first", restart=True)
+
+    def test_missed_events_are_replayed_in_order(self):
+        self.assertEqual(self.log.since("ROOM01", "first", 2), ["event 3", "event 4"])
+        self.assertEqual(self.log.since("ROOM01", "first", 4), [])
+        self.assertEqual(self.log.last_seq("ROOM01"), 4)
+
+    def test_gaps_past_the_buffer_need_a_snapshot(self):
+        # Event 1 fell out of the buffer, so a client at 0 cannot catch up.
+        self.assertIsNone(self.log.since("ROOM01", "first", 0))
+        self.assertEqual(self.log.since("ROOM01", "first", 1), ["event 2", "event 3", "event 4"])
+        self.assertIsNone(self.log.since("ROOM01", "first", 5))
+        self.assertIsNone(self.log.since("ROOM02", "first", 0))
+
+    def test_relayed_duplicates_are_ignored_and_restarts_reset(self):
+        self.log.record("ROOM01", 4, "relayed 4", "first")
+        self.assertEqual(self.log.since("ROOM01", "first", 3), ["event 4"])
+
+        self.log.record("ROOM01", 1, "restarted 1", "first", restart=True)
+        self.assertEqual(self.log.since("ROOM01", "first", 0), ["restarted 1"])
+
+        self.log.record("ROOM01", None, "room_snapshot")
+        self.assertIsNone(self.log.since("ROOM01", "first", 1))
+
+    def test_a_new_epoch_starts_the_numbering_over(self):
+        # A reloaded engine numbers from 1 again; a client at 2 of the old
+        # load must not be sent the new load's events 3 and 4.
+        for seq in range(1, 5):
+            self.log.record("ROOM01", seq, f"reloaded {seq}", "second")
+        self.assertIsNone(self.log.since("ROOM01", "first", 2))
+        self.assertEqual(self.log.since("ROOM01", "second", 2), ["reloaded 3", "reloaded 4"])
+
+        epoch = self.log.epoch("ROOM02")
+        self.assertEqual(self.log.epoch("ROOM02"), epoch)
+        self.assertEqual(self.log.since("ROOM02", epoch, 0), [])
+        self.log.clear("ROOM02")
+        self.assertNotEqual(self.log.epoch("ROOM02"), epoch)
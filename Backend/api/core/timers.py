@@ -0,0 +1,133 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# The room's own deadline check is strict, so fire a little after it.
+FIRE_GRACE_SECONDS = 0.1
+LATE_AFTER_SECONDS = 1.0
+
+
+class DeadlineScheduler:
+    """One heap of turn deadlines per process, keyed by room.
+
+    A room has at most one pending deadline; scheduling it again replaces the
+    previous one. A single loop task sleeps until the earliest deadline and
+    starts a task for every entry that is due, so a slow handler never holds
+    up the loop or the rest of its batch.
+    """
+
+    def __init__(self, clock=time.time, grace=FIRE_GRACE_SECONDS, late_after=LATE_AFTER_SECONDS, autostart=True):
+        self.clock = clock
+        self.grace = grace
+        self.late_after = late_after
+        self.autostart = autostart
+        self.fired = 0
+        self.fired_late = 0
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self._running = set()
+
+    @property
+    def pending(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {"pending": self.pending, "fired": self.fired, "fired_late": self.fired_late}
+
+    def schedule(self, key, deadline_iso, handler, delay=0):
+        due = datetime.fromisoformat(deadline_iso).timestamp() + self.grace + delay
+        current = self._entries.get(key)
+        if current is not None and current[1] == deadline_iso and current[2] == handler:
+            return
+
+        token = next(self._counter)
+        self._entries[key] = (token, deadline_iso, handler)
+        heapq.heappush(self._heap, (due, token, key))
+        if self._heap[0][1] == token:
+            self._wake()
+
+    def cancel(self, key):
+        # The heap entry stays behind and is skipped once it surfaces.
+        self._entries.pop(key, None)
+
+    def next_due(self):
+        while self._heap:
+            due, token, key = self._heap[0]
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == token:
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self):
+        now = self.clock()
+        batch = []
+        while self._heap and self._heap[0][0] <= now:
+            due, token, key = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != token:
+                continue
+            del self._entries[key]
+            if now - due > self.late_after:
+                self.fired_late += 1
+            batch.append((key, entry[1], entry[2]))
+        self.fired += len(batch)
+        return batch
+
+    async def fire_due(self):
+        batch = self.pop_due()
+        loop = asyncio.get_running_loop()
+        for entry in batch:
+            task = loop.create_task(self._fire(*entry))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+        return len(batch)
+
+    async def join(self):
+        # Waits for the handlers already started; used by tests and shutdown.
+        while self._running:
+            await asyncio.gather(*self._running)
+
+    async def _fire(self, key, deadline_iso, handler):
+        try:
+            await handler(key, deadline_iso)
+        except Exception:
+            logger.exception("Turn deadline handler failed for %s", key)
+
+    def _wake(self):
+        if not self.autostart:
+            return
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        else:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            due = self.next_due()
+            if due is None:
+                return
+
+            delay = due - self.clock()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self.fire_due()
+
+
+scheduler = DeadlineScheduler()
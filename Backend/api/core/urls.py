@@ -1,5 +1,16 @@
 from django.urls import path
-from .views import create_room, join_room, leaderboard, my_profile, register, room_detail
+from .views import (
+    create_room,
+    join_room,
+    leaderboard,
+    lobby,
+    my_profile,
+    my_rank,
+    prometheus_metrics,
+    register,
+    room_detail,
+    room_metrics,
+)
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 urlpatterns = [
@@ -8,7 +19,11 @@ urlpatterns = [
     path('refresh/', TokenRefreshView.as_view()),
     path('rooms/create/', create_room),
     path('rooms/join/', join_room),
+    path('rooms/open/', lobby),
     path('rooms/<str:room_id>/', room_detail),
     path('profile/', my_profile),
     path('leaderboard/', leaderboard),
+    path('leaderboard/me/', my_rank),
+    path('metrics/rooms/', room_metrics),
+    path('metrics/', prometheus_metrics),
 ]
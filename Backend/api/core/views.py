@@ -1,17 +1,30 @@
 import random
-import string
 
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 
-from django.db import models
-from .models import GameStatus, Profile, Room, RoomPlayer
-from .serializers import CreateRoomSerializer, JoinRoomSerializer, ProfileSerializer, RegisterSerializer, RoomSerializer
+from .cache import room_members, snapshots
+from .codec import dumps
+from .leaderboard import board as leaderboard_board
+from .lobby import LOBBY_MAX_PAGE_SIZE, LOBBY_PAGE_SIZE, open_rooms, publish_room
+from .matchmaking import matchmaker
+from .metrics import actions, append_metric
+from .models import GameStatus, GameType, RoomPlayer
+from .queues import commands
+from .replay import replay
+from .rooms import create_room_with_id, room_read_queryset
+from .serializers import CreateRoomSerializer, JoinRoomSerializer, ProfileSerializer, RegisterSerializer, room_data
+from .spectators import spectator_group, spectators
+from .timers import scheduler
+from .writers import writers
 
 
 @api_view(['POST'])
@@ -24,17 +37,13 @@ def register(request):
     return Response(serializer.errors)
 
 
-def _generate_room_id():
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-
-
 def _build_board():
     numbers = list(range(1, 26))
     random.shuffle(numbers)
     return numbers
 
 
-def _broadcast_room_snapshot(room):
+def _broadcast_room_snapshot(room, data):
     channel_layer = get_channel_layer()
     if channel_layer is None:
         return
@@ -42,12 +51,20 @@ def _broadcast_room_snapshot(room):
     
     payload = {
         "type": "room_snapshot",
-        "data": RoomSerializer(room).data,
+        "data": data,
     }
+    group = f"{prefix}_{room.room_id}"
+    # Sent without a seq, so reconnecting sockets fall back to a snapshot.
+    replay.clear(room.room_id)
     async_to_sync(channel_layer.group_send)(
-        f"{prefix}_{room.room_id}",
-        {"type": "room.event", "payload": payload},
+        group,
+        {"type": "room.event", "text": dumps(payload), "origin": snapshots.origin},
     )
+    if async_to_sync(spectators.watched)(group):
+        async_to_sync(channel_layer.group_send)(
+            spectator_group(group),
+            {"type": "spectator.changed", "room_id": room.room_id, "origin": snapshots.origin},
+        )
 
 
 @api_view(['POST'])
@@ -56,30 +73,30 @@ def create_room(request):
     serializer = CreateRoomSerializer(data=request.data)
     serializer.is_valid(raise_exception=True)
 
-    room_id = _generate_room_id()
-    while Room.objects.filter(room_id=room_id).exists():
-        room_id = _generate_room_id()
-
     game_type = serializer.validated_data.get("game_type", "BINGO")
     max_players = serializer.validated_data["max_players"]
     
     if game_type == "OXO":
         max_players = 2
 
-    room = Room.objects.create(
-        room_id=room_id,
-        owner=request.user,
-        max_players=max_players,
-        game_type=game_type,
-    )
-    RoomPlayer.objects.create(
-        room=room,
-        user=request.user,
-        turn_order=1,
-        board_numbers=_build_board() if game_type == "BINGO" else [],
-    )
-    _broadcast_room_snapshot(room)
-    return Response(RoomSerializer(room).data, status=status.HTTP_201_CREATED)
+    with transaction.atomic():
+        room = create_room_with_id(
+            owner=request.user,
+            max_players=max_players,
+            game_type=game_type,
+        )
+        player = RoomPlayer.objects.create(
+            room=room,
+            user=request.user,
+            turn_order=1,
+            board_numbers=_build_board() if game_type == "BINGO" else [],
+        )
+    room_members.delete((room.room_id, request.user.id))
+    snapshots.invalidate(room.room_id)
+    data = room_data(room, [player])
+    _broadcast_room_snapshot(room, data)
+    publish_room(room, 1)
+    return Response(data, status=status.HTTP_201_CREATED)
 
 
 @api_view(['POST'])
@@ -88,54 +105,136 @@ def join_room(request):
     serializer = JoinRoomSerializer(data=request.data)
     serializer.is_valid(raise_exception=True)
 
-    room = get_object_or_404(Room, room_id=serializer.validated_data["room_id"].upper())
-    if room.status != GameStatus.WAITING:
-        return Response({"detail": "Room already started or ended"}, status=status.HTTP_400_BAD_REQUEST)
-
-    if RoomPlayer.objects.filter(room=room, user=request.user).exists():
-        return Response(RoomSerializer(room).data, status=status.HTTP_200_OK)
+    with transaction.atomic():
+        # Locking the room keeps two joins from taking the same seat.
+        room = get_object_or_404(
+            room_read_queryset().select_for_update(of=("self",)),
+            room_id=serializer.validated_data["room_id"].upper(),
+        )
+        if room.status != GameStatus.WAITING:
+            return Response({"detail": "Room already started or ended"}, status=status.HTTP_400_BAD_REQUEST)
+
+        players = list(room.players.all())
+        if any(entry.user_id == request.user.id for entry in players):
+            return Response(room_data(room, players), status=status.HTTP_200_OK)
+
+        if len(players) >= room.max_players:
+            return Response({"detail": "Room is full"}, status=status.HTTP_400_BAD_REQUEST)
+
+        players.append(
+            RoomPlayer.objects.create(
+                room=room,
+                user=request.user,
+                turn_order=len(players) + 1,
+                board_numbers=_build_board() if room.game_type == "BINGO" else [],
+            )
+        )
+    room_members.delete((room.room_id, request.user.id))
+    snapshots.invalidate(room.room_id)
+    data = room_data(room, players)
+    _broadcast_room_snapshot(room, data)
+    publish_room(room, len(players))
+    return Response(data, status=status.HTTP_200_OK)
 
-    current_players = room.players.count()
-    if current_players >= room.max_players:
-        return Response({"detail": "Room is full"}, status=status.HTTP_400_BAD_REQUEST)
 
-    RoomPlayer.objects.create(
-        room=room,
-        user=request.user,
-        turn_order=current_players + 1,
-        board_numbers=_build_board() if room.game_type == "BINGO" else [],
-    )
-    room.refresh_from_db()
-    _broadcast_room_snapshot(room)
-    return Response(RoomSerializer(room).data, status=status.HTTP_200_OK)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def lobby(request):
+    # Open rooms, newest first; pass "next" back as ?cursor= for the next page.
+    # Changes are pushed on ws/lobby/.
+    game_type = request.query_params.get("game_type", "").upper() or None
+    if game_type is not None and game_type not in GameType.values:
+        return Response({"detail": "Unknown game_type"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        cursor = int(request.query_params.get("cursor", 0))
+        limit = int(request.query_params.get("limit", LOBBY_PAGE_SIZE))
+    except ValueError:
+        return Response({"detail": "Invalid cursor or limit"}, status=status.HTTP_400_BAD_REQUEST)
+    if cursor < 0 or not (1 <= limit <= LOBBY_MAX_PAGE_SIZE):
+        return Response({"detail": "Invalid cursor or limit"}, status=status.HTTP_400_BAD_REQUEST)
+
+    results, next_cursor = open_rooms(game_type, cursor, limit)
+    return Response({"results": results, "next": next_cursor})
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def room_detail(request, room_id):
-    room = get_object_or_404(Room, room_id=room_id.upper())
-    return Response(RoomSerializer(room).data)
+    room = get_object_or_404(room_read_queryset(), room_id=room_id.upper())
+    return Response(room_data(room))
+
+
+def _page_params(request, default_limit=100, max_limit=500):
+    try:
+        offset = int(request.query_params.get("offset", 0))
+        limit = int(request.query_params.get("limit", default_limit))
+    except ValueError:
+        return None
+    if offset < 0 or not (1 <= limit <= max_limit):
+        return None
+    return offset, limit
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def leaderboard(request):
-    # Sort by calculated win rate (wins/total * 100) or 0.0, then by points
-    profiles = Profile.objects.select_related("user").annotate(
-        calculated_win_rate=models.Case(
-            models.When(total_matches=0, then=models.Value(0.0)),
-            default=models.ExpressionWrapper(
-                models.F('wins') * 100.0 / models.F('total_matches'),
-                output_field=models.FloatField()
-            ),
-            output_field=models.FloatField(),
-        )
-    ).order_by("-calculated_win_rate", "-points")
-    
-    return Response(ProfileSerializer(profiles, many=True).data)
+    # Sorted by win rate (wins/total * 100, or 0.0) then points; see core.leaderboard
+    params = _page_params(request)
+    if params is None:
+        return Response({"detail": "Invalid offset or limit"}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(leaderboard_board.page(*params))
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def my_rank(request):
+    entry = leaderboard_board.entry(request.user.id)
+    if entry is None:
+        return Response({"detail": "Not ranked yet"}, status=status.HTTP_404_NOT_FOUND)
+    return Response(entry)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def my_profile(request):
     return Response(ProfileSerializer(request.user.profile).data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def room_metrics(request):
+    # Counters of the process serving the request.
+    return Response(
+        {
+            "queues": commands.stats(),
+            "writers": writers.stats(),
+            "deadlines": scheduler.stats(),
+            "matchmaking": {game_type: matchmaker.depth(game_type) for game_type in GameType.values},
+        }
+    )
+
+
+def prometheus_metrics(request):
+    # Prometheus text format for the process serving the scrape.
+    token = settings.METRICS_TOKEN
+    if not token or request.headers.get("Authorization") != f"Bearer {token}":
+        raise Http404
+
+    lines = actions.prometheus()
+    queues = commands.stats()
+    pool = writers.stats()
+    deadlines = scheduler.stats()
+    append_metric(lines, "room_command_queue_depth", "Room commands waiting or running.", queues["depth"])
+    append_metric(lines, "room_commands_total", "Room commands run.", queues["commands"], "counter")
+    append_metric(lines, "room_writer_threads", "Room writer threads started.", pool["threads"])
+    append_metric(lines, "room_writer_saturation", "Share of room writer threads busy.", pool["saturation"])
+    append_metric(lines, "room_writer_queued", "Writes waiting for their room writer.", pool["queued"])
+    append_metric(lines, "room_writes_total", "Writes run on room writers.", pool["completed"], "counter")
+    append_metric(lines, "turn_deadlines_pending", "Turn deadlines scheduled.", deadlines["pending"])
+    append_metric(lines, "turn_deadlines_fired_total", "Turn deadlines fired.", deadlines["fired"], "counter")
+    append_metric(lines, "turn_deadlines_fired_late_total", "Turn deadlines fired late.", deadlines["fired_late"], "counter")
+    lines.append("# HELP matchmaking_queued Users waiting in a matchmaking queue.")
+    lines.append("# TYPE matchmaking_queued gauge")
+    for game_type in GameType.values:
+        lines.append(f'matchmaking_queued{{game_type="{game_type}"}} {matchmaker.depth(game_type)}')
+    return HttpResponse("\n".join(lines) + "\n", content_type="text/plain; version=0.0.4")
@@ -0,0 +1,143 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from .metrics import add_lock_wait
+
+logger = logging.getLogger(__name__)
+
+ROOM_WRITE_THREADS = 4
+
+
+def deferred_sqlite():
+    """True on SQLite with deferred transactions, the default.
+
+    They take the write lock only on their first write and fail with
+    "database is locked" when another writer holds it, instead of waiting on
+    the busy timeout like IMMEDIATE ones (SQLITE_CONCURRENT).
+    """
+    db = connections["default"]
+    mode = str(db.settings_dict.get("OPTIONS", {}).get("transaction_mode") or "").upper()
+    return db.vendor == "sqlite" and mode != "IMMEDIATE"
+
+
+def default_thread_count():
+    """``ROOM_WRITE_THREADS``, or one on deferred-mode SQLite."""
+    size = getattr(settings, "ROOM_WRITE_THREADS", ROOM_WRITE_THREADS)
+    if size > 1 and deferred_sqlite():
+        logger.warning("ROOM_WRITE_THREADS=%s needs SQLITE_CONCURRENT on SQLite; using one writer thread", size)
+        return 1
+    return size
+
+
+class WriterPartition:
+    __slots__ = ("executor", "queued", "active", "completed", "wait_total", "wait_max")
+
+    def __init__(self, name):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class RoomWriterPool:
+    """Runs database writes on a fixed set of threads, one room per thread.
+
+    A room always maps to the same single-thread partition, so its writes
+    stay ordered while other rooms' writes run on the other threads. Each
+    thread keeps its own database connection.
+    """
+
+    def __init__(self, size=None, clock=time.monotonic):
+        self.size = size
+        self.clock = clock
+        self._partitions = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    @property
+    def partitions(self):
+        if self._partitions is None:
+            with self._lock:
+                if self._partitions is None:
+                    size = self.size or default_thread_count()
+                    self._partitions = [WriterPartition(f"room-writer-{idx}") for idx in range(size)]
+        return self._partitions
+
+    def partition(self, room_id):
+        partitions = self.partitions
+        return partitions[zlib.crc32(room_id.encode()) % len(partitions)]
+
+    async def run(self, room_id, func, *args):
+        partition = self.partition(room_id)
+        queued_at = self.clock()
+        context = contextvars.copy_context()
+
+        def job():
+            waited = self.clock() - queued_at
+            with self._stats_lock:
+                partition.queued -= 1
+                partition.active += 1
+                partition.wait_total += waited
+                partition.wait_max = max(partition.wait_max, waited)
+            context.run(add_lock_wait, waited)
+            # Same connection hygiene as a request: honour CONN_MAX_AGE and
+            # drop connections that errored.
+            close_old_connections()
+            try:
+                return context.run(func, *args)
+            finally:
+                close_old_connections()
+                with self._stats_lock:
+                    partition.active -= 1
+                    partition.completed += 1
+
+        with self._stats_lock:
+            partition.queued += 1
+        return await asyncio.get_running_loop().run_in_executor(partition.executor, job)
+
+    def shutdown(self):
+        # Closes each thread's connections, e.g. before dropping a test database.
+        with self._lock:
+            partitions, self._partitions = self._partitions or [], None
+        for partition in partitions:
+            partition.executor.submit(connections.close_all).result()
+            partition.executor.shutdown()
+
+    def stats(self):
+        partitions = self._partitions or []
+        busy = sum(1 for partition in partitions if partition.active or partition.queued)
+        completed = sum(partition.completed for partition in partitions)
+        wait_total = sum(partition.wait_total for partition in partitions)
+        return {
+            "threads": len(partitions),
+            "busy": busy,
+            "saturation": round(busy / len(partitions), 3) if partitions else 0.0,
+            "queued": sum(partition.queued for partition in partitions),
+            "completed": completed,
+            "wait_avg_ms": round(wait_total / completed * 1000, 3) if completed else 0.0,
+            "wait_max_ms": round(max((p.wait_max for p in partitions), default=0.0) * 1000, 3),
+        }
+
+
+writers = RoomWriterPool()
+
+
+def room_write(method):
+    """Run a consumer's ``method(self, room_id, ...)`` on the room's writer."""
+
+    @functools.wraps(method)
+    async def wrapper(self, room_id, *args):
+        return await writers.run(room_id, method, self, room_id, *args)
+
+    return wrapper
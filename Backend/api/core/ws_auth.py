@@ -3,13 +3,31 @@ from urllib.parse import parse_qs
 from channels.auth import AuthMiddlewareStack
 from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import AccessToken
 
+from .cache import TTLCache
+
+USER_CACHE_TTL_SECONDS = 30
+
+_users = TTLCache(USER_CACHE_TTL_SECONDS)
+
+
+class ClaimsUser(TokenUser):
+    """User built from a validated access token's claims, without a query."""
+
+    @cached_property
+    def id(self):
+        return get_user_model()._meta.pk.to_python(self.token[api_settings.USER_ID_CLAIM])
+
 
 @database_sync_to_async
-def get_user_by_id(user_id):
+def _load_user(user_id):
     user_model = get_user_model()
     try:
         return user_model.objects.get(id=user_id)
@@ -17,6 +35,21 @@ def get_user_by_id(user_id):
         return AnonymousUser()
 
 
+async def get_user_by_id(user_id):
+    user = _users.get(user_id)
+    if user is None:
+        user = await _load_user(user_id)
+        if not user.is_anonymous:
+            _users.set(user_id, user)
+    return user
+
+
+async def get_user_for_token(token):
+    if getattr(settings, "WS_TRUST_TOKEN_CLAIMS", False):
+        return ClaimsUser(token)
+    return await get_user_by_id(token[api_settings.USER_ID_CLAIM])
+
+
 class JWTAuthMiddleware(BaseMiddleware):
     async def __call__(self, scope, receive, send):
         if not scope.get("user") or scope["user"].is_anonymous:
@@ -24,8 +57,7 @@ class JWTAuthMiddleware(BaseMiddleware):
             token = (query.get("token") or [None])[0]
             if token:
                 try:
-                    validated = AccessToken(token)
-                    scope["user"] = await get_user_by_id(validated["user_id"])
+                    scope["user"] = await get_user_for_token(AccessToken(token))
                 except Exception:
                     scope["user"] = AnonymousUser()
         return await super().__call__(scope, receive, send)
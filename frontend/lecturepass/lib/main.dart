@@ -1,7 +1,7 @@
 import "dart:async";
 import "dart:convert";
 
-import "dart:math" show pi, sin, cos;
+import "dart:math" show pi, sin, cos, min;
 import "package:flutter/foundation.dart";
 import "package:flutter/material.dart";
 import "package:flutter/scheduler.dart";
@@ -993,6 +993,69 @@ class _GamifyRoomEntryPageState extends State<GamifyRoomEntryPage> {
   }
 }
 
+// Longest wait between attempts when a room socket keeps dropping.
+const reconnectMaxSeconds = 30;
+
+class BingoRoomEvents {
+  // Folds server messages into a room map: snapshots replace it and deltas are
+  // merged in sequence. Returns null when a delta cannot be applied; the first
+  // such delta sets awaitingSnapshot and the caller should ask for a fresh
+  // room_state. Deltas are dropped until it lands, since they would be merged
+  // onto stale state.
+  int? seq;
+  String? epoch;
+  bool awaitingSnapshot = false;
+
+  // Query parameters for a reconnecting socket, so the server sends only the
+  // events it missed; empty until there is a position to resume from.
+  Map<String, String> get resumeQuery =>
+      seq == null || epoch == null || awaitingSnapshot ? const {} : {"epoch": epoch!, "last_seq": "$seq"};
+
+  Map<String, dynamic>? apply(Map<String, dynamic>? room, Map<String, dynamic> message) {
+    final delta = message["delta"] as Map<String, dynamic>?;
+    if (delta == null) {
+      final data = message["data"] as Map<String, dynamic>?;
+      seq = data?["seq"] as int?;
+      epoch = data?["epoch"] as String?;
+      awaitingSnapshot = false;
+      return data;
+    }
+    if (awaitingSnapshot) return null;
+
+    final next = message["seq"] as int?;
+    if (room == null || (seq != null && next != null && next != seq! + 1)) {
+      seq = null;
+      awaitingSnapshot = true;
+      return null;
+    }
+    seq = next;
+    epoch = message["epoch"] as String? ?? epoch;
+
+    final merged = Map<String, dynamic>.from(room);
+    final players = [
+      for (final p in (room["players"] as List<dynamic>? ?? [])) Map<String, dynamic>.from(p as Map),
+    ];
+    delta.forEach((key, value) {
+      if (key != "players" && key != "number" && key != "called_by") merged[key] = value;
+    });
+    final number = delta["number"];
+    if (number != null) {
+      merged["called_numbers"] = [...(room["called_numbers"] as List<dynamic>? ?? []), number];
+    }
+    for (final change in (delta["players"] as List<dynamic>? ?? [])) {
+      final update = change as Map<String, dynamic>;
+      final idx = players.indexWhere((p) => (p["user_id"] ?? p["user"]) == update["user_id"]);
+      if (idx >= 0) {
+        players[idx].addAll(update);
+      } else {
+        players.add(Map<String, dynamic>.from(update));
+      }
+    }
+    merged["players"] = players;
+    return merged;
+  }
+}
+
 class WaitingRoomPage extends StatefulWidget {
   const WaitingRoomPage({required this.roomId, required this.isOwner, super.key});
 
@@ -1004,9 +1067,12 @@ class WaitingRoomPage extends StatefulWidget {
 }
 
 class _WaitingRoomPageState extends State<WaitingRoomPage> {
+  final _events = BingoRoomEvents();
   Map<String, dynamic>? _room;
   WebSocketChannel? _channel;
   StreamSubscription? _sub;
+  Timer? _retry;
+  int _attempts = 0;
   String? _error;
 
   @override
@@ -1017,6 +1083,7 @@ class _WaitingRoomPageState extends State<WaitingRoomPage> {
 
   @override
   void dispose() {
+    _retry?.cancel();
     _sub?.cancel();
     _channel?.sink.close();
     super.dispose();
@@ -1024,26 +1091,53 @@ class _WaitingRoomPageState extends State<WaitingRoomPage> {
 
   void _connect() {
     final token = Session.accessToken ?? "";
-    final uri = Uri.parse("${ApiConfig.wsBase}/ws/gamify/${widget.roomId}/?token=$token");
+    final resume = _events.resumeQuery;
+    final uri = Uri.parse("${ApiConfig.wsBase}/ws/gamify/${widget.roomId}/")
+        .replace(queryParameters: {"token": token, ...resume});
     _channel = WebSocketChannel.connect(uri);
-    _sub = _channel!.stream.listen(_onMessage, onError: (_) => setState(() => _error = "WebSocket connection error"));
-    _channel!.sink.add(jsonEncode({"action": "room_state"}));
+    _sub = _channel!.stream.listen(
+      _onMessage,
+      onError: (_) => setState(() => _error = "WebSocket connection error"),
+      onDone: _reconnect,
+    );
+    if (resume.isEmpty) _channel!.sink.add(jsonEncode({"action": "room_state"}));
+  }
+
+  void _reconnect() {
+    if (!mounted) return;
+    // 4001 is a bad token and 4003 not a player of the room; retrying will
+    // not change either.
+    final code = _channel?.closeCode;
+    if (code == 4001 || code == 4003) {
+      setState(() => _error = code == 4001 ? "Session expired, sign in again" : "You are not in this room");
+      return;
+    }
+    final delay = Duration(seconds: min(1 << _attempts, reconnectMaxSeconds));
+    if (_attempts < 5) _attempts++;
+    _retry = Timer(delay, () {
+      if (mounted) _connect();
+    });
   }
 
   void _onMessage(dynamic raw) {
+    _attempts = 0;
     final data = jsonDecode(raw as String) as Map<String, dynamic>;
     if (data["type"] == "error") {
       setState(() => _error = data["message"]?.toString());
       return;
     }
-    final roomData = data["data"] as Map<String, dynamic>?;
-    if (roomData == null) return;
+    final awaiting = _events.awaitingSnapshot;
+    final roomData = _events.apply(_room, data);
+    if (roomData == null) {
+      if (!awaiting && _events.awaitingSnapshot) _channel?.sink.add(jsonEncode({"action": "room_state"}));
+      return;
+    }
     setState(() => _room = roomData);
     if (roomData["status"] == "STARTED") {
       Navigator.pushReplacement(
         context,
         MaterialPageRoute(
-          builder: (_) => GamifyGamePage(roomId: widget.roomId, initialRoomData: roomData),
+          builder: (_) => GamifyGamePage(roomId: widget.roomId, initialRoomData: roomData, events: _events),
         ),
       );
     }
@@ -1117,19 +1211,24 @@ class _WaitingRoomPageState extends State<WaitingRoomPage> {
   }
 }
 class GamifyGamePage extends StatefulWidget {
-  const GamifyGamePage({required this.roomId, required this.initialRoomData, super.key});
+  const GamifyGamePage({required this.roomId, required this.initialRoomData, this.events, super.key});
 
   final String roomId;
   final Map<String, dynamic> initialRoomData;
+  // The waiting room's position in the event stream, resumed from here.
+  final BingoRoomEvents? events;
 
   @override
   State<GamifyGamePage> createState() => _GamifyGamePageState();
 }
 
 class _GamifyGamePageState extends State<GamifyGamePage> {
+  late final _events = widget.events ?? BingoRoomEvents();
   late Map<String, dynamic> _room;
   WebSocketChannel? _channel;
   StreamSubscription? _sub;
+  Timer? _retry;
+  int _attempts = 0;
   Timer? _ticker;
   int _secondsLeft = 0;
   String? _error;
@@ -1145,6 +1244,7 @@ class _GamifyGamePageState extends State<GamifyGamePage> {
   @override
   void dispose() {
     _ticker?.cancel();
+    _retry?.cancel();
     _sub?.cancel();
     _channel?.sink.close();
     super.dispose();
@@ -1152,20 +1252,47 @@ class _GamifyGamePageState extends State<GamifyGamePage> {
 
   void _connect() {
     final token = Session.accessToken ?? "";
-    final uri = Uri.parse("${ApiConfig.wsBase}/ws/gamify/${widget.roomId}/?token=$token");
+    final resume = _events.resumeQuery;
+    final uri = Uri.parse("${ApiConfig.wsBase}/ws/gamify/${widget.roomId}/")
+        .replace(queryParameters: {"token": token, ...resume});
     _channel = WebSocketChannel.connect(uri);
-    _sub = _channel!.stream.listen(_onMessage, onError: (_) => setState(() => _error = "WebSocket connection error"));
-    _channel!.sink.add(jsonEncode({"action": "room_state"}));
+    _sub = _channel!.stream.listen(
+      _onMessage,
+      onError: (_) => setState(() => _error = "WebSocket connection error"),
+      onDone: _reconnect,
+    );
+    if (resume.isEmpty) _channel!.sink.add(jsonEncode({"action": "room_state"}));
+  }
+
+  void _reconnect() {
+    if (!mounted) return;
+    // 4001 is a bad token and 4003 not a player of the room; retrying will
+    // not change either.
+    final code = _channel?.closeCode;
+    if (code == 4001 || code == 4003) {
+      setState(() => _error = code == 4001 ? "Session expired, sign in again" : "You are not in this room");
+      return;
+    }
+    final delay = Duration(seconds: min(1 << _attempts, reconnectMaxSeconds));
+    if (_attempts < 5) _attempts++;
+    _retry = Timer(delay, () {
+      if (mounted) _connect();
+    });
   }
 
   void _onMessage(dynamic raw) {
+    _attempts = 0;
     final data = jsonDecode(raw as String) as Map<String, dynamic>;
     if (data["type"] == "error") {
       setState(() => _error = data["message"]?.toString());
       return;
     }
-    final roomData = data["data"] as Map<String, dynamic>?;
-    if (roomData == null) return;
+    final awaiting = _events.awaitingSnapshot;
+    final roomData = _events.apply(_room, data);
+    if (roomData == null) {
+      if (!awaiting && _events.awaitingSnapshot) _channel?.sink.add(jsonEncode({"action": "room_state"}));
+      return;
+    }
     setState(() => _room = roomData);
     _syncTimer();
     if (roomData["status"] == "ENDED") {
@@ -0,0 +1,86 @@
+import 'package:flutter_test/flutter_test.dart';
+
+import 'package:lecturepass/main.dart';
+
+Map<String, dynamic> snapshot(int seq, List<int> called) => {
+      "type": "room_snapshot",
+      "data": {
+        "epoch": "first",
+        "seq": seq,
+        "status": "STARTED",
+        "current_turn_player_id": 1,
+        "called_numbers": called,
+        "players": [
+          {"user_id": 1, "status": "PLAYING", "lines_completed": 0, "rank": null},
+          {"user_id": 2, "status": "PLAYING", "lines_completed": 0, "rank": null},
+        ],
+      },
+    };
+
+Map<String, dynamic> move(int seq, int number, int nextPlayer, {List<Map<String, dynamic>>? players}) => {
+      "type": "turn_changed",
+      "epoch": "first",
+      "seq": seq,
+      "delta": {
+        "status": "STARTED",
+        "current_turn_player_id": nextPlayer,
+        "number": number,
+        "called_by": nextPlayer == 1 ? 2 : 1,
+        if (players != null) "players": players,
+      },
+    };
+
+void main() {
+  test('deltas in sequence are merged onto the snapshot', () {
+    final events = BingoRoomEvents();
+    var room = events.apply(null, snapshot(3, [5]));
+    room = events.apply(room, move(4, 7, 2));
+    room = events.apply(room, move(5, 9, 1, players: [
+      {"user_id": 2, "status": "PLAYING", "lines_completed": 1, "rank": null},
+    ]));
+
+    expect(events.seq, 5);
+    expect(room!["called_numbers"], [5, 7, 9]);
+    expect(room["current_turn_player_id"], 1);
+    expect(room.containsKey("number"), isFalse);
+    final players = room["players"] as List<dynamic>;
+    expect(players[1]["lines_completed"], 1);
+    expect(players[0]["lines_completed"], 0);
+  });
+
+  test('a gap drops deltas until the next snapshot', () {
+    final events = BingoRoomEvents();
+    final room = events.apply(null, snapshot(3, [5]));
+
+    expect(events.apply(room, move(5, 9, 1)), isNull);
+    expect(events.awaitingSnapshot, isTrue);
+    // Would apply cleanly after a reset seq, but the room it has is stale.
+    expect(events.apply(room, move(6, 11, 2)), isNull);
+
+    final fresh = events.apply(room, snapshot(6, [5, 7, 9, 11]));
+    expect(events.awaitingSnapshot, isFalse);
+    final next = events.apply(fresh, move(7, 13, 1));
+    expect(next!["called_numbers"], [5, 7, 9, 11, 13]);
+    expect(events.seq, 7);
+  });
+
+  test('a delta before any room asks for a snapshot', () {
+    final events = BingoRoomEvents();
+    expect(events.apply(null, move(1, 5, 2)), isNull);
+    expect(events.awaitingSnapshot, isTrue);
+  });
+
+  test('the position to resume from follows the events applied', () {
+    final events = BingoRoomEvents();
+    expect(events.resumeQuery, isEmpty);
+
+    final room = events.apply(null, snapshot(3, [5]));
+    expect(events.resumeQuery, {"epoch": "first", "last_seq": "3"});
+    events.apply(room, move(4, 7, 2));
+    expect(events.resumeQuery, {"epoch": "first", "last_seq": "4"});
+
+    // After a gap only a snapshot helps, so there is nothing to resume from.
+    events.apply(room, move(6, 9, 1));
+    expect(events.resumeQuery, isEmpty);
+  });
+}